@@ -0,0 +1,21 @@
+-- store posts creation time as integer epoch and index it for keyset pagination
+
+CREATE TABLE sarafan_posts_new (
+    magnet text primary key,
+    content text not null,
+    created_at integer not null default (CAST(strftime('%s', 'now') AS INTEGER))
+);
+
+INSERT INTO sarafan_posts_new (rowid, magnet, content, created_at)
+    SELECT rowid,
+           magnet,
+           content,
+           COALESCE(CAST(strftime('%s', created_at) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER))
+    FROM sarafan_posts;
+
+DROP TABLE sarafan_posts;
+
+ALTER TABLE sarafan_posts_new RENAME TO sarafan_posts;
+
+-- rowid is implicitly appended to the index, so it is a (created_at, rowid) index
+CREATE INDEX idx_sarafan_posts_feed ON sarafan_posts (created_at);
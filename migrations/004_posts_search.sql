@@ -0,0 +1,53 @@
+-- full-text search index over posts content
+
+CREATE VIRTUAL TABLE sarafan_posts_search USING fts5(
+    content,
+    content='sarafan_posts',
+    content_rowid='rowid'
+);
+
+-- posts existing before this migration are indexed in chunks by the backfill job,
+-- rows in (last_rowid, max_rowid] range are not indexed yet
+CREATE TABLE sarafan_posts_search_backfill (
+    id integer primary key check (id = 1),
+    last_rowid integer not null,
+    max_rowid integer not null
+);
+
+INSERT INTO sarafan_posts_search_backfill (id, last_rowid, max_rowid)
+    SELECT 1, 0, COALESCE(MAX(rowid), 0) FROM sarafan_posts;
+
+-- only indexed rows can be removed from the index
+CREATE VIEW sarafan_posts_search_indexed AS
+    SELECT p.rowid AS rowid, p.magnet AS magnet, p.content AS content
+    FROM sarafan_posts p, sarafan_posts_search_backfill b
+    WHERE p.rowid <= b.last_rowid OR p.rowid > b.max_rowid;
+
+-- INSERT OR REPLACE removes conflicting row without firing delete triggers
+CREATE TRIGGER sarafan_posts_search_before_insert BEFORE INSERT ON sarafan_posts
+BEGIN
+    INSERT INTO sarafan_posts_search (sarafan_posts_search, rowid, content)
+        SELECT 'delete', rowid, content FROM sarafan_posts_search_indexed WHERE magnet = NEW.magnet;
+END;
+
+CREATE TRIGGER sarafan_posts_search_after_insert AFTER INSERT ON sarafan_posts
+BEGIN
+    INSERT INTO sarafan_posts_search (rowid, content) VALUES (NEW.rowid, NEW.content);
+END;
+
+CREATE TRIGGER sarafan_posts_search_before_delete BEFORE DELETE ON sarafan_posts
+BEGIN
+    INSERT INTO sarafan_posts_search (sarafan_posts_search, rowid, content)
+        SELECT 'delete', rowid, content FROM sarafan_posts_search_indexed WHERE rowid = OLD.rowid;
+END;
+
+CREATE TRIGGER sarafan_posts_search_before_update BEFORE UPDATE OF content ON sarafan_posts
+BEGIN
+    INSERT INTO sarafan_posts_search (sarafan_posts_search, rowid, content)
+        SELECT 'delete', rowid, content FROM sarafan_posts_search_indexed WHERE rowid = OLD.rowid;
+END;
+
+CREATE TRIGGER sarafan_posts_search_after_update AFTER UPDATE OF content ON sarafan_posts
+BEGIN
+    INSERT INTO sarafan_posts_search (rowid, content) VALUES (NEW.rowid, NEW.content);
+END;
@@ -0,0 +1,29 @@
+-- replace nested-set comments tree with materialized path
+--
+-- nested-set triggers rewrote lft/rgt of every following comment of the thread on
+-- each insert and delete. With materialized path comment row is written once and
+-- never changed when other comments are added.
+
+DROP TRIGGER IF EXISTS insert_item;
+DROP TRIGGER IF EXISTS delete_item;
+DROP TABLE IF EXISTS p;
+DROP TABLE sarafan_comments;
+
+CREATE TABLE sarafan_comments (
+    -- comment publication magnet
+    magnet text primary key,
+    -- replied post or comment magnet
+    reply_to text not null,
+    -- root post of the thread
+    post_magnet text not null,
+    content text not null,
+    -- path segments of all ancestors and the comment itself separated by `/`,
+    -- ordering by path gives depth-first thread order
+    path text not null,
+    -- 0 for comments replying to the post directly
+    depth integer not null,
+    created_at integer not null default (CAST(strftime('%s', 'now') AS INTEGER))
+);
+
+-- thread and subtree range scans
+CREATE INDEX idx_sarafan_comments_path ON sarafan_comments (post_magnet, path);
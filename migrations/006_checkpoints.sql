@@ -0,0 +1,9 @@
+-- last processed block of every blockchain event stream
+
+CREATE TABLE sarafan_checkpoints (
+    -- stream identifier, contract address
+    stream text primary key,
+    -- all events up to this block (inclusive) are processed
+    block_number integer not null,
+    updated_at integer not null default (CAST(strftime('%s', 'now') AS INTEGER))
+);
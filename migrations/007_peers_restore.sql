@@ -0,0 +1,3 @@
+-- select top rated and recently seen peers on restore without sorting the table
+
+CREATE INDEX idx_sarafan_peers_restore ON sarafan_peers (rating DESC, last_seen DESC);
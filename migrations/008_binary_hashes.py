@@ -0,0 +1,128 @@
+"""
+Store magnets, hashes and addresses as binary values
+
+32 bytes hashes and 20 bytes addresses were stored as hex text, which doubled
+size of the primary key and secondary indexes of publications and posts.
+Tables are recreated with blob columns, existing rows are converted in batches
+keeping their rowids, so the posts search index stays valid.
+"""
+from yoyo import step
+
+__depends__ = {'007_peers_restore'}
+
+#: number of rows converted at once
+BATCH_SIZE = 1000
+
+
+def to_bytes(value):
+    if value is None:
+        return None
+    return bytes.fromhex(value[2:] if value.startswith('0x') else value)
+
+
+def copy_rows(cursor, source, target, columns, converters):
+    """Copy rows from source to target table in rowid order converting values.
+    """
+    select = f"SELECT rowid, {', '.join(columns)} FROM {source} WHERE rowid > ? ORDER BY rowid LIMIT ?"
+    insert = (f"INSERT INTO {target} (rowid, {', '.join(columns)}) "
+              f"VALUES (?, {', '.join(['?'] * len(columns))})")
+    last_rowid = 0
+    while True:
+        cursor.execute(select, [last_rowid, BATCH_SIZE])
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        cursor.executemany(insert, [
+            [row[0]] + [
+                convert(value) if convert else value
+                for convert, value in zip(converters, row[1:])
+            ]
+            for row in rows
+        ])
+        last_rowid = rows[-1][0]
+
+
+def migrate_publications(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE sarafan_publications_new (
+            magnet blob primary key,
+            source blob not null,
+            size integer not null,
+            reply_to blob,
+            retention integer
+        )
+    """)
+    copy_rows(cursor, 'sarafan_publications', 'sarafan_publications_new',
+              ['magnet', 'source', 'size', 'reply_to', 'retention'],
+              [to_bytes, to_bytes, None, to_bytes, None])
+    cursor.execute("DROP TABLE sarafan_publications")
+    cursor.execute("ALTER TABLE sarafan_publications_new RENAME TO sarafan_publications")
+    cursor.execute("CREATE INDEX idx_sarafan_publication_source ON sarafan_publications (source)")
+    cursor.execute("CREATE INDEX idx_sarafan_publication_reply_to ON sarafan_publications (reply_to)")
+
+
+def migrate_posts(conn):
+    cursor = conn.cursor()
+    # search triggers and view reference posts table, they are recreated below
+    for trigger in ('before_insert', 'after_insert', 'before_delete', 'before_update', 'after_update'):
+        cursor.execute(f"DROP TRIGGER sarafan_posts_search_{trigger}")
+    cursor.execute("DROP VIEW sarafan_posts_search_indexed")
+    cursor.execute("""
+        CREATE TABLE sarafan_posts_new (
+            magnet blob primary key,
+            content text not null,
+            created_at integer not null default (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+    """)
+    copy_rows(cursor, 'sarafan_posts', 'sarafan_posts_new',
+              ['magnet', 'content', 'created_at'],
+              [to_bytes, None, None])
+    cursor.execute("DROP TABLE sarafan_posts")
+    cursor.execute("ALTER TABLE sarafan_posts_new RENAME TO sarafan_posts")
+    cursor.execute("CREATE INDEX idx_sarafan_posts_feed ON sarafan_posts (created_at)")
+    cursor.execute("""
+        CREATE VIEW sarafan_posts_search_indexed AS
+            SELECT p.rowid AS rowid, p.magnet AS magnet, p.content AS content
+            FROM sarafan_posts p, sarafan_posts_search_backfill b
+            WHERE p.rowid <= b.last_rowid OR p.rowid > b.max_rowid
+    """)
+    cursor.execute("""
+        CREATE TRIGGER sarafan_posts_search_before_insert BEFORE INSERT ON sarafan_posts
+        BEGIN
+            INSERT INTO sarafan_posts_search (sarafan_posts_search, rowid, content)
+                SELECT 'delete', rowid, content FROM sarafan_posts_search_indexed WHERE magnet = NEW.magnet;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER sarafan_posts_search_after_insert AFTER INSERT ON sarafan_posts
+        BEGIN
+            INSERT INTO sarafan_posts_search (rowid, content) VALUES (NEW.rowid, NEW.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER sarafan_posts_search_before_delete BEFORE DELETE ON sarafan_posts
+        BEGIN
+            INSERT INTO sarafan_posts_search (sarafan_posts_search, rowid, content)
+                SELECT 'delete', rowid, content FROM sarafan_posts_search_indexed WHERE rowid = OLD.rowid;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER sarafan_posts_search_before_update BEFORE UPDATE OF content ON sarafan_posts
+        BEGIN
+            INSERT INTO sarafan_posts_search (sarafan_posts_search, rowid, content)
+                SELECT 'delete', rowid, content FROM sarafan_posts_search_indexed WHERE rowid = OLD.rowid;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER sarafan_posts_search_after_update AFTER UPDATE OF content ON sarafan_posts
+        BEGIN
+            INSERT INTO sarafan_posts_search (rowid, content) VALUES (NEW.rowid, NEW.content);
+        END
+    """)
+
+
+steps = [
+    step(migrate_publications),
+    step(migrate_posts),
+]
@@ -8,13 +8,17 @@ from core_service import Service, requirements, listener
 from eth_account import Account
 
 from sarafan.bundle.bundle import ContentBundle
+from sarafan.bundle.cache import RenderCache
 from sarafan.contract import ContractService
 from sarafan.contract.announcement_service import AnnouncementService
+from sarafan.database.collections import DEFAULT_PER_PAGE
 from sarafan.database.service import DatabaseService
+from sarafan.ethereum import EthereumNodeClient
+from sarafan.ethereum.pool import MAX_BLOCK_LAG, HEDGE_PERCENTILE
 from sarafan.download import DownloadService
 from sarafan.logging_helpers import setup_logging
 from sarafan.magnet import is_magnet
-from sarafan.events import Publication, Post, DownloadFinished
+from sarafan.events import Comment, Publication, Post, DownloadFinished
 from sarafan.onion.controller import HiddenServiceController
 from sarafan.models import Peer
 from sarafan.peering.service import PeeringService
@@ -27,8 +31,20 @@ argparser = configargparse.get_argument_parser()
 
 argparser.add_argument("--token", help="Sarafan token contract address",
                        default="0x957D0b2E4afA74A49bbEa4d7333D13c0b11af60F")
+argparser.add_argument("--eth-node", action="append", dest="eth_nodes",
+                       help="Ethereum node JSON-RPC url, can be repeated to use multiple nodes")
+argparser.add_argument("--eth-ws-url", action="store", dest="eth_ws_url",
+                       help="Ethereum node WebSocket url to receive new contract events")
+argparser.add_argument("--eth-max-block-lag", action="store", dest="eth_max_block_lag", type=int,
+                       help="Maximum number of blocks node can lag behind others to serve reads",
+                       default=MAX_BLOCK_LAG)
+argparser.add_argument("--eth-hedge-percentile", action="store", dest="eth_hedge_percentile", type=float,
+                       help="Node latency percentile after which logs and calls are sent to the next node",
+                       default=HEDGE_PERCENTILE)
 argparser.add_argument("--db", help="sqlite database path",
                        default="db.sqlite")
+argparser.add_argument("--db-incremental-vacuum", action="store_true", dest="db_incremental_vacuum",
+                       help="Rebuild database created by older versions to return free space to the file system")
 argparser.add_argument("--log-level", help="log level to output",
                        default="INFO", choices=('DEBUG', 'INFO', 'ERROR'))
 argparser.add_argument("--no-discover", action="store_false", dest="discover",
@@ -56,6 +72,14 @@ argparser.add_argument("--node-private-key", action="store", dest="node_private_
                        help="Node ethereum account address for peering contract operations")
 
 
+def is_reply(reply_to: str) -> bool:
+    """Check if publication replies to other publication.
+
+    Posts are published with zero hash instead of the parent magnet.
+    """
+    return bool(reply_to) and reply_to.lower().replace('0x', '', 1).strip('0') != ''
+
+
 class Application(Service):
     """Sarafan application.
 
@@ -78,12 +102,26 @@ class Application(Service):
 
         self.log.info("Content path: %s", self.conf.content_path)
 
-        self.db = DatabaseService(database=self.conf.db)
+        self.db = DatabaseService(
+            database=self.conf.db,
+            enable_incremental_vacuum=self.conf.db_incremental_vacuum,
+        )
+        eth_client_kwargs = {}
+        if self.conf.eth_nodes:
+            eth_client_kwargs['node_url'] = self.conf.eth_nodes
         self.contract = ContractService(
-            token_address=self.conf.token
+            token_address=self.conf.token,
+            eth_client=EthereumNodeClient(
+                ws_url=self.conf.eth_ws_url,
+                max_block_lag=self.conf.eth_max_block_lag,
+                hedge_percentile=self.conf.eth_hedge_percentile,
+                **eth_client_kwargs,
+            ),
+            event_store=self.db.contract_events,
         )
         self.peering = PeeringService()
         self.storage = StorageService(base_path=self.conf.content_path)
+        self.render_cache = RenderCache(path=self.storage.get_render_path())
         self.downloads = DownloadService(
             storage=self.storage
         )
@@ -107,9 +145,10 @@ class Application(Service):
         # resolve contract service before accessing contracts
         await self.contract.resolve()
 
+        # database should be started first to store contract events and restore checkpoints
         services = [
-            self.contract,
             self.db,
+            self.contract,
             self.downloads,
             self.peering,
             self.storage,
@@ -122,6 +161,7 @@ class Application(Service):
                 AnnouncementService(
                     peering_contract=self.contract.peering.contract,
                     hidden_service=self.hidden_service,
+                    transactions=self.contract.transactions,
                     node_account=self.conf.node_account,
                     node_private_key=self.conf.node_private_key,
                 )
@@ -136,14 +176,22 @@ class Application(Service):
         magnet = download.publication.magnet
         self.log.info("Process finished %s", download)
         # TODO: update peers stats from download info
-        bundle_path = self.storage.get_absolute_path(magnet)
-        with ContentBundle(bundle_path, 'r') as bundle:
-            markdown_content = bundle.render_markdown()
-            unpack_path = self.storage.get_unpack_path(magnet)
-            bundle.extractall(unpack_path)
-        # publication = await self.db.publications.get(magnet)
-        # TODO: support comments and reply_to
-        post = Post(magnet=magnet, content=markdown_content)
+        rendered = self.render_cache.get(magnet)
+        unpack_path = self.storage.get_unpack_path(magnet)
+        # bundle is immutable, open it only if it wasn't rendered and unpacked before
+        if rendered is None or not unpack_path.exists():
+            bundle_path = self.storage.get_absolute_path(magnet)
+            with ContentBundle(bundle_path, 'r') as bundle:
+                rendered = self.render_cache.render(magnet, bundle)
+                bundle.extractall(unpack_path)
+        reply_to = download.publication.reply_to
+        # parent might be downloaded later, comments collection moves the reply under it then
+        if is_reply(reply_to):
+            comment = Comment(magnet=magnet, reply_to=reply_to, content=rendered.markdown)
+            await self.db.comments.store(comment)
+            self.log.debug("Comment stored in the database %s", comment)
+            return
+        post = Post(magnet=magnet, content=rendered.markdown)
         await self.db.posts.store(post)
         self.log.debug("Post stored in the database %s", post)
 
@@ -189,7 +237,7 @@ class WebAppInterface(AbstractApplicationInterface):
         await self.app.contract.post_service.post(
             address=account.address,
             private_key=private_key,
-            reply_to=b'0',
+            reply_to=bytes(32),
             magnet=bytes.fromhex(magnet),
             size=os.path.getsize(filename),
             author=account.address
@@ -215,9 +263,10 @@ class WebAppInterface(AbstractApplicationInterface):
         await self.app.peering.distribute(target_filename, magnet)
         self.app.log.info("Finish publishing")
 
-    async def post_list(self, cursor=None):
+    async def post_list(self, cursor=None, per_page=DEFAULT_PER_PAGE):
         """Return posts list for API endpoint.
 
         :param cursor: return posts starting from position defined by cursor
+        :param per_page: number of posts per page
         """
-        return self.app.db.posts.all(cursor=cursor)
+        return await self.app.db.posts.all(cursor=cursor, per_page=per_page)
@@ -1,7 +1,9 @@
 import json
+import os
 from dataclasses import dataclass
-from typing import Optional, IO, Union, Dict
-from zipfile import ZipFile
+from pathlib import PurePosixPath
+from typing import Optional, IO, Union, Dict, List
+from zipfile import ZipFile, ZipInfo
 
 
 class BundleError(Exception):
@@ -20,6 +22,34 @@ class UnsafeBundleContent(BundleError):
     pass
 
 
+class BundleLimitExceeded(UnsafeBundleContent):
+    pass
+
+
+@dataclass(frozen=True)
+class BundleLimits:
+    """Hard limits applied to the untrusted content bundles.
+
+    Checked against the zip central directory before anything is extracted
+    or read and enforced again while streaming entries content.
+
+    Limits are shared by bundles, so they are immutable. Use
+    `dataclasses.replace()` to pass tuned limits to the single bundle.
+    """
+    #: maximum number of entries in the bundle
+    max_entries: int = 64
+    #: maximum total uncompressed size of all bundle entries in bytes
+    max_total_size: int = 32 * 1024 ** 2
+    #: maximum size of the text entry (content.json, index.md, ...) read in memory
+    max_text_size: int = 1024 ** 2
+    #: maximum compression ratio of the single entry
+    max_ratio: int = 100
+    #: entries smaller than this size are not checked for compression ratio
+    ratio_threshold: int = 1024 ** 2
+    #: chunk size used to stream entries content
+    chunk_size: int = 64 * 1024
+
+
 @dataclass
 class ContentJSON:
     """Bundles content.json representation.
@@ -66,6 +96,9 @@ class ContentBundle(ZipFile):
 
     Allows to read and write sarafan archives. It is based on ZipFile and adds
     some helper methods.
+
+    Default `limits` can be overridden for the single bundle with the `limits`
+    argument.
     """
     text_extensions = ['.md', '.txt']
     text_index_names = {f'index{x}' for x in text_extensions}
@@ -75,11 +108,56 @@ class ContentBundle(ZipFile):
 
     allowed_extensions = text_extensions + image_extensions
 
+    #: limits applied to the bundle content
+    limits: BundleLimits = BundleLimits()
+
+    #: bundle was validated in non-strict mode
+    _validated: bool = False
+    #: bundle was validated in strict mode
+    _validated_strict: bool = False
+
+    def __init__(self, *args, limits: Optional[BundleLimits] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if limits is not None:
+            self.limits = limits
+
+    def validate(self, strict=False):
+        """Check bundle central directory against `limits`.
+
+        Only the zip metadata is used, so hostile bundles are rejected before any
+        byte is decompressed.
+
+        :param strict: raise on entries with disallowed extensions instead of skipping them
+        :raise BundleLimitExceeded: entry count, size or compression ratio is out of limits
+        :raise UnsafeBundleContent: bundle contains unsafe entry name
+        """
+        infolist = self.infolist()
+        if len(infolist) > self.limits.max_entries:
+            raise BundleLimitExceeded("Too many entries in bundle: %i" % len(infolist))
+        total_size = 0
+        for info in infolist:
+            if not self._is_safe_name(info.filename):
+                raise UnsafeBundleContent(info.filename)
+            if strict and not info.is_dir() and not self._is_allowed_name(info.filename):
+                raise UnsafeBundleContent(info.filename)
+            if info.file_size > self.limits.ratio_threshold \
+                    and info.file_size > info.compress_size * self.limits.max_ratio:
+                raise BundleLimitExceeded("Compression ratio of %s is too high" % info.filename)
+            total_size += info.file_size
+            if total_size > self.limits.max_total_size:
+                raise BundleLimitExceeded("Bundle uncompressed size exceeds %i bytes"
+                                          % self.limits.max_total_size)
+        self._validated = True
+        if strict:
+            self._validated_strict = True
+
     def render_markdown(self):
         """Convert bundle to markdown according to content type.
 
         :return: markdown text
         """
+        if not self._validated:
+            self.validate()
         bundle_names = set(self.namelist())
         if 'content.json' in bundle_names:
             # apply content.json rules
@@ -89,7 +167,7 @@ class ContentBundle(ZipFile):
             # choose one of the index files in the right order
             for name in self.text_index_names:
                 if name in bundle_names:
-                    text_content = self.read(name)
+                    text_content = self.read_limited(name).decode()
                     return self._render_text(text_content)
         elif bundle_names.intersection(self.image_index_names):
             # build text content from image
@@ -103,32 +181,86 @@ class ContentBundle(ZipFile):
            directory. `path' specifies a different directory to extract to.
            `members' is optional and must be a subset of the list returned
            by namelist().
+
+        In strict mode the whole bundle is validated before anything is
+        written, so nothing is extracted from the rejected bundle.
         """
-        allowed_members = []
+        if strict and not self._validated_strict:
+            self.validate(strict=True)
+        elif not self._validated:
+            self.validate()
+        if path is None:
+            path = os.getcwd()
         if members is None:
-            members = self.namelist()
-        for name in members:
-            ext = name.split('.')[-1]
-            if ext in self.allowed_extensions:
-                allowed_members.append(name)
+            members = self.infolist()
+        for member in members:
+            info = member if isinstance(member, ZipInfo) else self.getinfo(member)
+            if info.is_dir():
+                continue
+            if self._is_allowed_name(info.filename):
+                self._extract_limited(info, path, pwd=pwd)
             elif strict:
-                raise UnsafeBundleContent(name)
-        super().extractall(path=path, members=allowed_members, pwd=pwd)
+                raise UnsafeBundleContent(info.filename)
+
+    def read_limited(self, name, max_size: Optional[int] = None) -> bytes:
+        """Read entry content in memory but not more than `max_size` bytes.
+
+        :param name: entry name
+        :param max_size: maximum content size, `limits.max_text_size` by default
+        :raise BundleLimitExceeded: entry content is larger than allowed
+        """
+        if max_size is None:
+            max_size = self.limits.max_text_size
+        chunks: List[bytes] = []
+        size = 0
+        with self.open(name) as fp:
+            for chunk in iter(lambda: fp.read(self.limits.chunk_size), b''):
+                size += len(chunk)
+                if size > max_size:
+                    raise BundleLimitExceeded("Entry %s is larger than %i bytes" % (name, max_size))
+                chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _extract_limited(self, info: ZipInfo, path, pwd=None):
+        """Stream entry content to the file under `path` with size limit applied.
+        """
+        target_path = os.path.join(path, *PurePosixPath(info.filename).parts)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        size = 0
+        with self.open(info, pwd=pwd) as source, open(target_path, 'wb') as target:
+            for chunk in iter(lambda: source.read(self.limits.chunk_size), b''):
+                size += len(chunk)
+                if size > info.file_size or size > self.limits.max_total_size:
+                    target.close()
+                    os.unlink(target_path)
+                    raise BundleLimitExceeded("Entry %s is larger than declared" % info.filename)
+                target.write(chunk)
+
+    def _is_safe_name(self, name: str) -> bool:
+        """Check if entry name can't escape from the extraction path.
+        """
+        if '\\' in name or name.startswith('/'):
+            return False
+        return '..' not in PurePosixPath(name).parts
+
+    def _is_allowed_name(self, name: str) -> bool:
+        """Check if entry has one of the allowed extensions.
+        """
+        return os.path.splitext(name)[1].lower() in self.allowed_extensions
 
     def _render_content_json(self):
         """Render bundle content to markdown using content.json parameters.
 
         :return:
         """
-        content_json = ContentJSON.parse(self.read('content.json').decode())
+        content_json = ContentJSON.parse(self.read_limited('content.json').decode())
         if content_json.index:
-            try:
-                ext = content_json.index.split('.')[-1]
-            except IndexError:
+            ext = os.path.splitext(content_json.index)[1].lower()
+            if not ext:
                 raise BundleFormatError("Index file %s in content.json has no extension"
                                         % content_json.index)
             if ext in self.text_extensions:
-                return self._render_text(self.read(content_json.index))
+                return self._render_text(self.read_limited(content_json.index).decode())
             elif ext in self.image_extensions:
                 return self._render_image(content_json.index, content_json.text)
             else:
@@ -0,0 +1,130 @@
+"""Content-addressed cache of rendered bundles.
+
+Bundle is addressed by its magnet and can't be changed, so rendered content
+is cached forever and never invalidated. Only the least recently used entries
+are evicted from memory when cache is full.
+"""
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+from ..magnet import magnet_path
+from .bundle import ContentBundle
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class RenderedContent:
+    """Rendered bundle content.
+    """
+    #: markdown content rendered from bundle
+    markdown: str
+    #: html pre-rendered from markdown, if html renderer is configured
+    html: Optional[str] = None
+
+
+class RenderCache:
+    """In-memory LRU cache of rendered bundles with optional persistence.
+
+    If `path` is provided, rendered content is also stored on disk under
+    the magnet path and loaded back on memory cache miss.
+
+    `html_renderer` is an optional callable converting markdown to html.
+    """
+
+    #: maximum number of entries kept in memory
+    max_size: int
+    #: path to persist rendered content, memory only if None
+    path: Optional[Path]
+
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(self,
+                 max_size: int = 1024,
+                 path: Optional[Union[str, Path]] = None,
+                 html_renderer: Optional[Callable[[str], str]] = None):
+        self.max_size = max_size
+        self.path = Path(path) if path is not None else None
+        self.html_renderer = html_renderer
+        self._entries: 'OrderedDict[str, RenderedContent]' = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, magnet: str) -> Optional[RenderedContent]:
+        """Get rendered content from memory or disk.
+        """
+        entry = self._entries.get(magnet)
+        if entry is not None:
+            self._entries.move_to_end(magnet)
+            self.hits += 1
+            return entry
+        entry = self._load(magnet)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(magnet, entry)
+        return entry
+
+    def put(self, magnet: str, markdown: str) -> RenderedContent:
+        """Store rendered markdown for the magnet.
+        """
+        html = self.html_renderer(markdown) if self.html_renderer else None
+        entry = RenderedContent(markdown=markdown, html=html)
+        self._remember(magnet, entry)
+        self._persist(magnet, entry)
+        return entry
+
+    def render(self, magnet: str, bundle: ContentBundle) -> RenderedContent:
+        """Get rendered content from cache or render it from bundle.
+        """
+        entry = self.get(magnet)
+        if entry is None:
+            entry = self.put(magnet, bundle.render_markdown())
+        return entry
+
+    def _remember(self, magnet: str, entry: RenderedContent):
+        self._entries[magnet] = entry
+        self._entries.move_to_end(magnet)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _get_path(self, magnet: str, suffix: str) -> Path:
+        return self.path / (magnet_path(magnet) + suffix)
+
+    def _load(self, magnet: str) -> Optional[RenderedContent]:
+        if self.path is None:
+            return None
+        try:
+            markdown = self._get_path(magnet, '.md').read_text()
+        except FileNotFoundError:
+            return None
+        try:
+            html = self._get_path(magnet, '.html').read_text()
+        except FileNotFoundError:
+            html = None
+        return RenderedContent(markdown=markdown, html=html)
+
+    def _persist(self, magnet: str, entry: RenderedContent):
+        if self.path is None:
+            return
+        try:
+            self._write(self._get_path(magnet, '.md'), entry.markdown)
+            if entry.html is not None:
+                self._write(self._get_path(magnet, '.html'), entry.html)
+        except OSError:
+            log.exception("Failed to persist rendered content of %s", magnet)
+
+    def _write(self, path: Path, content: str):
+        """Write file atomically to not expose partially written content.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_text(content)
+        os.replace(tmp_path, path)
@@ -1,13 +1,19 @@
 import asyncio
 import logging
-from collections import defaultdict
-from typing import Dict, Iterable, List, Optional, Type, Union
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Type, Union
 
 from core_service import Service, task
 
+from ..database.ingestion import ContractEventStore
 from ..ethereum import Contract, EthereumNodeClient
 from ..ethereum.block_range import BlockRange
 from ..ethereum.contract import BaseContractEvent
+from ..ethereum.dedup import EventDeduplicator, Reconciliation
+from ..ethereum.event import Event
+from ..ethereum.exceptions import ResultLimitExceeded
+from ..events import ContractEventRetracted
 from ..logging_helpers import pformat
 
 
@@ -21,6 +27,15 @@ EventTypeOrList = Union[
 
 SubscriptionsMapping = Dict[Type[BaseContractEvent], List[asyncio.Queue]]
 
+Window = Tuple[int, int]
+
+#: number of blocks before checkpoint to process again on resume
+REORG_MARGIN = 12
+#: number of block ranges requested simultaneously
+FETCH_CONCURRENCY = 4
+#: number of seconds between polling for new blocks while logs subscription is active
+PUSH_SLEEP_INTERVAL = 300.0
+
 
 class ContractEventService(Service):
 
@@ -32,6 +47,32 @@ class ContractEventService(Service):
 
     Client should call `subscribe()` before service start. Returned queue
     should be used to consume new events.
+
+    If event store is provided, events of every block range are stored in
+    a single transaction with the range checkpoint before subscribers are
+    notified. Forward iteration is resumed from the checkpoint on start.
+
+    Only events consumed by subscribers, registered service bus consumers or
+    the event store are requested from the node, see `get_topics()`. Bus
+    consumers should be registered with `event_types` or `consume()`.
+
+    Forward polling requests last `reorg_margin` blocks again. Events of
+    these blocks are deduplicated, events of blocks replaced by chain
+    reorganization are retracted: deleted from the event store and emitted
+    as `ContractEventRetracted`. Events of blocks up to the checkpoint are
+    requested again on resume to restore deduplication, but they are not
+    stored and delivered twice.
+
+    If node client has WebSocket endpoint, service subscribes to contract logs
+    and fetches new events as soon as they are emitted instead of polling every
+    `block_sleep_interval` seconds (push mode). Events of the blocks missed
+    while subscription was interrupted are fetched on reconnect, polling is
+    used until subscription is restored.
+
+    Up to `concurrency` block ranges are requested at once, events are still
+    delivered strictly in block range order. Range size is adjusted by
+    response time and number of events, ranges refused by the node as too
+    wide are split.
     """
 
     #: Ethereum node client
@@ -44,8 +85,26 @@ class ContractEventService(Service):
     block_sleep_interval: float = 30.0
     #: current block number
     current_block_number: Optional[int] = None
+    #: contract events and processed blocks checkpoints storage
+    event_store: Optional[ContractEventStore] = None
+    #: number of blocks before checkpoint to process again on resume
+    reorg_margin: int = REORG_MARGIN
+    #: number of block ranges requested simultaneously
+    concurrency: int = FETCH_CONCURRENCY
+    #: number of seconds to sleep between polling for new block in push mode
+    push_sleep_interval: float = PUSH_SLEEP_INTERVAL
+    #: True if new events are received from logs subscription
+    push_mode: bool = False
 
     _subscriptions: SubscriptionsMapping
+    #: event types consumed by service bus listeners
+    _consumed: Set[Type[BaseContractEvent]]
+    #: topics filter of the current `fetch_events()` call
+    _topics: List[List[str]]
+    #: last block number of the current `fetch_events()` call
+    _last_block_number: int = 0
+    #: events up to this block were delivered before restart
+    _delivered_block: Optional[int] = None
 
     def __init__(
         self,
@@ -53,6 +112,11 @@ class ContractEventService(Service):
         contract: Contract,
         block_range: Optional[BlockRange] = None,
         block_sleep_interval: float = 10.0,
+        event_store: Optional[ContractEventStore] = None,
+        reorg_margin: int = REORG_MARGIN,
+        concurrency: int = FETCH_CONCURRENCY,
+        push_sleep_interval: float = PUSH_SLEEP_INTERVAL,
+        event_types: EventTypeOrList = (),
         **kwargs
     ):
         super().__init__(**kwargs)
@@ -63,16 +127,48 @@ class ContractEventService(Service):
             block_range = BlockRange(from_block=0)
         self.block_range = block_range
         self.block_sleep_interval = block_sleep_interval
+        self.event_store = event_store
+        self.reorg_margin = reorg_margin
+        self.concurrency = concurrency
+        self.push_sleep_interval = push_sleep_interval
 
         self._subscriptions = defaultdict(list)
+        self._consumed = set()
+        self.consume(event_types)
+        self._topics = []
+        self._seen_events = EventDeduplicator()
+        self._new_events = asyncio.Event()
 
-        # FIXME: should be flushed sometime
-        #  used to remove duplicates while loading events, not a good solution
-        self._loaded_events = set()
+    @property
+    def stream(self) -> str:
+        """Checkpoint stream identifier.
+        """
+        return self.contract.address
 
-    async def stop(self):
-        await self.client.close()
-        await super().stop()
+    async def start(self):
+        await self.restore_checkpoint()
+        await super().start()
+
+    async def restore_checkpoint(self):
+        """Resume forward block iteration from the saved checkpoint.
+
+        Iteration is resumed `reorg_margin` blocks before the checkpoint to
+        receive events of the blocks replaced by chain reorganization.
+        Explicitly limited block ranges are not resumed.
+        """
+        if self.event_store is None or self.block_range.reverse or self.block_range.to_block is not None:
+            return
+        checkpoint = await self.event_store.get_checkpoint(self.stream)
+        if checkpoint is None:
+            self.log.info("No checkpoint for %s, start from block %s",
+                          self.stream, self.block_range.from_block)
+            return
+        from_block = max(checkpoint.block_number - self.reorg_margin, self.block_range.from_block)
+        self.log.info("Resume %s from block %i, checkpoint at block %i",
+                      self.stream, from_block, checkpoint.block_number)
+        self.current_block_number = checkpoint.block_number
+        self._delivered_block = checkpoint.block_number
+        self.block_range = self._shift_block_range(from_block)
 
     def subscribe(self,
                   event_type: EventTypeOrList,
@@ -83,15 +179,42 @@ class ContractEventService(Service):
         :param queue: optional queue to use instead of creating new one
         :return: queue with contract events
         """
-        # issubclass for linter
-        if isinstance(event_type, type) and issubclass(event_type, BaseContractEvent):
-            event_type = [event_type]
         if queue is None:
             queue = asyncio.Queue()
-        for t in event_type:
+        for t in self._event_types(event_type):
             self._subscriptions[t].append(queue)
         return queue
 
+    def consume(self, event_type: EventTypeOrList):
+        """Register contract events consumed by the service bus listeners.
+
+        Events are emitted to the service bus anyway, but only registered
+        ones are requested from the node.
+
+        :param event_type: contract event type or list of them
+        """
+        self._consumed.update(self._event_types(event_type))
+
+    def get_event_types(self) -> Set[Type[BaseContractEvent]]:
+        """Get contract event types consumed by subscribers.
+
+        Event type is consumed if it has `subscribe()` queues, registered
+        service bus consumers or should be saved by the event store.
+        """
+        consumed = {t for t, queues in self._subscriptions.items() if queues}
+        consumed.update(self._consumed)
+        if self.event_store is not None:
+            consumed.update(self.event_store.event_types)
+        return {t for t in self.contract.signatures.values() if t in consumed}
+
+    def get_topics(self) -> List[List[str]]:
+        """Get `eth_getLogs` topics filter matching any consumed event type.
+
+        Empty list is returned if there are no consumed event types.
+        """
+        signatures = sorted('0x' + t.get_signature_hash() for t in self.get_event_types())
+        return [signatures] if signatures else []
+
     async def notify_subscribers(self, contract_event: BaseContractEvent):
         await self.emit(contract_event)
         for queue in self._subscriptions.get(contract_event.__class__, []):
@@ -107,48 +230,228 @@ class ContractEventService(Service):
     @task(periodic=False)
     async def fetch_events_task(self):
         while not self.should_stop:
-            await self.fetch_events()
+            if not await self.fetch_events():
+                # blocks are fetched when events are consumed
+                await self._wait_new_events()
+                continue
             if self.block_range.reverse:
                 log.debug("First block processed, finishing reverse block iteration")
                 break
             if self.block_range.to_block is not None:
                 log.debug("To block defined and reached, finish forward block iteration")
                 break
-            # do not process blocks twice, replace block range with shifted to last block
-            self.block_range = BlockRange(
-                from_block=self.current_block_number or 0,
-                to_block=None,
-                start_size=self.block_range.step_size,
-                max_size=self.block_range.max_size,
-                min_size=self.block_range.min_size,
-                target_time=self.block_range.target_time,
+            # not finalized blocks are requested again to detect reorganizations
+            self.block_range = self._shift_block_range(
+                max((self.current_block_number or 0) - self.reorg_margin, self.block_range.from_block)
             )
             log.debug("All available events received, wait for next block")
+            await self._wait_new_events()
+
+    @task(periodic=False)
+    async def subscribe_logs_task(self):
+        """Wake up event fetching on contract logs notifications.
+
+        Subscription is restored after `block_sleep_interval` if connection
+        is lost. Polling is used while there are no consumed events, so
+        notifications of not consumed events don't wake up fetching.
+        """
+        if self.client.ws_url is None or self.block_range.reverse or self.block_range.to_block is not None:
+            return
+        while not self.should_stop:
+            topics = self.get_topics()
+            if not topics:
+                self.log.debug("No consumers of %s events, logs subscription is postponed", self.stream)
+                await asyncio.sleep(self.block_sleep_interval)
+                continue
+            try:
+                params = {"address": self.contract.address, "topics": topics}
+                async with self.client.subscribe("logs", params) as subscription:
+                    self.log.info("Subscribed to %s logs, switch to push mode", self.stream)
+                    self.push_mode = True
+                    # fetch events of blocks missed while subscription was interrupted
+                    self._new_events.set()
+                    async for _ in subscription:
+                        self._new_events.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa
+                self.log.warning("Logs subscription of %s failed: %r", self.stream, e)
+            if self.push_mode:
+                self.log.warning("Logs subscription of %s interrupted, fall back to polling", self.stream)
+            self.push_mode = False
             await asyncio.sleep(self.block_sleep_interval)
 
-    async def fetch_events(self):
+    async def _wait_new_events(self):
+        """Wait for logs notification or polling interval.
+        """
+        timeout = self.push_sleep_interval if self.push_mode else self.block_sleep_interval
+        try:
+            await asyncio.wait_for(self._new_events.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._new_events.clear()
+
+    async def fetch_events(self) -> bool:
+        """Fetch events of all block ranges up to the last known block.
+
+        Next block ranges are requested while events of the first one are
+        processed, so node round trip time is shared by `concurrency` ranges.
+
+        Nothing is fetched if there are no consumed events, current block and
+        checkpoint are not moved, so blocks are fetched for the later consumers.
+
+        :return: False if blocks weren't fetched because of no consumers
+        """
         self.log.debug("Start fetching events")
+        self._update_topics()
+        if not self._topics:
+            self.log.debug("No consumers of %s events, blocks are not fetched", self.stream)
+            return False
         last_block_number = await self.client.block_number()
-        for from_block, to_block in self.block_range:
-            if to_block > last_block_number:
-                to_block = last_block_number
-            self.log.debug("Requesting events for %i - %i block range",
-                           from_block, to_block)
-            resp = await self.client.get_logs(self.contract.address, from_block, to_block)
-            if self.block_range.reverse:
-                resp = reversed(resp)
-            for event in resp:
-                if event.transaction_hash in self._loaded_events:
+        self._last_block_number = last_block_number
+        windows = self._iter_windows(last_block_number)
+        pending: Deque[Tuple[Window, asyncio.Future]] = deque()
+        try:
+            while True:
+                while len(pending) < self.concurrency:
+                    window = next(windows, None)
+                    if window is None:
+                        break
+                    pending.append((window, self._request_window(window)))
+                if not pending:
+                    break
+                window, request = pending.popleft()
+                try:
+                    resp = await request
+                except ResultLimitExceeded:
+                    for part in reversed(self._split_window(window)):
+                        pending.appendleft((part, self._request_window(part)))
                     continue
-                self._loaded_events.add(event.transaction_hash)
-                contract_event = self.contract.parse(event)
-                self._update_current_block(event.block_number)
-                self.log.debug("Notify subscribers about new event %s", pformat(contract_event))
-                await self.notify_subscribers(contract_event)
-            if to_block == last_block_number:
-                self._update_current_block(last_block_number)
-                self.log.debug("Last known block fetched, finish `fetch_events`")
-                break
+                await self._process_window(window, resp)
+        finally:
+            for _, request in pending:
+                if request.done() and not request.cancelled():
+                    request.exception()
+                request.cancel()
+        self.log.debug("Last known block fetched, finish `fetch_events`")
+        return True
+
+    def _update_topics(self):
+        """Update topics filter of the next block ranges.
+
+        Delivered events of other types look missing from responses with the
+        new filter, so they are forgotten instead of being retracted as
+        reorganized. Events of the processed blocks are not delivered again.
+        """
+        topics = self.get_topics()
+        if self._topics and topics != self._topics:
+            self.log.info("Consumed events of %s changed at block %s", self.stream, self.current_block_number)
+            self._seen_events = EventDeduplicator()
+            if self.current_block_number is not None:
+                self._seen_events.finalize(self.current_block_number)
+        self._topics = topics
+
+    def _iter_windows(self, last_block_number: int) -> Iterator[Window]:
+        """Iterate over block range windows up to the last known block.
+        """
+        lower = max(self.block_range.from_block or 0, 0)
+        upper = last_block_number
+        if self.block_range.to_block is not None:
+            upper = min(upper, self.block_range.to_block)
+        if self.block_range.reverse and self.block_range.cursor > upper:
+            self.block_range.cursor = upper
+        for from_block, to_block in self.block_range:
+            from_block, to_block = max(from_block, lower), min(to_block, upper)
+            if from_block <= to_block:
+                yield from_block, to_block
+            if (to_block if not self.block_range.reverse else from_block) == \
+                    (upper if not self.block_range.reverse else lower):
+                return
+
+    @staticmethod
+    def _event_types(event_type: EventTypeOrList) -> List[Type[BaseContractEvent]]:
+        # issubclass for linter
+        if isinstance(event_type, type) and issubclass(event_type, BaseContractEvent):
+            return [event_type]
+        return list(event_type)
+
+    def _request_window(self, window: Window) -> asyncio.Future:
+        return asyncio.ensure_future(self._get_logs(*window))
+
+    async def _get_logs(self, from_block: int, to_block: int) -> List[Event]:
+        self.log.debug("Requesting events for %i - %i block range", from_block, to_block)
+        started_at = time.monotonic()
+        resp = await self.client.get_logs(self.contract.address, from_block, to_block, topics=self._topics)
+        self.block_range.record(from_block, to_block, time.monotonic() - started_at, len(resp))
+        return resp
+
+    def _split_window(self, window: Window) -> List[Window]:
+        """Split window refused by the node into halves in iteration order.
+
+        :raise ResultLimitExceeded: if the single block can't be fetched
+        """
+        from_block, to_block = window
+        if from_block == to_block:
+            raise ResultLimitExceeded(f"Events of block {from_block} can't be fetched")
+        self.block_range.record_result_limit(from_block, to_block)
+        middle = (from_block + to_block) // 2
+        self.log.debug("Too many events in %i - %i block range, split at %i", from_block, to_block, middle)
+        parts = [(from_block, middle), (middle + 1, to_block)]
+        return parts[::-1] if self.block_range.reverse else parts
+
+    async def _process_window(self, window: Window, resp: List[Event]):
+        from_block, to_block = window
+        if self.block_range.reverse:
+            # reverse iteration requests every block once
+            new_events = list(reversed(resp))
+        else:
+            reconciliation = self._seen_events.reconcile(from_block, to_block, resp)
+            if reconciliation.retracted:
+                await self._retract_events(reconciliation)
+            new_events = reconciliation.new
+            self._seen_events.finalize(min(to_block, self._last_block_number - self.reorg_margin))
+            if self._delivered_block is not None:
+                # events are remembered by deduplicator, but not delivered again
+                new_events = [event for event in new_events if event.block_number > self._delivered_block]
+                if to_block >= self._delivered_block:
+                    self._delivered_block = None
+        # the whole page is decoded and stored at once before notification
+        events = list(zip(new_events, self.contract.parse_many(new_events)))
+        await self._store_events([contract_event for _, contract_event in events], to_block)
+        for event, contract_event in events:
+            self._update_current_block(event.block_number)
+            self.log.debug("Notify subscribers about new event %s", pformat(contract_event))
+            await self.notify_subscribers(contract_event)
+        self._update_current_block(from_block if self.block_range.reverse else to_block)
+
+    async def _retract_events(self, reconciliation: Reconciliation):
+        """Retract events of blocks replaced by reorganization.
+
+        Current block and checkpoint are rewound to the block before the fork.
+        """
+        retracted = reconciliation.retracted
+        contract_events = self.contract.parse_many(retracted)
+        if self.event_store is not None:
+            await self.event_store.retract(self.stream, contract_events, reconciliation.fork_block - 1)
+        self.current_block_number = reconciliation.fork_block - 1
+        for event, contract_event in zip(retracted, contract_events):
+            self.log.debug("Retract event %s", pformat(contract_event))
+            await self.emit(ContractEventRetracted(
+                event=contract_event,
+                block_number=event.block_number,
+                block_hash=event.block_hash,
+            ))
+
+    async def _store_events(self, events: List[BaseContractEvent], to_block: int):
+        if self.event_store is None:
+            return
+        # checkpoint is meaningful for the forward iteration only, and it
+        # isn't rewound while blocks delivered before restart are requested
+        checkpoint = None if self.block_range.reverse or self._delivered_block is not None else to_block
+        await self.event_store.ingest(self.stream, events, checkpoint)
+
+    def _shift_block_range(self, from_block: int) -> BlockRange:
+        return self.block_range.shifted(from_block)
 
     def _update_current_block(self, value):
         if self.current_block_number is None:
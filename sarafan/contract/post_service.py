@@ -1,9 +1,9 @@
-from eth_account import Account
 from eth_utils import to_checksum_address
 
 from core_service import Service
 
-from ..ethereum import Contract, EthereumNodeClient
+from .transaction_service import TransactionService
+from ..ethereum import Contract
 
 
 class PostService(Service):
@@ -11,12 +11,12 @@ class PostService(Service):
     """
     #: content contract
     content_contract: Contract
-    #: Ethereum node client
-    client: EthereumNodeClient
+    #: transactions sender
+    transactions: TransactionService
 
-    def __init__(self, content_contract: Contract, node_client: EthereumNodeClient, **kwargs):
+    def __init__(self, content_contract: Contract, transactions: TransactionService, **kwargs):
         super().__init__(**kwargs)
-        self.client = node_client
+        self.transactions = transactions
         self.content_contract = content_contract
 
     async def post(self, address, private_key, reply_to, magnet, size, author, retention: int = 12):
@@ -29,17 +29,13 @@ class PostService(Service):
         :param size:
         :param author:
         :param retention:
-        :return:
+        :return: transaction hash
         """
         tx_data = self.content_contract.call(
             'post', replyTo=reply_to, magnet=magnet, size=size, author=author, retention=retention
         )
-        transaction = {
+        return await self.transactions.submit(address, private_key, {
             'to': to_checksum_address(self.content_contract.address),
             'data': tx_data,
             'gas': 200000,
-            'gasPrice': await self.client.gas_price(),
-            'nonce': await self.client.get_transaction_count(address, "pending")
-        }
-        signed = Account.sign_transaction(transaction, private_key)
-        await self.client.send_raw_transaction(signed.rawTransaction.hex())
+        })
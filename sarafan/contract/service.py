@@ -1,16 +1,21 @@
-from typing import Optional
+from typing import List, Optional
 
 from eth_abi import decode_single
 
-from core_service import Service, requirements
+from core_service import Service, requirements, task
 from eth_utils import to_checksum_address
 
 from .post_service import PostService
+from .transaction_service import TransactionService
+from ..database.ingestion import ContractEventStore
 from ..ethereum import Contract, EthereumNodeClient
 from .abi import CONTENT_CONTRACT, PEERING_CONTRACT, TOKEN_CONTRACT
 from .event_service import ContractEventService
 from ..events import Publication, NewPeer
 
+#: number of seconds between node endpoints health checks
+HEALTH_CHECK_INTERVAL = 15
+
 
 class ContractService(Service):
     """Sarafan contract service.
@@ -20,6 +25,8 @@ class ContractService(Service):
     """
     eth: EthereumNodeClient
 
+    #: transactions sender shared by posting and announcement services
+    transactions: TransactionService
     #: content posting service
     post_service: PostService
     #: peer announcement service
@@ -35,6 +42,9 @@ class ContractService(Service):
     content_address: Optional[str] = None
     peering_address: Optional[str] = None
 
+    #: contract events and checkpoints storage shared by contract services
+    event_store: Optional[ContractEventStore] = None
+
     _resolved: bool = False
 
     def __init__(self,
@@ -42,15 +52,18 @@ class ContractService(Service):
                  content_address: Optional[str] = None,
                  peering_address: Optional[str] = None,
                  eth_client: Optional[EthereumNodeClient] = None,
+                 event_store: Optional[ContractEventStore] = None,
                  **kwargs):
         super().__init__(**kwargs)
         self.token_address = token_address
         self.content_address = content_address
         self.peering_address = peering_address
+        self.event_store = event_store
 
         if eth_client is None:
             eth_client = EthereumNodeClient()
         self.eth = eth_client
+        self.transactions = TransactionService(self.eth)
 
     async def resolve(self):
         """Resolve content and peering contract addresses from Sarafan token.
@@ -59,12 +72,18 @@ class ContractService(Service):
         """
         self.create_token_service()
 
-        if not self.content_address:
-            self.content_address = await self._resolve_contract_address('getContentContract')
-        await self.create_content_service()
+        unresolved = [
+            (attr, method_name)
+            for attr, method_name in (('content_address', 'getContentContract'),
+                                      ('peering_address', 'getPeeringContract'))
+            if not getattr(self, attr)
+        ]
+        if unresolved:
+            addresses = await self._resolve_contract_addresses(*[method_name for _, method_name in unresolved])
+            for (attr, _), address in zip(unresolved, addresses):
+                setattr(self, attr, address)
 
-        if not self.peering_address:
-            self.peering_address = await self._resolve_contract_address('getPeeringContract')
+        await self.create_content_service()
         await self.create_peering_service()
 
         self._resolved = True
@@ -75,9 +94,19 @@ class ContractService(Service):
             self.log.warning("Contract service didn't resolved before the start")
         await super().start()
 
+    async def stop(self):
+        await super().stop()
+        await self.eth.close()
+
+    @task(periodic=True, sleep_interval=HEALTH_CHECK_INTERVAL)
+    async def check_nodes_task(self):
+        # unhealthy endpoints are restored by checks even without requests
+        await self.eth.check_health()
+
     @requirements()
     async def contract_service_req(self):
         return [
+            self.transactions,
             self.token,
             self.peering,
             self.content,
@@ -96,7 +125,8 @@ class ContractService(Service):
         if hasattr(self, 'token'):  # pragma: nocover
             raise RuntimeError("Token service already created")
         self.token = ContractEventService(
-            self.eth, Contract(self.token_address, TOKEN_CONTRACT['abi'])
+            self.eth, Contract(self.token_address, TOKEN_CONTRACT['abi']),
+            event_store=self.event_store,
         )
         self.log.debug("Token ContractEventService created")
 
@@ -118,6 +148,9 @@ class ContractService(Service):
                     'Publication': Publication,
                 }
             ),
+            event_store=self.event_store,
+            # content of new publications is downloaded
+            event_types=[Publication],
         )
         self.log.debug("Content ContractEventService created")
 
@@ -139,6 +172,9 @@ class ContractService(Service):
                     'NewPeer': NewPeer,
                 }
             ),
+            event_store=self.event_store,
+            # new peers are added by peering service
+            event_types=[NewPeer],
         )
         self.log.debug("Peering ContractEventService created")
 
@@ -147,7 +183,7 @@ class ContractService(Service):
             raise RuntimeError("Post service already created")
         self.post_service = PostService(
             content_contract=self.content.contract,
-            node_client=self.eth,
+            transactions=self.transactions,
         )
         self.log.debug("PostService instance created")
 
@@ -158,10 +194,30 @@ class ContractService(Service):
         :raise RuntimeError: if address can't be resolved
         :return:
         """
-        res = await self.eth.call({
-            "to": self.token.contract.address,
-            "data": '0x%s' % self.token.contract.call(method_name).hex(),
-        })
+        addresses = await self._resolve_contract_addresses(method_name)
+        return addresses[0]
+
+    async def _resolve_contract_addresses(self, *method_names) -> List[str]:
+        """Resolve related contract addresses in a single batch request.
+
+        :param method_names: names of the abi methods/properties
+        :raise RuntimeError: if address can't be resolved
+        :return: addresses in order of method names
+        """
+        async with self.eth.batch() as batch:
+            results = [
+                batch.call({
+                    "to": self.token.contract.address,
+                    "data": '0x%s' % self.token.contract.call(method_name).hex(),
+                })
+                for method_name in method_names
+            ]
+        return [
+            self._decode_contract_address(method_name, result.result())
+            for method_name, result in zip(method_names, results)
+        ]
+
+    def _decode_contract_address(self, method_name, res) -> str:
         if res == '0x':
             self.log.error("Can't resolve %s %s", method_name, self.token.contract.address)
             raise Exception("Can't resolve contract address from method %s "
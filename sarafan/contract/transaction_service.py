@@ -0,0 +1,179 @@
+import asyncio
+import functools
+import time
+from typing import Dict, List, Optional, Tuple
+
+from core_service import Service, task
+from eth_account import Account
+from eth_utils import to_checksum_address
+
+from ..ethereum import EthereumNodeClient
+
+#: number of seconds to reuse received gas price
+GAS_PRICE_TTL = 30.0
+#: gas limit of transactions without explicit limit
+DEFAULT_GAS = 200000
+#: gas limit of the plain value transfer
+TRANSFER_GAS = 21000
+
+#: (sender address, private key, transaction, future of the transaction hash)
+QueuedTransaction = Tuple[str, str, Dict, asyncio.Future]
+
+
+def sign_transaction(transaction: Dict, private_key: str) -> str:
+    """Sign transaction and return hex encoded raw transaction.
+    """
+    return Account.sign_transaction(transaction, private_key).rawTransaction.hex()
+
+
+class TransactionService(Service):
+    """Sign and send transactions of local accounts.
+
+    Transactions submitted with `submit()` are queued and sent in batches:
+
+    * nonces are allocated locally per account in submission order, pending
+      transaction count is requested from the node only for accounts without
+      known nonce, or after a failed transaction of the account
+    * gas price is requested not often than every `gas_price_ttl` seconds
+    * missing nonces and gas price are requested in a single batch request,
+      transactions are sent in another one
+    * transactions are signed in the default executor outside of the event loop
+
+    If transaction of the batch fails, nonces of all batch accounts are
+    requested again. Later transactions of the same account are already
+    accepted by the node, but can't be mined until the nonce of the failed
+    one is used, so it is filled with zero value transfer to the account.
+    Later transactions fail if the nonce can't be filled.
+    """
+
+    #: Ethereum node client
+    client: EthereumNodeClient
+    #: number of seconds to reuse received gas price
+    gas_price_ttl: float = GAS_PRICE_TTL
+
+    def __init__(self, node_client: EthereumNodeClient, gas_price_ttl: float = GAS_PRICE_TTL, **kwargs):
+        super().__init__(**kwargs)
+        self.client = node_client
+        self.gas_price_ttl = gas_price_ttl
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._nonces: Dict[str, int] = {}
+        self._gas_price: Optional[int] = None
+        self._gas_price_expires_at = 0.0
+
+    async def submit(self, address: str, private_key: str, transaction: Dict) -> str:
+        """Queue transaction for sending and wait until node accepts it.
+
+        :param address: sender address
+        :param private_key: sender private key
+        :param transaction: transaction without nonce and gas price
+        :return: transaction hash
+        """
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((to_checksum_address(address), private_key, transaction, future))
+        return await future
+
+    @task(periodic=False)
+    async def send_transactions_task(self):
+        while not self.should_stop:
+            queued = [await self._queue.get()]
+            while not self._queue.empty():
+                queued.append(self._queue.get_nowait())
+            try:
+                await self._send(queued)
+            except Exception as e:  # noqa
+                self.log.exception("Failed to send %i transactions", len(queued))
+                for address, *_, future in queued:
+                    # allocated nonces may be not used, so they are requested again
+                    self._nonces.pop(address, None)
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _send(self, queued: List[QueuedTransaction]):
+        await self._prepare({address for address, *_ in queued})
+        loop = asyncio.get_event_loop()
+        transactions = []
+        for address, private_key, transaction, _ in queued:
+            transaction = dict(transaction, nonce=self._nonces[address], gasPrice=self._gas_price)
+            transaction.setdefault('gas', DEFAULT_GAS)
+            self._nonces[address] += 1
+            transactions.append(transaction)
+        raw_transactions = await asyncio.gather(*[
+            loop.run_in_executor(None, functools.partial(sign_transaction, transaction, private_key))
+            for transaction, (_, private_key, *_) in zip(transactions, queued)
+        ])
+        async with self.client.batch() as batch:
+            results = [batch.send_raw_transaction(raw) for raw in raw_transactions]
+        failed = self._report(queued, transactions, results)
+        if failed:
+            # nonces are requested again, so they are not lost or reused
+            for address, *_ in queued:
+                self._nonces.pop(address, None)
+        for address, (private_key, transaction, later) in failed.items():
+            if later:
+                await self._fill_nonce(address, private_key, transaction, later)
+
+    def _report(self, queued: List[QueuedTransaction], transactions: List[Dict], results: List[asyncio.Future]):
+        """Set results of sent transactions.
+
+        Return first failed transaction and later sent transactions by account.
+        """
+        failed: Dict[str, Tuple[str, Dict, List[Tuple[asyncio.Future, str]]]] = {}
+        for (address, private_key, _, future), transaction, result in zip(queued, transactions, results):
+            if future.cancelled():
+                # transaction is sent anyway, but nobody waits for it
+                future = asyncio.get_event_loop().create_future()
+            if result.exception() is not None:
+                self.log.error("Transaction from %s with nonce %i failed: %r",
+                               address, transaction['nonce'], result.exception())
+                if address not in failed:
+                    failed[address] = (private_key, transaction, [])
+                future.set_exception(result.exception())
+            elif address in failed:
+                # result is reported when nonce gap is filled
+                failed[address][2].append((future, result.result()))
+            else:
+                self.log.debug("Transaction %s sent from %s with nonce %i",
+                               result.result(), address, transaction['nonce'])
+                future.set_result(result.result())
+        return failed
+
+    async def _fill_nonce(self, address: str, private_key: str, failed: Dict,
+                          later: List[Tuple[asyncio.Future, str]]):
+        """Use nonce of the failed transaction, so later transactions can be mined.
+        """
+        transaction = {'to': address, 'value': 0, 'data': b'', 'gas': TRANSFER_GAS,
+                       'gasPrice': failed['gasPrice'], 'nonce': failed['nonce']}
+        if 'chainId' in failed:
+            transaction['chainId'] = failed['chainId']
+        try:
+            raw = await asyncio.get_event_loop().run_in_executor(
+                None, functools.partial(sign_transaction, transaction, private_key)
+            )
+            async with self.client.batch() as batch:
+                result = batch.send_raw_transaction(raw)
+            tx_hash = result.result()
+        except Exception as e:  # noqa
+            self.log.error("Nonce %i of %s can't be filled, %i later transactions won't be mined: %r",
+                           failed['nonce'], address, len(later), e)
+            for future, _ in later:
+                future.set_exception(e)
+        else:
+            self.log.warning("Nonce %i of %s filled with transaction %s", failed['nonce'], address, tx_hash)
+            for future, later_hash in later:
+                future.set_result(later_hash)
+
+    async def _prepare(self, addresses):
+        """Request gas price and nonces if they are unknown.
+        """
+        unknown = sorted(address for address in addresses if address not in self._nonces)
+        refresh_gas_price = time.monotonic() >= self._gas_price_expires_at
+        if not unknown and not refresh_gas_price:
+            return
+        async with self.client.batch() as batch:
+            gas_price = batch.gas_price() if refresh_gas_price else None
+            nonces = [batch.get_transaction_count(address, "pending") for address in unknown]
+        if gas_price is not None:
+            self._gas_price = gas_price.result()
+            self._gas_price_expires_at = time.monotonic() + self.gas_price_ttl
+        for address, nonce in zip(unknown, nonces):
+            self._nonces[address] = nonce.result()
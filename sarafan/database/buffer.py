@@ -0,0 +1,55 @@
+import logging
+from typing import Callable, Dict, Generic, Hashable, TypeVar
+
+from .collections import Collection
+
+log = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class WriteBehindBuffer(Generic[T]):
+    """Write-behind buffer for frequently updated objects.
+
+    Only the last added version of the object is kept for each key, so repeated
+    updates of the same object are coalesced into a single write. Buffered objects
+    are written to the collection in a single transaction on `flush()`.
+
+    Owner should flush buffer periodically and when it is `full`.
+    """
+
+    #: collection to flush objects to
+    collection: Collection[T]
+    #: number of buffered objects considered as full buffer
+    max_size: int
+
+    def __init__(self, collection: Collection[T], key: Callable[[T], Hashable], max_size: int = 100):
+        self.collection = collection
+        self.key = key
+        self.max_size = max_size
+        self._objects: Dict[Hashable, T] = {}
+
+    def __len__(self):
+        return len(self._objects)
+
+    @property
+    def full(self) -> bool:
+        return len(self._objects) >= self.max_size
+
+    def add(self, obj: T):
+        """Add object to the buffer replacing previous version with the same key.
+        """
+        self._objects[self.key(obj)] = obj
+
+    async def flush(self) -> int:
+        """Write all buffered objects to the collection.
+
+        :return: number of written objects
+        """
+        if not self._objects:
+            return 0
+        objects = list(self._objects.values())
+        self._objects = {}
+        log.debug("Flush %i objects to %s", len(objects), self.collection.table_name)
+        await self.collection.store_many(objects)
+        return len(objects)
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class ObjectCache(Generic[T]):
+    """In-memory LRU cache of collection objects by primary key.
+
+    Least recently used objects are evicted when cache is full.
+
+    >>> cache = ObjectCache(max_size=1)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a') is None, cache.get('b')
+    (True, 2)
+    >>> cache.hits, cache.misses
+    (1, 1)
+    """
+
+    #: maximum number of cached objects
+    max_size: int
+
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[Hashable, T]' = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[T]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: Hashable, obj: T):
+        self._entries[key] = obj
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Any):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
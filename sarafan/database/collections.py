@@ -1,32 +1,127 @@
 import logging
-import sqlite3
-from base64 import b64decode, b64encode
-from typing import TypeVar, Generic
-from urllib.parse import parse_qs, urlencode
+import time
+from collections import defaultdict
+from dataclasses import replace
+from typing import Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
 
-from ..events import Publication, Post
+from ..events import Comment, Publication, Post
 
-from .mappers import AbstractMapper, DataclassMapper, PostMapper, PublicationMapper, PeerMapper
-from ..models import Peer
+from .mappers import (
+    AbstractMapper,
+    CheckpointMapper,
+    CommentMapper,
+    DataclassMapper,
+    PostMapper,
+    PublicationMapper,
+    PeerMapper,
+)
+from .cache import ObjectCache
+from .executor import DatabaseExecutor
+from ..models import Checkpoint, Peer
 
 log = logging.getLogger(__name__)
 
 T = TypeVar('T')
 
+#: posts feed page size used if client didn't request specific one
+DEFAULT_PER_PAGE = 20
+#: maximum posts feed page size client can request
+MAX_PER_PAGE = 100
+#: maximum number of search results client can page through
+MAX_SEARCH_RESULTS = 1000
+#: number of posts indexed by the single search backfill step
+SEARCH_BACKFILL_CHUNK_SIZE = 500
+
+
+#: separator of the comment path segments, sorted before segment characters
+COMMENT_PATH_SEPARATOR = '/'
+#: maximum number of variables in the single query
+MAX_QUERY_VARIABLES = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: int, rowid: int) -> str:
+    """Encode feed position to the compact url-safe cursor.
+
+    >>> encode_cursor(1600000000, 42)
+    '5f5e1000.2a'
+    """
+    return f'{created_at:x}.{rowid:x}'
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """Decode feed position from cursor.
+
+    >>> decode_cursor('5f5e1000.2a')
+    (1600000000, 42)
+    >>> decode_cursor('wrong')
+    Traceback (most recent call last):
+    ...
+    sarafan.database.collections.InvalidCursor: wrong
+    """
+    try:
+        created_at, rowid = cursor.split('.')
+        return int(created_at, 16), int(rowid, 16)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+def build_match_query(query: str) -> str:
+    """Build FTS5 match expression from user query.
+
+    Every word is quoted, so user input can't break FTS query syntax. Posts
+    containing all of the words will match.
+
+    >>> build_match_query('hello sara"fan')
+    '"hello" "sara""fan"'
+    """
+    return ' '.join('"%s"' % word.replace('"', '""') for word in query.split())
+
+
+def comment_path_segment(created_at: int, magnet: str) -> str:
+    """Build fixed-size comment path segment.
+
+    Creation time goes first to order sibling comments chronologically,
+    magnet prefix makes segment unique.
+
+    >>> comment_path_segment(1600000000, 'a0b1c2d3e4f5a6b7c8d9')
+    '5f5e1000a0b1c2d3e4f5a6b7'
+    """
+    return f'{created_at:08x}{magnet[:16]}'
+
 
 class Collection(Generic[T]):
+    """Collection of objects stored in the database table.
+
+    All queries are executed by the database executor outside of the event loop.
+    Public methods are awaitable, blocking implementations are defined
+    in underscored methods receiving connection as the first argument.
+
+    Writes of multiple collections can be combined in a single transaction
+    with blocking `*_in()` methods receiving connection, cached objects should
+    be invalidated with `invalidate()` after the transaction.
+
+    If `cache_size` is set, objects received with `get()` are cached in memory.
+    Cached object is invalidated when an object with the same primary key
+    is stored through the collection.
+    """
     mapper: AbstractMapper
+    #: maximum number of objects cached by `get()`, cache is disabled if 0
+    cache_size: int = 0
+    #: read-through object cache, None if disabled
+    cache: Optional[ObjectCache[T]] = None
 
-    def __init__(self, db: str):
-        self._db_path = db
+    def __init__(self, executor: DatabaseExecutor, cache_size: Optional[int] = None):
+        self.executor = executor
         if not hasattr(self, 'mapper'):
             self.mapper = DataclassMapper()
-
-    @property
-    def db(self):
-        db = sqlite3.connect(self._db_path)
-        db.row_factory = sqlite3.Row
-        return db
+        if cache_size is not None:
+            self.cache_size = cache_size
+        if self.cache_size > 0:
+            self.cache = ObjectCache(max_size=self.cache_size)
 
     @property
     def table_name(self):
@@ -35,73 +130,367 @@ class Collection(Generic[T]):
     async def get(self, pk):
         """Get object from the collection by primary key.
         """
-        with self.db as db:
-            pk_column = self.mapper.get_pk_column()
-            query = f"SELECT * FROM {self.table_name} WHERE {pk_column}=?"
-            cursor = db.cursor()
-            log.debug("Retrieve %s with query `%s` %s=%s", self.mapper.model, query, pk_column, pk)
-            cursor.execute(query, [pk])
-            data = cursor.fetchone()
-            if data is None:
-                log.debug("No %s with %s=%s", self.mapper.model, pk_column, pk)
-                return None
-            return self.mapper.build_object(data)
+        if self.cache is not None:
+            obj = self.cache.get(pk)
+            if obj is not None:
+                return obj
+        obj = await self.executor.read(self._get, pk)
+        if obj is not None and self.cache is not None:
+            self.cache.put(pk, obj)
+        return obj
 
     async def store(self, obj: T):
         """Store object in database.
         """
         try:
-            with self.db as db:
-                values = self.mapper.get_insert_data(obj)
-                fields = ', '.join(values.keys())
-                subs = ','.join(['?'] * len(values))
-                query = f"INSERT OR REPLACE INTO {self.table_name} ({fields}) VALUES ({subs})"
-                cursor = db.cursor()
-                log.debug("Store %s with insert query `%s` and args %s", obj, query, values.values())
-                cursor.execute(query, list(values.values()))
+            await self.executor.write(self._store, obj)
         except Exception:  # TODO: better error handling
             log.exception("Failed to store %s", obj)
+        finally:
+            self.invalidate([obj])
+
+    async def store_many(self, objs: Iterable[T]):
+        """Store multiple objects in a single transaction.
+        """
+        objs = list(objs)
+        if not objs:
+            return
+        try:
+            await self.executor.write(self._store_many, objs)
+        except Exception:  # TODO: better error handling
+            log.exception("Failed to store %i objects to %s", len(objs), self.table_name)
+        finally:
+            self.invalidate(objs)
+
+    def store_in(self, db, obj: T):
+        """Store object using connection of the running transaction.
+        """
+        self._store(db, obj)
+
+    def store_many_in(self, db, objs: List[T]):
+        """Store multiple objects using connection of the running transaction.
+        """
+        self._store_many(db, objs)
+
+    def delete_many_in(self, db, objs: List[T]):
+        """Delete multiple objects using connection of the running transaction.
+        """
+        self._delete_many(db, objs)
+
+    def invalidate(self, objs: Iterable[T]):
+        """Drop cached objects with the same primary keys.
+        """
+        # stored row might differ from the object because of database defaults,
+        # so it will be read again on the next `get()`
+        if self.cache is not None:
+            for obj in objs:
+                self.cache.invalidate(self.mapper.get_pk(obj))
+
+    def _delete_many(self, db, objs: List[T]):
+        query = f"DELETE FROM {self.table_name} WHERE {self.mapper.get_pk_column()}=?"
+        log.debug("Delete %i objects with query `%s`", len(objs), query)
+        db.executemany(query, [[self.mapper.get_pk_value(self.mapper.get_pk(obj))] for obj in objs])
+
+    def _get(self, db, pk):
+        pk_column = self.mapper.get_pk_column()
+        query = f"SELECT {self.mapper.get_select_columns()} FROM {self.table_name} WHERE {pk_column}=?"
+        cursor = db.cursor()
+        log.debug("Retrieve %s with query `%s` %s=%s", self.mapper.model, query, pk_column, pk)
+        cursor.execute(query, [self.mapper.get_pk_value(pk)])
+        data = cursor.fetchone()
+        if data is None:
+            log.debug("No %s with %s=%s", self.mapper.model, pk_column, pk)
+            return None
+        return self.mapper.build_object(data)
+
+    def _store(self, db, obj: T):
+        query, args = self.mapper.get_insert(obj)
+        log.debug("Store %s with insert query `%s` and args %s", obj, query, args)
+        db.execute(query, args)
+
+    def _store_many(self, db, objs: List[T]):
+        # objects with different set of non-empty values need different queries
+        batches: Dict[str, List[Tuple]] = defaultdict(list)
+        for obj in objs:
+            query, args = self.mapper.get_insert(obj)
+            batches[query].append(args)
+        for query, rows in batches.items():
+            log.debug("Store %i objects with insert query `%s`", len(rows), query)
+            db.executemany(query, rows)
 
 
 class PublicationsCollection(Collection[Publication]):
     mapper = PublicationMapper()
+    # publications are immutable and addressed by magnet
+    cache_size = 1024
 
 
 class PostsCollection(Collection[Post]):
     mapper = PostMapper()
+    # posts are immutable and addressed by magnet
+    cache_size = 1024
 
-    def all(self, cursor=None, per_page=2):
-        args = []
-        query = f"SELECT ROWID, * FROM {self.table_name} "
-        if cursor is not None:
-            cursor_data = parse_qs(b64decode(cursor.encode()))
-            parse_qs(b64decode(cursor.encode()), encoding='utf-8')
-            # import ipdb; ipdb.set_trace()
-            last_time = cursor_data[b't'][0].decode()
-            last_rowid = cursor_data[b'r'][0].decode()
-            query += "WHERE created_at <= ? AND ROWID < ? "
-            args += [last_time, last_rowid]
-        query += f"ORDER BY created_at DESC LIMIT {per_page}"
-        with self.db as db:
-            cursor = db.cursor()
-            cursor.execute(query, args)
-            result = cursor.fetchall()
+    async def all(self,
+                  cursor: Optional[str] = None,
+                  per_page: int = DEFAULT_PER_PAGE) -> Tuple[List[Post], Optional[str]]:
+        """Get page of the posts feed, newest posts first.
+
+        Keyset pagination over the `(created_at, rowid)` index is used, so every
+        page costs the same regardless of its position in the feed.
+
+        :param cursor: cursor returned with the previous page
+        :param per_page: page size, limited by `MAX_PER_PAGE`
+        :raise InvalidCursor: if cursor can't be decoded
+        :return: list of posts and cursor of the next page (None for the last page)
+        """
+        position = decode_cursor(cursor) if cursor else None
+        per_page = max(1, min(per_page, MAX_PER_PAGE))
+        return await self.executor.read(self._all, position, per_page)
+
+    def _all(self, db, position: Optional[Tuple[int, int]], per_page: int):
+        args: List = []
+        query = f"SELECT {self.mapper.get_select_columns()}, rowid FROM {self.table_name} "
+        if position is not None:
+            query += "WHERE (created_at, rowid) < (?, ?) "
+            args += list(position)
+        # one more row is requested to check if there is a next page
+        query += "ORDER BY created_at DESC, rowid DESC LIMIT ?"
+        args.append(per_page + 1)
+        cursor = db.cursor()
+        cursor.execute(query, args)
+        result = cursor.fetchall()
+        next_cursor = None
+        if len(result) > per_page:
+            result = result[:per_page]
+            next_cursor = encode_cursor(result[-1]['created_at'], result[-1]['rowid'])
+        return self.mapper.build_objects(result), next_cursor
+
+    async def search(self,
+                     query: str,
+                     cursor: Optional[str] = None,
+                     per_page: int = DEFAULT_PER_PAGE) -> Tuple[List[Tuple[Post, str]], Optional[str]]:
+        """Full-text search over posts content, the most relevant posts first.
+
+        :param query: words to search
+        :param cursor: cursor returned with the previous page
+        :param per_page: page size, limited by `MAX_PER_PAGE`
+        :raise InvalidCursor: if cursor can't be decoded
+        :return: list of posts with matched content snippet and cursor of the next page
+        """
+        try:
+            offset = int(cursor) if cursor else 0
+        except ValueError:
+            raise InvalidCursor(cursor)
+        if offset < 0:
+            raise InvalidCursor(cursor)
+        per_page = max(1, min(per_page, MAX_PER_PAGE, MAX_SEARCH_RESULTS - offset))
+        match = build_match_query(query)
+        if not match or offset >= MAX_SEARCH_RESULTS:
+            return [], None
+        return await self.executor.read(self._search, match, offset, per_page)
+
+    def _search(self, db, match: str, offset: int, per_page: int):
+        query = (
+            f"SELECT {self.mapper.get_select_columns('p')}, "
+            f"snippet(sarafan_posts_search, 0, '<b>', '</b>', '…', 16) AS snippet "
+            f"FROM sarafan_posts_search s JOIN {self.table_name} p ON p.rowid = s.rowid "
+            f"WHERE sarafan_posts_search MATCH ? ORDER BY s.rank LIMIT ? OFFSET ?"
+        )
+        result = db.execute(query, [match, per_page + 1, offset]).fetchall()
         next_cursor = None
-        if len(result) == per_page:
-            next_cursor = b64encode(urlencode({
-                't': result[-1]['created_at'],
-                'r': result[-1]['ROWID']
-            }).encode()).decode()
-        return [self.mapper.build_object(item) for item in result], next_cursor
+        if len(result) > per_page:
+            result = result[:per_page]
+            if offset + per_page < MAX_SEARCH_RESULTS:
+                next_cursor = str(offset + per_page)
+        posts = self.mapper.build_objects(result)
+        return [(post, item['snippet']) for post, item in zip(posts, result)], next_cursor
+
+    async def backfill_search(self, chunk_size: int = SEARCH_BACKFILL_CHUNK_SIZE) -> int:
+        """Add next chunk of posts stored before search was introduced to the search index.
+
+        :return: number of indexed posts, 0 if there is nothing left to index
+        """
+        return await self.executor.write(self._backfill_search, chunk_size)
+
+    def _backfill_search(self, db, chunk_size: int) -> int:
+        state = db.execute(
+            "SELECT last_rowid, max_rowid FROM sarafan_posts_search_backfill WHERE id = 1"
+        ).fetchone()
+        if state is None or state['last_rowid'] >= state['max_rowid']:
+            return 0
+        rows = db.execute(
+            f"SELECT rowid, content FROM {self.table_name} "
+            f"WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?",
+            [state['last_rowid'], state['max_rowid'], chunk_size]
+        ).fetchall()
+        db.executemany(
+            "INSERT INTO sarafan_posts_search (rowid, content) VALUES (?, ?)",
+            [tuple(row) for row in rows]
+        )
+        last_rowid = rows[-1]['rowid'] if len(rows) == chunk_size else state['max_rowid']
+        db.execute("UPDATE sarafan_posts_search_backfill SET last_rowid = ? WHERE id = 1", [last_rowid])
+        return len(rows)
+
+
+class CommentsCollection(Collection[Comment]):
+    """Comment threads stored as materialized paths.
+
+    Every comment stores path of its ancestors, so adding a comment is a
+    single insert regardless of the thread size, and subtree of any comment
+    is a range scan over the `(post_magnet, path)` index.
+    """
+    mapper = CommentMapper()
+
+    async def replies(self,
+                      magnet: str,
+                      cursor: Optional[str] = None,
+                      per_page: int = DEFAULT_PER_PAGE,
+                      max_depth: Optional[int] = None) -> Tuple[List[Comment], Optional[str]]:
+        """Get page of replies to the post or comment in thread order.
+
+        Replies are ordered depth-first, every comment is followed by its
+        replies, siblings are ordered chronologically.
+
+        :param magnet: post or comment magnet
+        :param cursor: cursor returned with the previous page
+        :param per_page: page size, limited by `MAX_PER_PAGE`
+        :param max_depth: number of reply levels to return, all levels if None
+        :return: list of comments and cursor of the next page (None for the last page)
+        """
+        per_page = max(1, min(per_page, MAX_PER_PAGE))
+        return await self.executor.read(self._replies, magnet, cursor, per_page, max_depth)
+
+    def _replies(self, db, magnet: str, cursor: Optional[str], per_page: int, max_depth: Optional[int]):
+        root = self._get(db, magnet)
+        if root is None:
+            # direct replies to the post have depth 0
+            args: List = [magnet, cursor or '']
+            query = "WHERE post_magnet = ? AND path > ? "
+            max_level = max_depth - 1 if max_depth is not None else None
+        else:
+            # descendants paths are between `<path>/` and `<path>0`
+            lower = root.path + COMMENT_PATH_SEPARATOR
+            upper = root.path + chr(ord(COMMENT_PATH_SEPARATOR) + 1)
+            args = [root.post_magnet, max(lower, cursor or ''), upper]
+            query = "WHERE post_magnet = ? AND path > ? AND path < ? "
+            max_level = root.depth + max_depth if max_depth is not None else None
+        if max_level is not None:
+            query += "AND depth <= ? "
+            args.append(max_level)
+        # one more row is requested to check if there is a next page
+        query += "ORDER BY path LIMIT ?"
+        args.append(per_page + 1)
+        result = self.mapper.build_objects(db.execute(
+            f"SELECT {self.mapper.get_select_columns()} FROM {self.table_name} {query}", args
+        ))
+        next_cursor = None
+        if len(result) > per_page:
+            result = result[:per_page]
+            next_cursor = result[-1].path
+        return result, next_cursor
+
+    def _store(self, db, obj: Comment):
+        self._store_many(db, [obj])
+
+    def _store_many(self, db, objs: List[Comment]):
+        comments = self._resolve_threads(db, objs)
+        super()._store_many(db, comments)
+        self._adopt_replies(db, comments)
+
+    def _resolve_threads(self, db, comments: List[Comment]) -> List[Comment]:
+        """Resolve thread position of comments.
+
+        Comment replying to an unknown magnet is considered a direct reply
+        to the post with this magnet until the comment with this magnet is
+        stored, see `_adopt_replies`. Replies to comments of the same batch
+        are resolved after their parents, so batch can be stored in any order.
+        """
+        batch = {comment.magnet: comment for comment in comments}
+        parents = self._get_many(db, {
+            comment.reply_to for comment in comments if comment.reply_to not in batch
+        })
+        resolved: Dict[str, Comment] = {}
+        for comment in comments:
+            chain = [comment]
+            seen = {comment.magnet}
+            # walk up to the first ancestor which is not waiting for its parent
+            while chain[-1].reply_to in batch and chain[-1].reply_to not in resolved:
+                if chain[-1].reply_to in seen:
+                    log.warning("Comment %s replies to itself", chain[-1].magnet)
+                    break
+                seen.add(chain[-1].reply_to)
+                chain.append(batch[chain[-1].reply_to])
+            for item in reversed(chain):
+                if item.magnet not in resolved:
+                    parent = resolved.get(item.reply_to) or parents.get(item.reply_to)
+                    resolved[item.magnet] = self._place(item, parent)
+        return list(resolved.values())
+
+    def _adopt_replies(self, db, comments: List[Comment]):
+        """Move replies stored before their parent comments to the parents threads.
+
+        Comments are downloaded in any order, so replies to the comment might
+        be stored as replies to the post with the comment magnet. Their
+        subtree is moved under the comment with a single update.
+        """
+        db.executemany(
+            f"UPDATE {self.table_name} SET post_magnet = ?, path = ? || path, depth = depth + ? "
+            f"WHERE post_magnet = ?",
+            [(comment.post_magnet, comment.path + COMMENT_PATH_SEPARATOR, comment.depth + 1, comment.magnet)
+             for comment in comments]
+        )
+
+    def _place(self, comment: Comment, parent: Optional[Comment]) -> Comment:
+        created_at = comment.created_at or int(time.time())
+        segment = comment_path_segment(created_at, comment.magnet)
+        if parent is None:
+            return replace(comment, post_magnet=comment.reply_to, path=segment, depth=0,
+                           created_at=created_at)
+        return replace(comment,
+                       post_magnet=parent.post_magnet,
+                       path=parent.path + COMMENT_PATH_SEPARATOR + segment,
+                       depth=parent.depth + 1,
+                       created_at=created_at)
+
+    def _get_many(self, db, magnets: Iterable[str]) -> Dict[str, Comment]:
+        magnets = list(magnets)
+        result = {}
+        for start in range(0, len(magnets), MAX_QUERY_VARIABLES):
+            chunk = magnets[start:start + MAX_QUERY_VARIABLES]
+            rows = db.execute(
+                f"SELECT {self.mapper.get_select_columns()} FROM {self.table_name} "
+                f"WHERE magnet IN ({','.join(['?'] * len(chunk))})",
+                chunk
+            )
+            for comment in self.mapper.build_objects(rows):
+                result[comment.magnet] = comment
+        return result
 
 
 class PeersCollection(Collection[Peer]):
     mapper = PeerMapper()
 
-    def all(self):
-        query = "SELECT * FROM sarafan_peers;"
-        with self.db as db:
-            cursor = db.cursor()
-            cursor.execute(query)
-            result = cursor.fetchall()
-        return [self.mapper.build_object(item) for item in result]
+    async def all(self):
+        return await self.executor.read(self._all)
+
+    def _all(self, db):
+        query = f"SELECT {self.mapper.get_select_columns()} FROM {self.table_name}"
+        return self.mapper.build_objects(db.execute(query))
+
+    async def top(self, limit: int) -> List[Peer]:
+        """Get peers with the highest rating, recently seen peers first.
+        """
+        return await self.executor.read(self._top, limit)
+
+    def _top(self, db, limit: int):
+        query = (
+            f"SELECT {self.mapper.get_select_columns()} FROM {self.table_name} "
+            f"ORDER BY rating DESC, last_seen DESC LIMIT ?"
+        )
+        return self.mapper.build_objects(db.execute(query, [limit]))
+
+
+class CheckpointsCollection(Collection[Checkpoint]):
+    """Last processed blocks of blockchain event streams.
+    """
+    mapper = CheckpointMapper()
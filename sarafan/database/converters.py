@@ -0,0 +1,59 @@
+"""Conversion of model values to database values and back.
+"""
+from typing import Any
+
+
+class Converter:
+    """Identity converter.
+    """
+    def to_db(self, value: Any) -> Any:
+        return value
+
+    def from_db(self, value: Any) -> Any:
+        return value
+
+
+class HexBytes(Converter):
+    """Store hex string as binary value of the fixed size.
+
+    Value is stored twice as compact as text and compared as raw bytes. Empty
+    value `0x` is stored as empty bytes.
+
+    >>> HASH.to_db('0x' + '0f' * 32) == bytes([15] * 32)
+    True
+    >>> HASH.from_db(bytes([15] * 32)) == '0f' * 32
+    True
+    >>> ADDRESS.from_db(bytes([171] * 20))
+    '0xabababababababababababababababababababab'
+    >>> HASH.from_db(HASH.to_db('0x'))
+    '0x'
+    >>> ADDRESS.to_db('0x1234')
+    Traceback (most recent call last):
+    ...
+    ValueError: 0x1234 is not a 20 bytes hex value
+    """
+    #: value size in bytes
+    size: int
+    #: prefix of the model value
+    prefix: str
+
+    def __init__(self, size: int, prefix: str = ''):
+        self.size = size
+        self.prefix = prefix
+
+    def to_db(self, value: str) -> bytes:
+        result = bytes.fromhex(value[2:] if value.startswith('0x') else value)
+        if len(result) not in (0, self.size):
+            raise ValueError(f"{value} is not a {self.size} bytes hex value")
+        return result
+
+    def from_db(self, value: bytes) -> str:
+        if not value:
+            return '0x'
+        return self.prefix + value.hex()
+
+
+#: 32 bytes hash without prefix, like magnet
+HASH = HexBytes(32)
+#: 20 bytes ethereum address with 0x prefix
+ADDRESS = HexBytes(20, prefix='0x')
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+from typing import Any, Callable, Optional, Tuple, TypeVar
+
+from .pool import ConnectionPool
+
+log = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+DatabaseOperation = Callable[..., T]
+
+_WriteRequest = Tuple[DatabaseOperation, Tuple, Future]
+
+
+class DatabaseExecutor:
+    """Database executor.
+
+    Run blocking sqlite operations outside of the event loop thread.
+
+    Writes are serialized through the request queue and executed one by one
+    on a dedicated writer thread with the pool writer connection. Reads are
+    executed by a pool of reader threads with pool reader connections.
+
+    Operation is a callable receiving connection as the first argument::
+
+        def count_posts(db):
+            return db.execute("SELECT COUNT(*) FROM sarafan_posts").fetchone()[0]
+
+        await executor.read(count_posts)
+    """
+
+    #: connection pool used by executor threads
+    pool: ConnectionPool
+
+    _writer_thread: Optional[threading.Thread] = None
+    _readers: Optional[ThreadPoolExecutor] = None
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self._write_queue: 'Queue[Optional[_WriteRequest]]' = Queue()
+        self._last_activity = time.monotonic()
+
+    @property
+    def idle_time(self) -> float:
+        """Number of seconds since the last submitted operation.
+        """
+        return time.monotonic() - self._last_activity
+
+    @property
+    def running(self) -> bool:
+        return self._writer_thread is not None
+
+    def start(self):
+        """Start writer thread and reader thread pool.
+        """
+        if self.running:
+            raise RuntimeError("Database executor is already started")
+        self._writer_thread = threading.Thread(
+            target=self._writer_loop, name='sarafan-db-writer', daemon=True
+        )
+        self._writer_thread.start()
+        self._readers = ThreadPoolExecutor(
+            max_workers=max(self.pool.readers, 1), thread_name_prefix='sarafan-db-reader'
+        )
+
+    def stop(self):
+        """Stop executor threads.
+
+        Already queued writes will be finished first.
+        """
+        if not self.running:
+            return
+        self._write_queue.put(None)
+        self._writer_thread.join()
+        self._writer_thread = None
+        self._readers.shutdown(wait=True)
+        self._readers = None
+
+    async def write(self, operation: DatabaseOperation, *args) -> Any:
+        """Execute operation in a write transaction on the writer thread.
+
+        Transaction will be committed after operation or rolled back on exception.
+        """
+        if not self.running:
+            raise RuntimeError("Database executor is not running")
+        self._last_activity = time.monotonic()
+        future: Future = Future()
+        self._write_queue.put((operation, args, future))
+        return await asyncio.wrap_future(future)
+
+    async def read(self, operation: DatabaseOperation, *args) -> Any:
+        """Execute operation on one of the reader threads.
+        """
+        if not self.running:
+            raise RuntimeError("Database executor is not running")
+        self._last_activity = time.monotonic()
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._readers, self._read, operation, args)
+
+    def _read(self, operation: DatabaseOperation, args: Tuple):
+        with self.pool.reader() as db:
+            return operation(db, *args)
+
+    def _writer_loop(self):
+        while True:
+            request = self._write_queue.get()
+            if request is None:
+                break
+            operation, args, future = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with self.pool.writer() as db:
+                    result = operation(db, *args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        log.debug("Database writer thread finished")
@@ -0,0 +1,98 @@
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Set, Type
+
+from .collections import CheckpointsCollection, Collection
+from .executor import DatabaseExecutor
+from ..models import Checkpoint
+
+log = logging.getLogger(__name__)
+
+
+class ContractEventStore:
+    """Store contract events in batches together with the stream checkpoint.
+
+    Events of the whole block range are written in a single transaction with
+    the checkpoint of the range, so checkpoint never gets ahead of stored events.
+    Events of types without registered collection are not stored.
+    """
+
+    #: processed blocks checkpoints
+    checkpoints: CheckpointsCollection
+    #: collections to store events by event type
+    collections: Dict[Type, Collection]
+
+    def __init__(self,
+                 executor: DatabaseExecutor,
+                 checkpoints: CheckpointsCollection,
+                 collections: Dict[Type, Collection]):
+        self.executor = executor
+        self.checkpoints = checkpoints
+        self.collections = collections
+
+    @property
+    def event_types(self) -> Set[Type]:
+        """Types of events stored by the store.
+        """
+        return set(self.collections)
+
+    async def get_checkpoint(self, stream: str) -> Optional[Checkpoint]:
+        """Get last saved stream checkpoint.
+        """
+        return await self.checkpoints.get(stream)
+
+    async def ingest(self, stream: str, events: Sequence, block_number: Optional[int] = None):
+        """Store events and stream checkpoint in a single transaction.
+
+        :param stream: stream identifier
+        :param events: contract events
+        :param block_number: all stream events up to this block are processed,
+            checkpoint is not saved if None
+        """
+        batches = self._group(events)
+        if not batches and block_number is None:
+            return
+        try:
+            await self.executor.write(self._ingest, stream, batches, block_number)
+        finally:
+            for collection, objs in batches.items():
+                collection.invalidate(objs)
+        log.debug("%i events of %s stored with checkpoint at block %s",
+                  sum(map(len, batches.values())), stream, block_number)
+
+    async def retract(self, stream: str, events: Sequence, block_number: int):
+        """Delete events and rewind stream checkpoint in a single transaction.
+
+        Used when events are removed from the chain by reorganization.
+
+        :param stream: stream identifier
+        :param events: retracted contract events
+        :param block_number: last block of the stream not affected by reorganization
+        """
+        batches = self._group(events)
+        try:
+            await self.executor.write(self._retract, stream, batches, block_number)
+        finally:
+            for collection, objs in batches.items():
+                collection.invalidate(objs)
+        log.debug("%i events of %s retracted, checkpoint rewound to block %i",
+                  sum(map(len, batches.values())), stream, block_number)
+
+    def _group(self, events: Sequence) -> Dict[Collection, List]:
+        batches: Dict[Collection, List] = defaultdict(list)
+        for event in events:
+            collection = self.collections.get(type(event))
+            if collection is not None:
+                batches[collection].append(event)
+        return batches
+
+    def _retract(self, db, stream: str, batches: Dict[Collection, List], block_number: int):
+        for collection, objs in batches.items():
+            collection.delete_many_in(db, objs)
+        self.checkpoints.store_in(db, Checkpoint(stream=stream, block_number=block_number))
+
+    def _ingest(self, db, stream: str, batches: Dict[Collection, List], block_number: Optional[int]):
+        for collection, objs in batches.items():
+            collection.store_many_in(db, objs)
+        if block_number is not None:
+            self.checkpoints.store_in(db, Checkpoint(stream=stream, block_number=block_number))
@@ -0,0 +1,180 @@
+"""Database maintenance.
+
+Long running node database is periodically optimized in order to keep query
+plans fresh and to return space of removed rows to the file system.
+"""
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from .executor import DatabaseExecutor
+
+log = logging.getLogger(__name__)
+
+#: maximum number of seconds to spend on the single maintenance
+MAINTENANCE_TIME_BUDGET = 2.0
+#: minimal number of seconds between maintenances
+MAINTENANCE_INTERVAL = 3600.0
+#: number of seconds without database queries to consider database idle
+MAINTENANCE_IDLE_TIME = 5.0
+#: number of free pages returned to the file system at once
+VACUUM_PAGES_STEP = 256
+#: number of rows sampled per index by ANALYZE
+ANALYSIS_LIMIT = 400
+
+
+@dataclass
+class MaintenanceReport:
+    """Result of the single maintenance run.
+    """
+    #: unix time of maintenance start
+    started_at: float
+    #: maintenance duration in seconds
+    duration: float = 0.0
+    #: number of free pages returned to the file system
+    vacuumed_pages: int = 0
+    #: number of WAL frames checkpointed
+    checkpointed_frames: int = 0
+    #: True if maintenance was interrupted by time budget
+    interrupted: bool = False
+
+
+@dataclass
+class DatabaseStats:
+    """Database file statistics.
+    """
+    page_size: int
+    page_count: int
+    freelist_count: int
+    #: size in bytes by table or index name
+    tables: Dict[str, int] = field(default_factory=dict)
+    #: last maintenance report, None if maintenance wasn't performed yet
+    last_maintenance: Optional[MaintenanceReport] = None
+
+
+class DatabaseMaintenance:
+    """Database maintenance runner.
+
+    Maintenance steps are executed by the database executor one by one, so
+    regular queries can be executed between them:
+
+    * `PRAGMA optimize` with limited analysis to refresh query planner statistics
+    * incremental vacuum in small steps to return free pages to the file system
+    * WAL checkpoint to truncate write-ahead log
+
+    Maintenance is stopped when `time_budget` is exceeded, the rest will be done
+    on the next run.
+    """
+
+    #: maximum number of seconds to spend on the single maintenance
+    time_budget: float
+    #: minimal number of seconds between maintenances
+    interval: float
+    #: last maintenance report
+    last_report: Optional[MaintenanceReport] = None
+
+    def __init__(self,
+                 executor: DatabaseExecutor,
+                 time_budget: float = MAINTENANCE_TIME_BUDGET,
+                 interval: float = MAINTENANCE_INTERVAL,
+                 idle_time: float = MAINTENANCE_IDLE_TIME):
+        self.executor = executor
+        self.time_budget = time_budget
+        self.interval = interval
+        self.idle_time = idle_time
+
+    @property
+    def due(self) -> bool:
+        """Check if maintenance should be started now.
+
+        Maintenance is started not often than `interval` and only if database
+        was idle for `idle_time` seconds.
+        """
+        if self.last_report is not None and time.time() - self.last_report.started_at < self.interval:
+            return False
+        return self.executor.idle_time >= self.idle_time
+
+    async def run(self) -> MaintenanceReport:
+        """Run maintenance steps within the time budget.
+        """
+        report = MaintenanceReport(started_at=time.time())
+        deadline = time.monotonic() + self.time_budget
+        await self.executor.write(self._optimize)
+        while True:
+            if time.monotonic() >= deadline:
+                report.interrupted = True
+                break
+            vacuumed = await self.executor.write(self._incremental_vacuum, VACUUM_PAGES_STEP)
+            report.vacuumed_pages += vacuumed
+            if vacuumed < VACUUM_PAGES_STEP:
+                break
+        if not report.interrupted and not self.executor.pool.in_memory:
+            report.checkpointed_frames = await self.executor.write(self._checkpoint)
+        report.duration = time.time() - report.started_at
+        self.last_report = report
+        log.info("Database maintenance finished in %.3fs, %i pages vacuumed, %i frames checkpointed%s",
+                 report.duration, report.vacuumed_pages, report.checkpointed_frames,
+                 " (interrupted by time budget)" if report.interrupted else "")
+        return report
+
+    async def stats(self) -> DatabaseStats:
+        """Collect database file statistics.
+        """
+        stats = await self.executor.read(self._stats)
+        stats.last_maintenance = self.last_report
+        return stats
+
+    async def enable_incremental_vacuum(self):
+        """Switch existing database to incremental vacuum mode.
+
+        New databases are created in incremental mode by the connection pool,
+        older ones should be rebuilt once with full VACUUM. Writes are blocked
+        until the database is rebuilt.
+        """
+        await self.executor.write(self._enable_incremental_vacuum)
+
+    def _optimize(self, db: sqlite3.Connection):
+        db.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+        db.execute("PRAGMA optimize")
+
+    def _incremental_vacuum(self, db: sqlite3.Connection, pages: int) -> int:
+        before = db.execute("PRAGMA freelist_count").fetchone()[0]
+        # every statement step frees a single page, but sqlite3 module steps
+        # statements without result only once, script is executed completely
+        db.executescript(f"PRAGMA incremental_vacuum({pages})")
+        return before - db.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def _checkpoint(self, db: sqlite3.Connection) -> int:
+        busy, _, checkpointed = db.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        if busy:
+            log.debug("WAL checkpoint wasn't finished because database is busy")
+        return max(checkpointed, 0)
+
+    def _enable_incremental_vacuum(self, db: sqlite3.Connection):
+        if incremental_vacuum_enabled(db):
+            return
+        log.warning("Rebuild database to enable incremental vacuum, it can take a while")
+        started_at = time.monotonic()
+        db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        db.execute("VACUUM")
+        log.info("Database rebuilt in %.3fs", time.monotonic() - started_at)
+
+    def _stats(self, db: sqlite3.Connection) -> DatabaseStats:
+        stats = DatabaseStats(
+            page_size=db.execute("PRAGMA page_size").fetchone()[0],
+            page_count=db.execute("PRAGMA page_count").fetchone()[0],
+            freelist_count=db.execute("PRAGMA freelist_count").fetchone()[0],
+        )
+        try:
+            rows = db.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY name")
+        except sqlite3.OperationalError:  # pragma: no cover
+            log.debug("dbstat virtual table is not available, table sizes are not collected")
+        else:
+            stats.tables = {name: size for name, size in rows}
+        return stats
+
+
+def incremental_vacuum_enabled(db: sqlite3.Connection) -> bool:
+    return db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
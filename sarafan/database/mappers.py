@@ -1,11 +1,16 @@
 from dataclasses import fields
-from typing import TypeVar, Generic, Type, Dict
+from operator import attrgetter
+from typing import Callable, TypeVar, Generic, Type, Dict, Iterable, List, Optional, Sequence, Tuple
 
-from sarafan.events import Publication, Post
-from sarafan.models import Peer
+from sarafan.events import Comment, Publication, Post
+from sarafan.database.converters import ADDRESS, HASH, Converter
+from sarafan.models import Checkpoint, Peer
 
 T = TypeVar('T')
 
+#: insert query with its arguments
+InsertStatement = Tuple[str, Tuple]
+
 
 class AbstractMapper(Generic[T]):
     model: Type[T]
@@ -29,46 +34,159 @@ class AbstractMapper(Generic[T]):
     def get_pk_column(self) -> str:
         return 'id'
 
+    def get_pk_value(self, pk):
+        """Convert primary key to the database value.
+        """
+        return pk
+
+    def get_pk(self, obj: T):
+        """Get primary key of the object.
+        """
+        return getattr(obj, self.get_pk_column())
+
+    def get_select_columns(self, alias: Optional[str] = None) -> str:
+        """Comma separated list of columns to select rows accepted by `build_object`.
+
+        Extra columns can be selected after them, they are ignored by the mapper.
+        """
+        pass
+
     def build_object(self, data) -> T:
         pass
 
+    def build_objects(self, rows: Iterable) -> List[T]:
+        return [self.build_object(row) for row in rows]
+
     def get_insert_data(self, obj: T) -> Dict:
         pass
 
+    def get_insert(self, obj: T) -> InsertStatement:
+        """Build insert query and its arguments for the object.
+        """
+        pass
+
 
 class DataclassMapper(AbstractMapper[T]):
+    """Map dataclass fields to table columns.
+
+    Column list, select and insert queries are compiled once per mapper, so
+    mapping of a row is a plain positional conversion without any field
+    introspection. Rows should be selected with `get_select_columns()` to
+    keep columns in the mapper order.
+
+    Fields with None values are not inserted to let database defaults apply.
+    Insert query is compiled once for every combination of empty fields.
+
+    Values of fields listed in `converters` are converted on the mapper
+    boundary, None values are never converted.
+    """
     only_fields = None
+    #: conflict resolution of the insert query
+    on_conflict = 'REPLACE'
+    #: field value converters by field name
+    converters: Dict[str, Converter] = {}
+
+    #: mapped dataclass fields names
+    field_names: Tuple[str, ...]
+    #: table columns in the same order as `field_names`
+    columns: Tuple[str, ...]
+
+    def __init__(self, model: Type[T] = None, table_name: str = None):
+        super().__init__(model=model, table_name=table_name)
+        self.field_names = tuple(field.name for field in self._get_fields())
+        self.columns = tuple(
+            (field.metadata or {}).get('db_name') or field.name
+            for field in self._get_fields()
+        )
+        self._get_values: Callable[[T], Tuple] = attrgetter(*self.field_names)
+        if len(self.field_names) == 1:
+            getter = self._get_values
+            self._get_values = lambda obj: (getter(obj), )
+        self._insert_queries: Dict[Tuple[bool, ...], str] = {}
+        converters = tuple(self.converters.get(name) for name in self.field_names)
+        self._converters: Optional[Tuple[Optional[Converter], ...]] = \
+            converters if any(converters) else None
+        pk_column = self.get_pk_column()
+        self._pk_field: Optional[str] = None
+        self._pk_converter: Optional[Converter] = None
+        if pk_column in self.columns:
+            self._pk_field = self.field_names[self.columns.index(pk_column)]
+            self._pk_converter = self.converters.get(self._pk_field)
+
+    def get_pk_value(self, pk):
+        if pk is None or self._pk_converter is None:
+            return pk
+        return self._pk_converter.to_db(pk)
+
+    def get_pk(self, obj: T):
+        return getattr(obj, self._pk_field or self.get_pk_column())
+
+    def get_select_columns(self, alias: Optional[str] = None) -> str:
+        if alias is None:
+            return ', '.join(self.columns)
+        return ', '.join(f'{alias}.{column}' for column in self.columns)
 
     def build_object(self, data) -> T:
-        props = {}
-        for field in self._get_fields():
-            col_name = field.name
-            if field.metadata and 'db_name' in field.metadata:
-                col_name = field.metadata['db_name']
-            props[field.name] = data[col_name]
-        return self.model(**props)
+        if self._converters is not None:
+            data = self._from_db(data)
+        return self.model(**dict(zip(self.field_names, data)))
+
+    def build_objects(self, rows: Iterable) -> List[T]:
+        model, names = self.model, self.field_names
+        if self._converters is not None:
+            rows = map(self._from_db, rows)
+        return [model(**dict(zip(names, row))) for row in rows]
 
     def get_insert_data(self, obj: T) -> Dict:
-        values = {}
-        for field in self._get_fields():
-            col_name = field.name
-            if field.metadata and 'db_name' in field.metadata:
-                col_name = field.metadata['db_name']
-            v = getattr(obj, field.name)
-            if v is not None:
-                values[col_name] = v
-        return values
+        return {
+            column: value
+            for column, value in zip(self.columns, self._to_db(obj))
+            if value is not None
+        }
+
+    def get_insert(self, obj: T) -> InsertStatement:
+        values = self._to_db(obj)
+        mask = tuple(value is not None for value in values)
+        query = self._insert_queries.get(mask)
+        if query is None:
+            query = self._insert_queries[mask] = self._compile_insert(mask)
+        if all(mask):
+            return query, values
+        return query, tuple(value for value in values if value is not None)
+
+    def _to_db(self, obj: T) -> Tuple:
+        values = self._get_values(obj)
+        if self._converters is None:
+            return values
+        return tuple(
+            value if converter is None or value is None else converter.to_db(value)
+            for converter, value in zip(self._converters, values)
+        )
+
+    def _from_db(self, row) -> List:
+        return [
+            value if converter is None or value is None else converter.from_db(value)
+            for converter, value in zip(self._converters, row)
+        ]
+
+    def _compile_insert(self, mask: Sequence[bool]) -> str:
+        columns = [column for column, present in zip(self.columns, mask) if present]
+        subs = ','.join(['?'] * len(columns))
+        return f"INSERT OR {self.on_conflict} INTO {self.table_name} ({', '.join(columns)}) VALUES ({subs})"
 
     def _get_fields(self):
         all_fields = fields(self.model)
         if self.only_fields:
-            return filter(lambda x: x.name in self.only_fields, all_fields)
+            return [field for field in all_fields if field.name in self.only_fields]
         return all_fields
 
 
 class PostMapper(DataclassMapper[Post]):
     model = Post
     table_name = 'sarafan_posts'
+    converters = {
+        'magnet': HASH,
+    }
 
     def get_pk_column(self):
         return 'magnet'
@@ -77,6 +195,11 @@ class PostMapper(DataclassMapper[Post]):
 class PublicationMapper(DataclassMapper[Publication]):
     model = Publication
     table_name = 'sarafan_publications'
+    converters = {
+        'magnet': HASH,
+        'reply_to': HASH,
+        'source': ADDRESS,
+    }
 
     def get_pk_column(self):
         return 'magnet'
@@ -85,4 +208,22 @@ class PublicationMapper(DataclassMapper[Publication]):
 class PeerMapper(DataclassMapper[Peer]):
     model = Peer
     table_name = 'sarafan_peers'
-    only_fields = ('service_id', 'rating')
+    only_fields = ('service_id', 'rating', 'last_seen')
+
+
+class CheckpointMapper(DataclassMapper[Checkpoint]):
+    model = Checkpoint
+    table_name = 'sarafan_checkpoints'
+
+    def get_pk_column(self):
+        return 'stream'
+
+
+class CommentMapper(DataclassMapper[Comment]):
+    model = Comment
+    table_name = 'sarafan_comments'
+    # comment is immutable, its descendants paths depend on the stored one
+    on_conflict = 'IGNORE'
+
+    def get_pk_column(self):
+        return 'magnet'
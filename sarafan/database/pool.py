@@ -0,0 +1,139 @@
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from queue import Queue
+from typing import Dict, Iterator, List, Optional, Union
+
+log = logging.getLogger(__name__)
+
+#: in-memory database uri shared between all connections of the process
+MEMORY_DATABASE_URI = 'file::memory:?cache=shared'
+
+PragmaValue = Union[str, int]
+
+
+class ConnectionPool:
+    """SQLite connection pool.
+
+    Own a single writer connection and a set of reader connections. File
+    database is switched to WAL mode, so readers are not blocked by the writer
+    and the writer is not blocked by readers.
+
+    In-memory database has no WAL support, all operations use writer
+    connection in this case.
+
+    Connections are opened with `open()` and closed with `close()`.
+    """
+
+    #: pragmas applied to every connection
+    pragmas: Dict[str, PragmaValue] = {
+        # WAL is consistent after crash with NORMAL, only durability of the last
+        # transactions might be lost
+        'synchronous': 'NORMAL',
+        # negative value is a size in KiB
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 ** 2,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+        # free pages are returned to the file system by the maintenance, applied
+        # to the new databases only, existing ones should be vacuumed to switch
+        'auto_vacuum': 'INCREMENTAL',
+    }
+
+    #: number of reader connections
+    readers: int
+
+    _writer: Optional[sqlite3.Connection] = None
+    _readers: List[sqlite3.Connection]
+    _idle_readers: 'Queue[sqlite3.Connection]'
+
+    def __init__(self, path: str, readers: int = 4, pragmas: Optional[Dict[str, PragmaValue]] = None):
+        self.path = path
+        self.readers = 0 if self.in_memory else readers
+        self.pragmas = dict(self.pragmas, **(pragmas or {}))
+        self._write_lock = threading.RLock()
+        self._readers = []
+        self._idle_readers = Queue()
+
+    @property
+    def in_memory(self) -> bool:
+        return self.path == ':memory:'
+
+    @property
+    def closed(self) -> bool:
+        return self._writer is None
+
+    def open(self):
+        """Open writer and reader connections.
+        """
+        if not self.closed:
+            raise RuntimeError("Connection pool is already opened")
+        self._writer = self._connect()
+        if not self.in_memory:
+            mode = self._writer.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            if mode != 'wal':  # pragma: no cover
+                log.warning("Can't switch database %s to WAL mode, %s mode is used",
+                            self.path, mode)
+        for _ in range(self.readers):
+            connection = self._connect()
+            connection.execute("PRAGMA query_only=ON")
+            self._readers.append(connection)
+            self._idle_readers.put(connection)
+        log.debug("Connection pool for %s opened with %i readers", self.path, self.readers)
+
+    def close(self):
+        """Close all connections.
+        """
+        if self.closed:
+            return
+        for connection in self._readers:
+            connection.close()
+        self._readers = []
+        self._idle_readers = Queue()
+        with self._write_lock:
+            self._writer.close()
+            self._writer = None
+        log.debug("Connection pool for %s closed", self.path)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Acquire writer connection.
+
+        Transaction will be committed on exit or rolled back on exception.
+        """
+        with self._write_lock:
+            if self._writer is None:
+                raise RuntimeError("Connection pool is closed")
+            with self._writer:
+                yield self._writer
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Acquire one of the reader connections.
+
+        Writer connection is used if there are no readers configured.
+        """
+        if self.readers == 0:
+            with self.writer() as connection:
+                yield connection
+            return
+        if self.closed:
+            raise RuntimeError("Connection pool is closed")
+        connection = self._idle_readers.get()
+        try:
+            yield connection
+        finally:
+            # connection might be closed while used
+            if connection in self._readers:
+                self._idle_readers.put(connection)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.in_memory:
+            connection = sqlite3.connect(MEMORY_DATABASE_URI, uri=True, check_same_thread=False)
+        else:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {name}={value}")
+        return connection
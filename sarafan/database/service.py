@@ -1,59 +1,182 @@
+import asyncio
 import inspect
 from pathlib import Path
 
 from core_service import Service, listener, task
 
 from .collections import (
+    CheckpointsCollection,
     Collection,
+    CommentsCollection,
     PostsCollection,
     PublicationsCollection,
     PeersCollection,
 )
+from .buffer import WriteBehindBuffer
+from .executor import DatabaseExecutor
+from .ingestion import ContractEventStore
+from .maintenance import DatabaseMaintenance, DatabaseStats, incremental_vacuum_enabled
 from .migrations import apply_migrations
+from .pool import ConnectionPool
+from ..events import PeersRestored, Publication
 from ..models import Peer
 
+#: number of seconds between periodic peers buffer flushes
+PEERS_FLUSH_INTERVAL = 5.0
+#: maximum number of peers restored on start
+RESTORE_PEERS_LIMIT = 1000
+#: number of seconds between checks if maintenance should be started
+MAINTENANCE_CHECK_INTERVAL = 60.0
+
 
 class DatabaseService(Service):
 
     """Database service.
 
     Manage set of collections with a business-oriented interface.
+
+    Own a connection pool and an executor shared by all collections. Connections
+    are opened and executor threads are started on start, they are stopped
+    and closed on stop.
     """
 
     publications: PublicationsCollection = PublicationsCollection
     posts: PostsCollection = PostsCollection
     peers: PeersCollection = PeersCollection
-    # comments = CommentsCollection
+    checkpoints: CheckpointsCollection = CheckpointsCollection
+    comments: CommentsCollection = CommentsCollection
+
+    #: database connection pool
+    pool: ConnectionPool
+    #: executor running queries outside of the event loop
+    executor: DatabaseExecutor
+    #: buffer coalescing peer updates before write
+    peers_buffer: WriteBehindBuffer[Peer]
+    #: maximum number of peers restored on start
+    restore_peers_limit: int
+    #: database maintenance runner
+    maintenance: DatabaseMaintenance
+    #: rebuild database created without incremental vacuum on start
+    enable_incremental_vacuum: bool
+    #: contract events and checkpoints storage
+    contract_events: ContractEventStore
 
-    def __init__(self, database: str = ':memory:', **kwargs):
+    def __init__(self,
+                 database: str = ':memory:',
+                 readers: int = 4,
+                 peers_flush_size: int = 100,
+                 restore_peers_limit: int = RESTORE_PEERS_LIMIT,
+                 enable_incremental_vacuum: bool = False,
+                 **kwargs):
         super().__init__(**kwargs)
         if database != ':memory:':
             database = str(Path(database).resolve())
         self.log.info("Starting with database %s", database)
         self._db_path = database
+        self.restore_peers_limit = restore_peers_limit
+        self.enable_incremental_vacuum = enable_incremental_vacuum
+        self.pool = ConnectionPool(database, readers=readers)
+        self.executor = DatabaseExecutor(self.pool)
+        self.maintenance = DatabaseMaintenance(self.executor)
         self._initialize_collections()
+        self.contract_events = ContractEventStore(
+            self.executor, self.checkpoints, collections={
+                Publication: self.publications,
+            }
+        )
+        self.peers_buffer = WriteBehindBuffer(
+            self.peers, key=lambda peer: peer.service_id, max_size=peers_flush_size
+        )
 
     def _initialize_collections(self):
         for name, value in inspect.getmembers(self, lambda x: isinstance(x, type) and issubclass(x, Collection)):
-            setattr(self, name, value(db=self._db_path))
+            setattr(self, name, value(executor=self.executor))
 
     async def start(self):
-        apply_migrations(self._db_path)
+        # pool should be opened first to keep in-memory database alive for migrations
+        self.pool.open()
+        try:
+            apply_migrations(self._db_path)
+            with self.pool.writer() as db:
+                incremental_vacuum = incremental_vacuum_enabled(db)
+        except Exception:
+            self.pool.close()
+            raise
+        self.executor.start()
+        if not incremental_vacuum and not self.enable_incremental_vacuum:
+            self.log.info("Incremental vacuum is disabled for the database, free pages are not returned "
+                          "to the file system until the database is rebuilt")
         await super().start()
 
     async def stop(self):
         await super().stop()
+        await self.peers_buffer.flush()
+        self.executor.stop()
+        self.pool.close()
         self.log.info("Database connection was closed")
 
     @listener(Peer)
     async def store_peers(self, peer: Peer):
         """Store all Peers emited on service bus in the database.
+
+        Peers are buffered and written in batches, repeated updates of the same
+        peer are coalesced.
+        """
+        self.peers_buffer.add(peer)
+        if self.peers_buffer.full:
+            await self.peers_buffer.flush()
+
+    @task(periodic=True, sleep_interval=PEERS_FLUSH_INTERVAL)
+    async def flush_peers(self):
+        """Periodically write buffered peer updates.
+        """
+        await self.peers_buffer.flush()
+
+    @task(periodic=True, sleep_interval=MAINTENANCE_CHECK_INTERVAL)
+    async def maintain(self):
+        """Run database maintenance when database is idle.
+        """
+        if self.maintenance.due:
+            await self.maintenance.run()
+
+    @task(periodic=False)
+    async def rebuild(self):
+        """Rebuild database created without incremental vacuum if enabled.
+
+        Database is rebuilt by the executor, so the event loop is not blocked.
+        """
+        if self.enable_incremental_vacuum:
+            await self.maintenance.enable_incremental_vacuum()
+
+    async def stats(self) -> DatabaseStats:
+        """Database file statistics and last maintenance report.
+        """
+        return await self.maintenance.stats()
+
+    @task(periodic=False)
+    async def backfill_search(self):
+        """Add posts stored before search was introduced to the search index.
+
+        Posts are indexed in small chunks to not block writer for a long time.
         """
-        await self.peers.store(peer)
+        total = 0
+        while not self.should_stop:
+            indexed = await self.posts.backfill_search()
+            if indexed == 0:
+                break
+            total += indexed
+            await asyncio.sleep(0)
+        if total:
+            self.log.info("Search index backfill finished, %i posts indexed", total)
 
     @task(periodic=False)
     async def restore_peers(self):
-        self.log.info("Restoring peers from the database")
-        for peer in self.peers.all():
-            self.log.info("Restoring peer %s", peer)
-            await self.emit(peer)
+        """Restore the best known peers from the database.
+
+        Only `restore_peers_limit` peers with the highest rating are restored,
+        they are emitted as a single `PeersRestored` event.
+        """
+        peers = await self.peers.top(self.restore_peers_limit)
+        self.log.info("%i peers restored from the database", len(peers))
+        if peers:
+            await self.emit(PeersRestored(peers=peers))
@@ -1,20 +1,61 @@
+import copy
 import logging
 import math
+from typing import Dict, Iterator, Optional, Tuple
 
 log = logging.getLogger(__name__)
 
+#: desired number of logs in the single response
+TARGET_RESULTS = 5000
+#: number of blocks in the region with the separate events density estimation
+REGION_SIZE = 10000
+#: weight of the new sample in the moving averages
+SMOOTHING = 0.3
+#: step size multiplier on slow response or too many results
+DECREASE_FACTOR = 0.5
 
-class BlockRange:
-    """Block range iterator.
-
-    Generate a pairs of (from_block, to_block).
-
-    `retry` method can be used to drastically decrease range on next iteration
 
-    `record_time` should be used to record response time and align range size to achieve
-        `target_time` the next time
+class BlockRange:
+    """Adaptive block range iterator.
+
+    Generate a pairs of (from_block, to_block), from the lower block in forward
+    mode and from the upper block in reverse mode.
+
+    Range size is controlled AIMD-style by the feedback recorded with `record`:
+
+    * step size is doubled until the first slow or too large response
+      (slow start), after that it is increased by `increase_size`
+    * step size is halved if response took more than `target_time` or contains
+      more than `target_results` logs
+    * step size never exceeds the number of blocks served within `target_time`
+      according to the moving average of time per block
+
+    Moving average of the events density is tracked by block regions, so ranges
+    are narrowed in dense regions only. `record_result_limit` should be used
+    when node refuses to serve the range, `retry` repeats the last range with
+    the smaller size.
+
+    >>> block_range = BlockRange(from_block=0, to_block=9, start_size=4)
+    >>> list(block_range)
+    [(0, 3), (4, 7), (8, 9)]
+    >>> block_range = BlockRange(from_block=0, to_block=9, start_size=4, reverse=True)
+    >>> windows = iter(block_range)
+    >>> next(windows)
+    (6, 9)
+    >>> block_range.retry()
+    >>> list(windows)
+    [(8, 9), (6, 7), (4, 5), (2, 3), (0, 1)]
     """
 
+    #: number of blocks in the next range
+    step_size: int
+    #: moving average of the response time per block
+    latency: Optional[float] = None
+    #: moving average of logs per block by block region
+    density: Dict[int, float]
+    #: step size grows exponentially until the first decrease
+    slow_start: bool = True
+
     def __init__(
         self,
         from_block: int = None,
@@ -24,82 +65,140 @@ class BlockRange:
         min_size: int = 1,
         reverse: int = False,
         target_time: float = 10.0,
+        target_results: int = TARGET_RESULTS,
+        increase_size: Optional[int] = None,
+        region_size: int = REGION_SIZE,
     ):
         assert (
             from_block is not None or to_block is not None
         ), "One of `from_block` or `to_block` should be provided"
+        assert not reverse or to_block is not None, "Reverse iteration requires `to_block`"
         if from_block is None:
             from_block = 0
         self.from_block = from_block
-        self.cursor = from_block
         self.to_block = to_block
-        self.step_size = start_size
         self.max_size = max_size
         self.min_size = min_size
+        self.step_size = self._clamp(start_size)
         self.reverse = reverse
         self.target_time = target_time
+        self.target_results = target_results
+        if increase_size is None:
+            increase_size = max(start_size // 10, 1)
+        self.increase_size = increase_size
+        self.region_size = region_size
+        self.cursor = to_block if reverse else from_block
+        self.density = {}
+        self._last: Optional[Tuple[int, int]] = None
 
     @property
     def step(self):
         s = self.step_size - 1
         return -s if self.reverse else s
 
-    def __iter__(self):
-        if self.reverse:
-            _to = self.to_block
-            _from = _to + self.step
-            if _from < self.from_block:
-                _from = self.from_block
-        else:
-            _from = self.from_block or 0
-            _to = _from + self.step
-            if self.to_block and _to > self.to_block:
-                _to = self.to_block
-
-        self._to = _to
-        self._from = _from
-
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
         while True:
-            yield self._from, self._to
             if self.reverse:
-                self._to = self._from - 1
-                self._from = self._to + self.step
+                if self.cursor < self.from_block:
+                    log.debug("End of block range")
+                    return
+                window = (max(self.cursor - self.window_size(self.cursor) + 1, self.from_block), self.cursor)
+                self.cursor = window[0] - 1
             else:
-                self._from = self._to + 1
-                self._to = self._from + self.step
-            if self._to < 0:
-                log.debug("End of block range")
-                return
+                if self.to_block is not None and self.cursor > self.to_block:
+                    log.debug("End of block range")
+                    return
+                window = (self.cursor, self.cursor + self.window_size(self.cursor) - 1)
+                if self.to_block is not None:
+                    window = (window[0], min(window[1], self.to_block))
+                self.cursor = window[1] + 1
+            self._last = window
+            yield window
+
+    def shifted(self, from_block: int) -> 'BlockRange':
+        """Copy of the forward range starting from the block.
+
+        Collected response statistics are preserved.
+        """
+        block_range = copy.copy(self)
+        block_range.from_block = block_range.cursor = from_block
+        block_range.density = dict(self.density)
+        block_range._last = None
+        return block_range
+
+    def window_size(self, block: int) -> int:
+        """Number of blocks in the range starting at the block.
+
+        Step size is limited by the events density of the block region.
+        """
+        density = self.density.get(self._region(block))
+        if not density:
+            return self.step_size
+        return self._clamp(min(self.step_size, math.floor(self.target_results / density)))
 
     def retry(self):
         """Retry last interval with decreased step size.
 
         Step size will be decreased by 2 but will be not less than minimal step size.
         """
-        if self.reverse:
-            self._to -= self.step - 1
-            self._from -= self.step - 1
+        if self._last is None:
+            return
+        from_block, to_block = self._last
+        self.cursor = to_block if self.reverse else from_block
+        self._last = None
+        self._decrease()
+
+    def record(self, from_block: int, to_block: int, t: float, results: int = 0) -> int:
+        """Record response of the range and adjust step size according it.
+
+        :param from_block: first block of the range
+        :param to_block: last block of the range
+        :param t: number of seconds range was fetched
+        :param results: number of logs in the response
+        :return: new step size
+        """
+        size = to_block - from_block + 1
+        self.latency = self._average(self.latency, t / size)
+        for region in self._regions(from_block, to_block):
+            self.density[region] = self._average(self.density.get(region), results / size)
+
+        if t > self.target_time or results > self.target_results:
+            self._decrease()
+        elif self.slow_start:
+            self.step_size = self._clamp(self.step_size * 2)
         else:
-            self._to -= self.step + 1
-            self._from -= self.step + 1
-
-        self.step_size = self.step_size // 2
-        if self.step_size < self.min_size:
-            self.step_size = self.min_size
+            self.step_size = self._clamp(self.step_size + self.increase_size)
+        if self.latency > 0:
+            self.step_size = self._clamp(min(self.step_size, math.floor(self.target_time / self.latency)))
+        return self.step_size
 
-    def record_time(self, t: float):
-        """Record last interval execution time and adjust step size according it.
+    def record_result_limit(self, from_block: int, to_block: int) -> int:
+        """Record that node refused to return logs of the too wide range.
 
-        TODO: moving average should be used
+        Ranges of the same block regions are narrowed at least twice.
 
-        :param t: number of seconds last interval executed
         :return: new step size
         """
-        self.step_size = min(
-            max(
-                math.ceil(self.step_size * min(max(self.target_time / t, 0.5), 2)),
-                self.min_size,
-            ),
-            self.max_size,
-        )
+        density = 2 * self.target_results / (to_block - from_block + 1)
+        for region in self._regions(from_block, to_block):
+            self.density[region] = max(self.density.get(region, 0), density)
+        self._decrease()
         return self.step_size
+
+    def _decrease(self):
+        self.slow_start = False
+        self.step_size = self._clamp(math.floor(self.step_size * DECREASE_FACTOR))
+
+    def _clamp(self, size: int) -> int:
+        return min(max(size, self.min_size), self.max_size)
+
+    def _average(self, value: Optional[float], sample: float) -> float:
+        if value is None:
+            return sample
+        return value + SMOOTHING * (sample - value)
+
+    def _region(self, block: int) -> int:
+        return block // self.region_size
+
+    def _regions(self, from_block: int, to_block: int) -> range:
+        return range(self._region(from_block), self._region(to_block) + 1)
@@ -2,62 +2,99 @@
 
 Minimal functionality used by Sarafan.
 """
+import asyncio
+import itertools
+import json
 import logging
-from typing import List, Optional, Any, Dict
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession, ClientTimeout, ClientWebSocketResponse, TCPConnector, WSMsgType
 
-from .exceptions import EXCEPTIONS_MAP, EthereumNodeException
+from .exceptions import EthereumNodeException, get_exception_class
 from .event import Event
+from .pool import MAX_BLOCK_LAG, HEDGE_PERCENTILE, PINNED_METHODS, Endpoint, EndpointPool
 from ..logging_helpers import pformat
 
 log = logging.getLogger(__name__)
 
+#: maximum number of simultaneous connections to the node
+CONNECTIONS_LIMIT = 10
+#: number of seconds to keep idle connection to the node open
+KEEPALIVE_TIMEOUT = 30.0
+#: number of seconds to wait for the node connection
+CONNECT_TIMEOUT = 10.0
+#: number of seconds to wait for the whole request including response
+REQUEST_TIMEOUT = 60.0
+#: number of seconds between WebSocket pings
+HEARTBEAT_INTERVAL = 30.0
 
-class EthereumNodeClient:
-    """Ethereum node client.
+#: endpoint failures, request is retried with another endpoint
+ENDPOINT_ERRORS = (ClientError, asyncio.TimeoutError, ValueError)
 
-    Utilise ethereum node standard JSON-RPC interface.
-    """
+#: (request body, response parser, future of the result) of the batch call
+BatchCall = Tuple[Dict, Callable[[Dict], Any], asyncio.Future]
 
-    def __init__(self, node_url: str = "http://127.0.0.1:7545/"):
-        self.node_url = node_url
-        self._session = ClientSession()
 
-    @property
-    def closed(self):
-        """Check if client was closed.
-        """
-        return self._session.closed
+def _result(data: Dict) -> Any:
+    return data.get("result")
 
-    async def close(self):
-        """Close client and free resources.
-        """
-        await self._session.close()
 
-    async def block_number(self) -> int:
+def _quantity(data: Dict) -> int:
+    return int(data.get("result"), 16)
+
+
+def _accounts(data: Dict) -> List[str]:
+    return data.get("result", [])
+
+
+def _logs(data: Dict) -> List[Event]:
+    return [Event.from_raw_event(raw_event) for raw_event in data.get("result")]
+
+
+def _gas(data: Dict) -> int:
+    res = data.get("result")
+    try:
+        if res is not None:
+            return int(res[2:], 16)
+        log.error("Empty result for eth_estimateGas")
+        raise EthereumNodeException("Gas estimation error")
+    except (ValueError, TypeError):
+        log.error("Wrong eth_estimateGas response (not an int): %s", res)
+        raise EthereumNodeException("Wrong estimate gas response")
+
+
+class EthereumNodeMethods:
+    """Ethereum node JSON-RPC methods.
+
+    Methods build the request and return awaitable result of the abstract
+    `_call()`: coroutine of the client, which sends the request when awaited,
+    or future of the batch request, which adds the call immediately.
+    """
+
+    def _call(self, method: str, params=None, parse: Callable[[Dict], Any] = _result) -> Awaitable:
+        raise NotImplementedError()  # pragma: no cover
+
+    def block_number(self) -> Awaitable[int]:
         """Get last block number.
         """
-        res = await self.request("eth_blockNumber")
-        return int(res.get("result"), 16)
+        return self._call("eth_blockNumber", parse=_quantity)
 
-    async def chain_id(self) -> int:
+    def chain_id(self) -> Awaitable[int]:
         """Get current chain id.
         """
-        data = await self.request("eth_chainId")
-        return int(data.get("result"), 16)
+        return self._call("eth_chainId", parse=_quantity)
 
-    async def accounts(self) -> List[str]:
-        res = await self.request('eth_accounts')
-        return res.get('result', [])
+    def accounts(self) -> Awaitable[List[str]]:
+        return self._call('eth_accounts', parse=_accounts)
 
-    async def get_logs(
+    def get_logs(
         self,
         address: str,
         from_block: int,
         to_block: Optional[int] = None,
         topics: Optional[List[str]] = None,
-    ) -> List[Event]:
+    ) -> Awaitable[List[Event]]:
         """Get contract event logs.
 
         :param address: contract address
@@ -73,103 +110,417 @@ class EthereumNodeClient:
             params["toBlock"] = hex(to_block)
         if topics:
             params["topics"] = topics
-        data = await self.request("eth_getLogs", [params])
-        return [Event.from_raw_event(raw_event) for raw_event in data.get("result")]
+        return self._call("eth_getLogs", [params], parse=_logs)
 
-    async def get_transaction_count(self, address, tag=None) -> int:
+    def get_transaction_count(self, address, tag=None) -> Awaitable[int]:
         """Get number of transactions for specific address.
         """
         params = [address]
         if tag:
             params.append(tag)
-        data = await self.request("eth_getTransactionCount", params)
-        return int(data.get("result"), 16)
+        return self._call("eth_getTransactionCount", params, parse=_quantity)
 
-    async def gas_price(self) -> int:
+    def gas_price(self) -> Awaitable[int]:
         """Get current gas price.
         """
-        data = await self.request("eth_gasPrice")
-        return int(data.get("result"), 16)
+        return self._call("eth_gasPrice", parse=_quantity)
 
-    async def estimate_gas(self, from_address: str, code: str, to: str = None) -> int:
+    def estimate_gas(self, from_address: str, code: str, to: str = None) -> Awaitable[int]:
         """Estimate gas for transaction execution.
         """
         params = {"from": from_address, "data": code}
         if to:
             params["to"] = to
-        data = await self.request("eth_estimateGas", [params])
-        res = data.get("result")
-        try:
-            if res is not None:
-                return int(res[2:], 16)
-            log.error("Empty result for eth_estimateGas")
-            raise EthereumNodeException("Gas estimation error")
-        except (ValueError, TypeError):
-            log.error("Wrong eth_estimateGas response (not an int): %s", res)
-            raise EthereumNodeException("Wrong estimate gas response")
-
-    async def send_transaction(self, tx_object):
+        return self._call("eth_estimateGas", [params], parse=_gas)
+
+    def send_transaction(self, tx_object) -> Awaitable[str]:
         """Send transaction and return transaction hash.
 
         FIXME: unused
         """
-        data = await self.request("eth_sendTransaction", [tx_object])
-        return data.get("result")
+        return self._call("eth_sendTransaction", [tx_object])
 
-    async def call(self, tx_object):
-        data = await self.request('eth_call', [tx_object])
-        return data.get('result')
+    def call(self, tx_object) -> Awaitable[str]:
+        return self._call('eth_call', [tx_object])
 
-    async def send_raw_transaction(self, tx_object) -> str:
+    def send_raw_transaction(self, tx_object) -> Awaitable[str]:
         """Send raw transaction and return transaction hash.
         """
-        data = await self.request("eth_sendRawTransaction", [tx_object])
-        return data.get("result")
+        return self._call("eth_sendRawTransaction", [tx_object])
 
-    async def get_transaction_receipt(self, tx_hash: str):
+    def get_transaction_receipt(self, tx_hash: str) -> Awaitable[Dict]:
         """Retrieve transaction receipt from node.
         """
-        data = await self.request("eth_getTransactionReceipt", [tx_hash])
-        return data.get("result")
+        return self._call("eth_getTransactionReceipt", [tx_hash])
 
-    async def request(self, method, params=None):
-        """Send request to ethereum node.
 
-        :param method: RPC method name
-        :param params: params
-        :return: RPC response
+class EthereumNodeClient(EthereumNodeMethods):
+    """Ethereum node client.
+
+    Utilise ethereum node standard JSON-RPC interface.
+
+    Multiple calls can be sent in a single JSON-RPC batch request::
+
+        async with client.batch() as batch:
+            gas_price = batch.gas_price()
+            nonce = batch.get_transaction_count(address, "pending")
+        print(gas_price.result(), nonce.result())
+
+    Multiple node urls can be provided, requests are routed between them by
+    the `EndpointPool`. `check_health()` should be called periodically to
+    update endpoints block numbers.
+
+    If `ws_url` is provided, node notifications can be received with
+    `eth_subscribe` over WebSocket::
+
+        async with client.subscribe("newHeads") as subscription:
+            async for head in subscription:
+                print(int(head["number"], 16))
+    """
+
+    #: node WebSocket endpoint, subscriptions are not available if None
+    ws_url: Optional[str] = None
+
+    def __init__(self,
+                 node_url: Union[str, Sequence[str]] = "http://127.0.0.1:7545/",
+                 ws_url: Optional[str] = None,
+                 connections_limit: int = CONNECTIONS_LIMIT,
+                 keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 request_timeout: float = REQUEST_TIMEOUT,
+                 max_block_lag: int = MAX_BLOCK_LAG,
+                 hedge_percentile: float = HEDGE_PERCENTILE):
+        node_urls = [node_url] if isinstance(node_url, str) else list(node_url)
+        self.pool = EndpointPool(node_urls, max_block_lag=max_block_lag, hedge_percentile=hedge_percentile)
+        self.node_url = node_urls[0]
+        self.ws_url = ws_url
+        self.connections_limit = connections_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self._session: Optional[ClientSession] = None
+        self._closed = False
+        self._request_ids = itertools.count(1)
+
+    @property
+    def closed(self):
+        """Check if client was closed.
+        """
+        return self._closed
+
+    @property
+    def session(self) -> ClientSession:
+        """HTTP session with pool of keep-alive node connections.
+
+        Session is created on the first request.
+
+        :raise EthereumNodeException: if client is closed
+        """
+        if self._closed:
+            raise EthereumNodeException("Ethereum node client is closed")
+        if self._session is None:
+            self._session = ClientSession(
+                connector=TCPConnector(
+                    limit=self.connections_limit,
+                    keepalive_timeout=self.keepalive_timeout,
+                ),
+                timeout=ClientTimeout(
+                    total=self.request_timeout,
+                    sock_connect=self.connect_timeout,
+                ),
+            )
+        return self._session
+
+    async def close(self):
+        """Close client and free resources.
+
+        Pooled connections are closed, client can't be used after that.
+        """
+        self._closed = True
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    def batch(self) -> 'BatchRequest':
+        """Create batch request.
+
+        Methods called on the batch return futures, all of them are sent in
+        a single request on exit from `async with` block.
+        """
+        return BatchRequest(self)
+
+    def subscribe(self, kind: str, params: Optional[Dict] = None) -> 'Subscription':
+        """Create `eth_subscribe` subscription.
+
+        :param kind: subscription type like `newHeads` or `logs`
+        :param params: subscription params, like `logs` filter
+        :raise EthereumNodeException: if WebSocket endpoint is not configured
+        """
+        if self.ws_url is None:
+            raise EthereumNodeException("Node WebSocket endpoint is not configured")
+        return Subscription(self, kind, params)
+
+    def build_request(self, method, params=None) -> Dict:
+        """Build JSON-RPC request body with unique id.
         """
-        # if self._session.closed:  # pragma: no cover
-        #     log.warning("HTTP client session is closed, request interrupted")
-        #     return
-        log.debug("Ethereum node request method `%s`, params: %s", method, pformat(params))
         request_body = {
             "jsonrpc": "2.0",
-            "id": 1,
+            "id": next(self._request_ids),
             "method": method,
         }
         if params:
             request_body["params"] = params
+        return request_body
 
-        async with ClientSession() as session:
-            resp = await session.post(
-                self.node_url,
-                json={"jsonrpc": "2.0", "id": 1, "method": method, "params": params},
-            )
-            data = await resp.json()
+    async def request(self, method, params=None):
+        """Send request to ethereum node.
 
+        :param method: RPC method name
+        :param params: params
+        :return: RPC response
+        """
+        log.debug("Ethereum node request method `%s`, params: %s", method, pformat(params))
+        data = await self._post(self.build_request(method, params))
         log.debug("Ethereum node response:\n%s", pformat(data))
-        if "error" in data:
-            message = data["error"].get("message")
-            log.error(
-                "Ethereum node request to method `%s` with params `%s`"
-                "failed with error: %s",
-                method,
-                pformat(params),
-                pformat(data["error"]),
-            )
-            if message in EXCEPTIONS_MAP:
-                cls = EXCEPTIONS_MAP[message]
-                raise cls()
-            raise EthereumNodeException()
+        check_response(method, params, data)
+        return data
+
+    async def _call(self, method: str, params=None, parse: Callable[[Dict], Any] = _result):
+        return parse(await self.request(method, params))
+
+    async def check_health(self):
+        """Update block number and latency of every node endpoint.
+        """
+        async def check(endpoint: Endpoint):
+            try:
+                data = await self._send(endpoint, self.build_request("eth_blockNumber"), "eth_blockNumber")
+                check_response("eth_blockNumber", None, data)
+                self.pool.update_block_number(endpoint, int(data["result"], 16))
+            except (EthereumNodeException, *ENDPOINT_ERRORS) as e:
+                self.pool.fail(endpoint, e)
+        await asyncio.gather(*[check(endpoint) for endpoint in self.pool.endpoints])
+        log.debug("Node endpoints checked: %s", self.pool.endpoints)
+
+    async def _post(self, body):
+        methods = [item["method"] for item in body] if isinstance(body, list) else [body["method"]]
+        if PINNED_METHODS.intersection(methods):
+            return await self._write(body, methods[0])
+        return await self._read(body, methods[0] if len(set(methods)) == 1 else "batch")
+
+    async def _write(self, body, method: str):
+        # pinned endpoint is changed on failure, so retry goes to the next one
+        error: Optional[BaseException] = None
+        for _ in self.pool.endpoints:
+            try:
+                return await self._send(self.pool.write_endpoint(), body, method)
+            except ENDPOINT_ERRORS as e:
+                error = e
+        raise EthereumNodeException(f"All node endpoints failed: {error!r}")
+
+    async def _read(self, body, method: str):
+        candidates = self.pool.read_endpoints()
+        error: Optional[BaseException] = None
+        while candidates:
+            endpoint = candidates.pop(0)
+            request = asyncio.ensure_future(self._send(endpoint, body, method))
+            delay = self.pool.hedge_delay(endpoint, method)
+            if delay is not None and candidates:
+                done, _ = await asyncio.wait({request}, timeout=delay)
+                if not done:
+                    hedge = candidates.pop(0)
+                    log.debug("No response from %s in %.3fs, hedge %s to %s", endpoint.url, delay, method, hedge.url)
+                    request = self._first_response(request, asyncio.ensure_future(self._send(hedge, body, method)))
+            try:
+                return await request
+            except ENDPOINT_ERRORS as e:
+                error = e
+        raise EthereumNodeException(f"All node endpoints failed: {error!r}")
+
+    @staticmethod
+    async def _first_response(*requests: asyncio.Future):
+        pending = set(requests)
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for request in done:
+                    if request.exception() is None or not pending:
+                        return request.result()
+        finally:
+            for request in pending:
+                request.cancel()
+            # let cancelled requests record their latency
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _send(self, endpoint: Endpoint, body, method: str):
+        started_at = time.monotonic()
+        try:
+            async with self.session.post(endpoint.url, json=body) as resp:
+                data = await resp.json()
+        except ENDPOINT_ERRORS as e:
+            self.pool.fail(endpoint, e)
+            raise
+        except asyncio.CancelledError:
+            # losing hedged request is cancelled, its latency is still accounted
+            endpoint.record_cancelled(method, time.monotonic() - started_at)
+            raise
+        self.pool.succeed(endpoint, method, time.monotonic() - started_at)
         return data
+
+
+class SubscriptionClosed(EthereumNodeException):
+    """WebSocket connection of the subscription is closed.
+    """
+
+    pass
+
+
+class Subscription:
+    """Node notifications received with `eth_subscribe` over WebSocket.
+
+    Should be used as an async context manager, WebSocket connection is
+    opened on enter and closed on exit. Notification results are received
+    by async iteration, iteration raises `SubscriptionClosed` if connection
+    is lost.
+    """
+
+    #: subscription id assigned by the node
+    id: Optional[str] = None
+
+    def __init__(self, client: EthereumNodeClient, kind: str, params: Optional[Dict] = None):
+        self.client = client
+        self.kind = kind
+        self.params = params
+        self._ws: Optional[ClientWebSocketResponse] = None
+
+    async def __aenter__(self) -> 'Subscription':
+        self._ws = await self.client.session.ws_connect(self.client.ws_url, heartbeat=HEARTBEAT_INTERVAL)
+        try:
+            params = [self.kind] + ([self.params] if self.params else [])
+            request = self.client.build_request("eth_subscribe", params)
+            await self._ws.send_json(request)
+            # notifications can't be received before the subscription response
+            data = await self._receive()
+            check_response("eth_subscribe", params, data)
+        except BaseException:
+            await self._ws.close()
+            raise
+        self.id = data["result"]
+        log.debug("Subscribed to %s notifications with id %s", self.kind, self.id)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if not self._ws.closed:
+            try:
+                await self._ws.send_json(self.client.build_request("eth_unsubscribe", [self.id]))
+            except Exception:  # noqa
+                log.debug("Can't unsubscribe %s, connection lost", self.id)
+        await self._ws.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Any:
+        while True:
+            data = await self._receive()
+            if data.get("method") == "eth_subscription" and data["params"]["subscription"] == self.id:
+                return data["params"]["result"]
+
+    async def _receive(self) -> Dict:
+        msg = await self._ws.receive()
+        if msg.type == WSMsgType.TEXT:
+            return json.loads(msg.data)
+        raise SubscriptionClosed(f"Subscription connection closed with {msg.type.name} message")
+
+
+def check_response(method, params, data: Dict):
+    """Raise exception if JSON-RPC response contains error.
+
+    Known errors are raised as exceptions from `EXCEPTIONS_MAP`,
+    `EthereumNodeException` is raised for others.
+    """
+    if "error" not in data:
+        return
+    message = data["error"].get("message")
+    log.error(
+        "Ethereum node request to method `%s` with params `%s`"
+        "failed with error: %s",
+        method,
+        pformat(params),
+        pformat(data["error"]),
+    )
+    raise get_exception_class(message)(message)
+
+
+class BatchRequest(EthereumNodeMethods):
+    """JSON-RPC batch request.
+
+    Should be used as an async context manager. Every node method called
+    on the batch adds the call and returns its future, calls are sent in a
+    single request on exit and responses are matched with calls by request
+    id. Error of the single call is set as exception of its future only.
+
+    Calls are not sent if exception is raised inside the block.
+    """
+
+    def __init__(self, client: EthereumNodeClient):
+        self.client = client
+        self._calls: List[BatchCall] = []
+
+    async def __aenter__(self) -> 'BatchRequest':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            calls, self._calls = self._calls, []
+            for _, _, future in calls:
+                future.cancel()
+            return
+        await self.execute()
+
+    def request(self, method, params=None) -> asyncio.Future:
+        """Add call to the batch.
+
+        :return: future of the raw response
+        """
+        return self._call(method, params, parse=lambda data: data)
+
+    def _call(self, method: str, params=None, parse: Callable[[Dict], Any] = _result) -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        self._calls.append((self.client.build_request(method, params), parse, future))
+        return future
+
+    async def execute(self):
+        """Send all added calls in a single request.
+        """
+        calls, self._calls = self._calls, []
+        if not calls:
+            return
+        log.debug("Ethereum node batch request with %i calls", len(calls))
+        try:
+            data = await self.client._post([body for body, _, _ in calls])
+        except Exception as e:
+            for _, _, future in calls:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            self._set_results(calls, data)
+        finally:
+            for _, _, future in calls:
+                future.cancel()
+
+    def _set_results(self, calls: List[BatchCall], data):
+        if isinstance(data, dict):
+            # node can respond with a single error to the whole batch
+            data = [dict(data, id=body["id"]) for body, _, _ in calls]
+        responses = {response.get("id"): response for response in data}
+        for body, parse, future in calls:
+            if future.done():
+                continue
+            response = responses.get(body["id"])
+            try:
+                if response is None:
+                    raise EthereumNodeException("No response to batch call %s" % body["method"])
+                check_response(body["method"], body.get("params"), response)
+                future.set_result(parse(response))
+            except Exception as e:
+                future.set_exception(e)
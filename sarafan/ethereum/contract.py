@@ -1,10 +1,11 @@
 import re
 import logging
+from collections import defaultdict
 from dataclasses import make_dataclass, field, fields, dataclass
-from typing import Dict, List, Type, Union, Optional
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Type, Union, Optional
 
 from Cryptodome.Hash import keccak
-from eth_abi import decode_abi, decode_single, encode_abi, encode_single
+from eth_abi import decode_abi, encode_abi, encode_single
 from .event import Event
 
 log = logging.getLogger(__name__)
@@ -39,6 +40,34 @@ def abi_to_signature(abi: Dict) -> bytes:
     return keccak.new(digest_bytes=32, data=bytes(signature, "ascii")).digest()[:4]
 
 
+@dataclass(frozen=True)
+class DecodePlan:
+    """Precompiled information to encode and decode contract event.
+
+    Built once per event class, see `BaseContractEvent.get_decode_plan()`.
+    """
+    #: event signature hash hex digest
+    signature_hash: str
+    #: names of indexed fields in topics order
+    indexed_names: Tuple[str, ...]
+    #: abi types of indexed fields
+    indexed_types: Tuple[str, ...]
+    #: names of not indexed fields in data order
+    data_names: Tuple[str, ...]
+    #: abi types of not indexed fields
+    data_types: Tuple[str, ...]
+    #: decoded value transformations by field name
+    transforms: Tuple[Tuple[str, Callable[[Any], Any]], ...]
+
+
+def _hex_bytes(value: bytes) -> str:
+    return value.hex()
+
+
+def _ascii_bytes(value: bytes) -> str:
+    return value.decode('ascii').rstrip('\x00')
+
+
 @dataclass
 class BaseContractEvent:
     """Base class for contract events.
@@ -54,81 +83,87 @@ class BaseContractEvent:
     def data(self):
         """Get encoded data for contract event.
         """
-        input_types = []
-        input_values = []
-        for f in fields(self):
-            if not f.metadata["abi_indexed"]:
-                input_types.append(f.metadata["abi_type"])
-                value = getattr(self, f.name)
-                # if ETH_TO_DATACLASS_TYPE[f.metadata["abi_type"]] is str:
-                #     value = bytes(value, 'ascii')
-                input_values.append(value)
-        return '0x' + encode_abi(input_types, input_values).hex()
+        plan = self.get_decode_plan()
+        input_values = [getattr(self, name) for name in plan.data_names]
+        return '0x' + encode_abi(plan.data_types, input_values).hex()
 
     def topics(self):
         """Get encoded topics list for contract event.
         """
-        return ['0x%s' % self.get_signature_hash()] + [
-            '0x' + encode_single(f.metadata["abi_type"], getattr(self, f.name)).hex()
-            for f in fields(self) if f.metadata["abi_indexed"]
+        plan = self.get_decode_plan()
+        return ['0x%s' % plan.signature_hash] + [
+            '0x' + encode_single(t, getattr(self, n)).hex()
+            for n, t in zip(plan.indexed_names, plan.indexed_types)
         ]
 
     def topics_types(self) -> Dict:
-        indexed_types = []
-        indexed_names = []
-        for f in fields(self):
-            if f.metadata["abi_indexed"]:
-                indexed_types.append(f.metadata["abi_type"])
-                indexed_names.append(f.name)
-        return dict(zip(indexed_names, indexed_types))
+        plan = self.get_decode_plan()
+        return dict(zip(plan.indexed_names, plan.indexed_types))
 
     @classmethod
-    def from_event(cls, event: Event):
-        """Decode event data to contract event.
+    def get_decode_plan(cls) -> DecodePlan:
+        """Get decode plan of the event class.
+
+        Plan is built on the first call and stored on the class.
         """
-        # collect information about `data` fields positions and types,
-        # and indexed field types (in topics)
-        # TODO: we should do it only once
-        input_types = []
-        field_names = []
-        indexed_types = []
-        indexed_names = []
-        for f in fields(cls):
-            if f.metadata["abi_indexed"]:
-                indexed_types.append(f.metadata["abi_type"])
-                indexed_names.append(f.name)
-            else:
-                input_types.append(f.metadata["abi_type"])
-                field_names.append(f.name)
-
-        # decode `topics` using collected type information and merge them with
-        # names by position
-        data = {
-            n: decode_single(t, bytes.fromhex(d[2:]))
-            for n, t, d in zip(indexed_names, indexed_types, event.topics[1:])
-        }
-        # decode events `data` content using collected indexed types
-        decoded = decode_abi(input_types, bytes.fromhex(event.data[2:]))
-        # merge decoded values with field name by position and update
-        data.update(dict(zip(field_names, decoded)))
-        # convert camel-case event property names to snake-case
-        snake_data = {camel_to_snake(key): value for key, value in data.items()}
-        # apply fields transformations
+        plan = cls.__dict__.get('_decode_plan')
+        if plan is None:
+            plan = cls._build_decode_plan()
+            cls._decode_plan = plan
+        return plan
+
+    @classmethod
+    def _build_decode_plan(cls) -> DecodePlan:
+        indexed, not_indexed, transforms = [], [], []
         for f in fields(cls):
+            (indexed if f.metadata["abi_indexed"] else not_indexed).append((f.name, f.metadata["abi_type"]))
             if f.metadata.get("abi_hex_bytes"):
-                snake_data[f.name] = snake_data[f.name].hex()
+                transforms.append((f.name, _hex_bytes))
             elif f.metadata.get("abi_ascii_bytes"):
-                snake_data[f.name] = snake_data[f.name].decode('ascii').rstrip('\x00')
-        return cls(**snake_data)
+                transforms.append((f.name, _ascii_bytes))
+        args_sig = ",".join([f.metadata["abi_type"] for f in fields(cls)])
+        return DecodePlan(
+            signature_hash=keccak.new(
+                digest_bytes=32, data=bytes(f"{cls.__name__}({args_sig})", "ascii")
+            ).hexdigest(),
+            indexed_names=tuple(n for n, _ in indexed),
+            indexed_types=tuple(t for _, t in indexed),
+            data_names=tuple(n for n, _ in not_indexed),
+            data_types=tuple(t for _, t in not_indexed),
+            transforms=tuple(transforms),
+        )
+
+    @classmethod
+    def from_event(cls, event: Event):
+        """Decode event data to contract event.
+        """
+        return cls.from_events([event])[0]
+
+    @classmethod
+    def from_events(cls, events: Iterable[Event]) -> List['BaseContractEvent']:
+        """Decode data of multiple events of the class.
+        """
+        plan = cls.get_decode_plan()
+        result = []
+        for event in events:
+            # every indexed value of static type occupies a whole topic,
+            # so topics are decoded at once as a sequence of words
+            values = decode_abi(
+                plan.indexed_types,
+                b''.join(bytes.fromhex(topic[2:]) for topic in event.topics[1:len(plan.indexed_types) + 1]),
+            )
+            data = dict(zip(plan.indexed_names, values))
+            data.update(zip(plan.data_names, decode_abi(plan.data_types, bytes.fromhex(event.data[2:]))))
+            for name, transform in plan.transforms:
+                data[name] = transform(data[name])
+            result.append(cls(**data))
+        return result
 
     @classmethod
     def get_signature_hash(cls):
         """Get event signature hash.
         """
-        args_sig = ",".join([f.metadata["abi_type"] for f in fields(cls)])
-        return keccak.new(
-            digest_bytes=32, data=bytes(f"{cls.__name__}({args_sig})", "ascii")
-        ).hexdigest()
+        return cls.get_decode_plan().signature_hash
 
 
 class ContractMethod:
@@ -245,6 +280,21 @@ class Contract:
         type_cls = self.signatures[event.topics[0][2:]]
         return type_cls.from_event(event)
 
+    def parse_many(self, events: Iterable[Event]) -> List[BaseContractEvent]:
+        """Parse blockchain events page keeping the order.
+
+        Events are decoded in groups by event type.
+        """
+        groups: Dict[Type[BaseContractEvent], List[int]] = defaultdict(list)
+        events = list(events)
+        for i, event in enumerate(events):
+            groups[self.signatures[event.topics[0][2:]]].append(i)
+        result: List[Optional[BaseContractEvent]] = [None] * len(events)
+        for type_cls, positions in groups.items():
+            for i, contract_event in zip(positions, type_cls.from_events(events[i] for i in positions)):
+                result[i] = contract_event
+        return result
+
     def call(self, method_name, *args, **kwargs) -> bytes:
         """Get transaction data for method call.
         """
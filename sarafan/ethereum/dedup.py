@@ -0,0 +1,127 @@
+"""Deduplication of contract event logs.
+
+Not finalized blocks are requested again to detect chain reorganizations, so
+the same logs are received multiple times. Logs are identified by
+(block number, transaction hash, log index), only logs of not finalized
+blocks are remembered.
+"""
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .event import Event
+
+log = logging.getLogger(__name__)
+
+#: log identifier, transaction can emit multiple logs
+EventKey = Tuple[int, str, int]
+
+
+def event_key(event: Event) -> EventKey:
+    return event.block_number, event.transaction_hash, event.log_index
+
+
+@dataclass
+class BlockEvents:
+    """Delivered logs of the single block.
+    """
+    block_hash: str
+    events: Dict[EventKey, Event] = field(default_factory=dict)
+
+
+@dataclass
+class Reconciliation:
+    """Result of the block range reconciliation with delivered logs.
+    """
+    #: logs not delivered before in the received order
+    new: List[Event] = field(default_factory=list)
+    #: delivered logs of the replaced blocks, the latest first
+    retracted: List[Event] = field(default_factory=list)
+    #: first replaced block, None if chain wasn't reorganized
+    fork_block: Optional[int] = None
+
+
+class EventDeduplicator:
+    """Bounded set of delivered logs with reorg detection.
+
+    Block range response is compared with logs delivered before. If a
+    delivered log is missing or its block hash is changed, the block is
+    considered replaced by reorganization, all delivered logs starting from
+    this block are retracted and forgotten.
+
+    Logs of blocks up to the finalized watermark are forgotten, and logs of
+    these blocks are not delivered again.
+
+    >>> dedup = EventDeduplicator()
+    >>> first = Event(0, 10, '0xa', '0x1', 0, '0x0', '0x', [])
+    >>> second = Event(1, 10, '0xa', '0x1', 0, '0x0', '0x', [])
+    >>> len(dedup.reconcile(10, 10, [first]).new)
+    1
+    >>> len(dedup.reconcile(10, 11, [first, second]).new)
+    1
+    >>> dedup.reconcile(10, 11, [Event(0, 11, '0xb', '0x2', 0, '0x0', '0x', [])]).fork_block
+    10
+    >>> dedup.finalize(11)
+    >>> len(dedup), dedup.reconcile(11, 11, [Event(0, 11, '0xb', '0x2', 0, '0x0', '0x', [])]).new
+    (0, [])
+    """
+
+    #: logs of blocks up to watermark are finalized
+    watermark: Optional[int] = None
+
+    def __init__(self):
+        self._blocks: Dict[int, BlockEvents] = {}
+
+    def __len__(self):
+        return sum(len(block.events) for block in self._blocks.values())
+
+    def reconcile(self, from_block: int, to_block: int, events: Iterable[Event]) -> Reconciliation:
+        """Reconcile complete block range response with delivered logs.
+
+        :param from_block: first block of the range
+        :param to_block: last block of the range
+        :param events: all logs of the block range
+        :return: new and retracted logs
+        """
+        events = [event for event in events if self.watermark is None or event.block_number > self.watermark]
+        received: Dict[int, List[Event]] = defaultdict(list)
+        for event in events:
+            received[event.block_number].append(event)
+
+        result = Reconciliation()
+        for block_number in sorted(b for b in self._blocks if from_block <= b <= to_block):
+            known = self._blocks[block_number]
+            block_events = received.get(block_number, [])
+            if any(event.block_hash != known.block_hash for event in block_events) or \
+                    not known.events.keys() <= {event_key(event) for event in block_events}:
+                result.fork_block = block_number
+                result.retracted = self._rewind(block_number)
+                log.warning("Chain reorganization detected at block %i, %i events retracted",
+                            block_number, len(result.retracted))
+                break
+
+        for event in events:
+            block = self._blocks.get(event.block_number)
+            if block is None:
+                block = self._blocks[event.block_number] = BlockEvents(block_hash=event.block_hash)
+            key = event_key(event)
+            if key not in block.events:
+                block.events[key] = event
+                result.new.append(event)
+        return result
+
+    def finalize(self, block_number: int):
+        """Forget logs of finalized blocks.
+        """
+        if self.watermark is not None and block_number <= self.watermark:
+            return
+        self.watermark = block_number
+        for finalized in [b for b in self._blocks if b <= block_number]:
+            del self._blocks[finalized]
+
+    def _rewind(self, fork_block: int) -> List[Event]:
+        retracted = []
+        for block_number in sorted((b for b in self._blocks if b >= fork_block), reverse=True):
+            retracted.extend(reversed(list(self._blocks.pop(block_number).events.values())))
+        return retracted
@@ -14,6 +14,36 @@ class FilterNotFound(EthereumNodeException):
     pass
 
 
+class ResultLimitExceeded(EthereumNodeException):
+    """Node refused to return logs of the too wide block range.
+
+    Request should be repeated with the smaller block range.
+    """
+
+    pass
+
+
+#: node exceptions by error message or its prefix
 EXCEPTIONS_MAP = {
     "Filter not found": FilterNotFound,
+    "query returned more than": ResultLimitExceeded,
+    "Log response size exceeded": ResultLimitExceeded,
+    "exceed maximum block range": ResultLimitExceeded,
+    "block range is too wide": ResultLimitExceeded,
 }
+
+
+def get_exception_class(message: str) -> type:
+    """Get exception class by node error message.
+
+    >>> get_exception_class("query returned more than 10000 results")
+    <class 'sarafan.ethereum.exceptions.ResultLimitExceeded'>
+    >>> get_exception_class("execution reverted")
+    <class 'sarafan.ethereum.exceptions.EthereumNodeException'>
+    """
+    if message in EXCEPTIONS_MAP:
+        return EXCEPTIONS_MAP[message]
+    for prefix, cls in EXCEPTIONS_MAP.items():
+        if message and message.startswith(prefix):
+            return cls
+    return EthereumNodeException
@@ -0,0 +1,181 @@
+"""Pool of Ethereum node JSON-RPC endpoints.
+
+Requests are routed by the node client according to endpoints health:
+
+* reads are sent to the fastest endpoint in sync with the chain head, the
+  next endpoints are used if it fails
+* slow `eth_getLogs` and `eth_call` reads are hedged: if response is not
+  received within the latency percentile of the endpoint, request is sent
+  to the second endpoint too and the first response is used
+* writes and pending nonce reads are pinned to a single endpoint, so
+  transactions are seen by the same transaction pool
+"""
+import logging
+import math
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Sequence
+
+log = logging.getLogger(__name__)
+
+#: maximum number of blocks endpoint can lag behind the best one to be in sync
+MAX_BLOCK_LAG = 2
+#: latency percentile after which read is sent to the second endpoint
+HEDGE_PERCENTILE = 90.0
+#: minimal number of latency samples to calculate hedge delay
+MIN_HEDGE_SAMPLES = 20
+#: number of latency samples kept per method
+LATENCY_SAMPLES = 200
+#: weight of the new sample in the latency moving average
+SMOOTHING = 0.3
+
+#: methods sending transactions or depending on the endpoint transaction pool
+PINNED_METHODS = frozenset({"eth_sendRawTransaction", "eth_sendTransaction", "eth_getTransactionCount"})
+#: methods hedged to the second endpoint if response is slow
+HEDGED_METHODS = frozenset({"eth_getLogs", "eth_call"})
+
+
+class Endpoint:
+    """Node endpoint health statistics.
+    """
+
+    #: last block number reported by the endpoint
+    block_number: Optional[int] = None
+    #: moving average of the response time
+    latency: Optional[float] = None
+    #: False if the last request failed
+    healthy: bool = True
+
+    def __init__(self, url: str):
+        self.url = url
+        self.samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))
+
+    def __repr__(self):
+        return f"Endpoint({self.url!r}, block_number={self.block_number}, latency={self.latency})"
+
+    def record(self, method: str, latency: float):
+        """Record successful response time.
+        """
+        self.healthy = True
+        self._add_sample(method, latency)
+
+    def record_cancelled(self, method: str, elapsed: float):
+        """Record time of the request cancelled before response.
+
+        Response would take at least `elapsed` seconds, so it is used as a
+        sample to not bias latency of slow endpoints towards fast responses.
+        """
+        self._add_sample(method, elapsed)
+
+    def _add_sample(self, method: str, latency: float):
+        self.samples[method].append(latency)
+        self.latency = latency if self.latency is None else self.latency + SMOOTHING * (latency - self.latency)
+
+    def percentile(self, method: str, percentile: float) -> Optional[float]:
+        """Get response time percentile of the method.
+
+        :return: None if there are not enough samples
+        """
+        samples = self.samples.get(method)
+        if not samples or len(samples) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(math.ceil(len(ordered) * percentile / 100) - 1, len(ordered) - 1)]
+
+
+class EndpointPool:
+    """Node endpoints ordered by health.
+
+    >>> pool = EndpointPool(['http://a', 'http://b', 'http://c'])
+    >>> a, b, c = pool.endpoints
+    >>> pool.update_block_number(a, 100)
+    >>> pool.update_block_number(b, 97)
+    >>> pool.update_block_number(c, 100)
+    >>> a.record('eth_blockNumber', 0.5)
+    >>> c.record('eth_blockNumber', 0.1)
+    >>> [e.url for e in pool.read_endpoints()]
+    ['http://c', 'http://a', 'http://b']
+    >>> pool.write_endpoint().url
+    'http://a'
+    """
+
+    #: maximum number of blocks endpoint can lag behind the best one
+    max_block_lag: int
+    #: latency percentile after which hedged read is sent to the second endpoint
+    hedge_percentile: float
+
+    def __init__(self,
+                 urls: Sequence[str],
+                 max_block_lag: int = MAX_BLOCK_LAG,
+                 hedge_percentile: float = HEDGE_PERCENTILE):
+        if not urls:
+            raise ValueError("At least one node endpoint required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.max_block_lag = max_block_lag
+        self.hedge_percentile = hedge_percentile
+        self._pinned: Optional[Endpoint] = None
+
+    @property
+    def block_number(self) -> Optional[int]:
+        """Best known block number.
+        """
+        known = [e.block_number for e in self.endpoints if e.healthy and e.block_number is not None]
+        return max(known) if known else None
+
+    def in_sync(self, endpoint: Endpoint) -> bool:
+        best = self.block_number
+        if best is None or endpoint.block_number is None:
+            return True
+        return endpoint.block_number >= best - self.max_block_lag
+
+    def read_endpoints(self) -> List[Endpoint]:
+        """Endpoints to read from, the best first.
+
+        Healthy endpoints in sync with the chain head ordered by latency are
+        followed by others, so request can be retried while any endpoint is alive.
+        """
+        def key(item):
+            i, endpoint = item
+            latency = endpoint.latency if endpoint.latency is not None else math.inf
+            return not endpoint.healthy, not self.in_sync(endpoint), latency, i
+        return [endpoint for _, endpoint in sorted(enumerate(self.endpoints), key=key)]
+
+    def write_endpoint(self) -> Endpoint:
+        """Endpoint to send transactions to.
+
+        Endpoint is kept until it fails, then the first healthy endpoint in
+        configuration order is pinned.
+        """
+        if self._pinned is None or not self._pinned.healthy:
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+            pinned = healthy[0] if healthy else self.endpoints[0]
+            if pinned is not self._pinned:
+                log.info("Pin node endpoint %s for transactions", pinned.url)
+            self._pinned = pinned
+        return self._pinned
+
+    def hedge_delay(self, endpoint: Endpoint, method: str) -> Optional[float]:
+        """Number of seconds to wait for response before hedging the read.
+
+        :return: None if request shouldn't be hedged
+        """
+        if method not in HEDGED_METHODS or len(self.endpoints) < 2:
+            return None
+        return endpoint.percentile(method, self.hedge_percentile)
+
+    def update_block_number(self, endpoint: Endpoint, block_number: int):
+        self.succeed(endpoint)
+        endpoint.block_number = block_number
+
+    def succeed(self, endpoint: Endpoint, method: Optional[str] = None, latency: Optional[float] = None):
+        """Mark endpoint healthy after successful response.
+        """
+        if not endpoint.healthy:
+            log.info("Node endpoint %s recovered", endpoint.url)
+        endpoint.healthy = True
+        if method is not None and latency is not None:
+            endpoint.record(method, latency)
+
+    def fail(self, endpoint: Endpoint, error: BaseException):
+        if endpoint.healthy:
+            log.warning("Node endpoint %s failed: %r", endpoint.url, error)
+        endpoint.healthy = False
@@ -3,7 +3,7 @@
 Any service can subscribe or emit them. Some of the events stored in the database if emitted.
 """
 from dataclasses import dataclass, field
-from typing import Set
+from typing import List, Set
 
 from dataclasses_json import dataclass_json
 
@@ -145,6 +145,18 @@ class NewPeer(BaseContractEvent):
     hostname: str = event_field('hostname', 'bytes32', ascii_bytes=True)
 
 
+@dataclass_json
+@dataclass
+class PeersRestored:
+    """Peers restored from the database.
+
+    Emitted by the DatabaseService on start and consumed by the PeeringService to fill
+    the peer table with a single bulk load.
+    """
+    #: best peers, highest rating first
+    peers: List[Peer]
+
+
 @dataclass_json
 @dataclass
 class Post:
@@ -156,3 +168,39 @@ class Post:
     magnet: str
     content: str
     created_at: int = None
+
+
+@dataclass_json
+@dataclass
+class Comment:
+    """Comment model.
+
+    Comment is a publication replying to a post or to another comment. Thread
+    position (`post_magnet`, `path` and `depth`) is resolved by the database
+    on store.
+    """
+    magnet: str
+    #: replied post or comment magnet
+    reply_to: str
+    content: str
+    #: root post of the thread
+    post_magnet: str = None
+    #: materialized path of the comment in the thread
+    path: str = None
+    #: comment nesting level, 0 for direct replies to the post
+    depth: int = None
+    created_at: int = None
+
+
+@dataclass
+class ContractEventRetracted:
+    """Contract event removed from the chain by reorganization.
+
+    Emitted by the :py:class:`ContractEventService` for every delivered event of
+    the replaced blocks, the latest first. Event of the new chain is emitted
+    again if it is included in the other block.
+    """
+    event: BaseContractEvent
+    #: block of the replaced chain the event was included in
+    block_number: int
+    block_hash: str
@@ -9,6 +9,18 @@ class Peer:
     version: Optional[str] = None
     rating: float = .5
     address: Optional[str] = None
+    #: unix time of the last successful communication with the peer
+    last_seen: Optional[int] = None
 
     def __hash__(self):
         return hash(self.service_id)
+
+
+@dataclass
+class Checkpoint:
+    """Blockchain event stream checkpoint.
+    """
+    #: stream identifier, contract address
+    stream: str
+    #: all stream events up to this block (inclusive) are processed
+    block_number: int
@@ -8,14 +8,15 @@ Main responsibilities:
 """
 import asyncio
 import logging
+import time
 from dataclasses import dataclass
 from itertools import chain
-from typing import List, Dict
+from typing import Dict, Iterable, List
 
 from aiohttp_socks import ProxyError
 from core_service import Service, listener
 
-from ..events import NewPeer, DiscoveryRequest, DiscoveryFinished, DiscoveryFailed
+from ..events import NewPeer, DiscoveryRequest, DiscoveryFinished, DiscoveryFailed, PeersRestored
 from ..distance import ascii_to_hash_distance
 
 from ..models import Peer
@@ -80,6 +81,24 @@ class PeeringService(Service):
         self.peers_by_rating.sort(key=lambda x: x.rating)
         await self._cleanup_peers()
 
+    async def add_peers(self, peers: Iterable[Peer]):
+        """Add multiple peers to known network.
+
+        Peer list is sorted and cleaned up once for the whole batch. Already known
+        peers are ignored.
+        """
+        added = 0
+        for peer in peers:
+            if peer.service_id in self.peers:
+                continue
+            self.peers[peer.service_id] = peer
+            self.peers_by_rating.append(peer)
+            added += 1
+        if added:
+            self.peers_by_rating.sort(key=lambda x: x.rating)
+            await self._cleanup_peers()
+        self.log.debug("%i peers added", added)
+
     async def remove_peer(self, peer: Peer):
         """Remove peer from known network.
         """
@@ -148,6 +167,12 @@ class PeeringService(Service):
         if peer.service_id not in self.peers:
             await self.add_peer(peer)
 
+    @listener(PeersRestored)
+    async def handle_restored_peers(self, restored: PeersRestored):
+        """Bulk load peers restored from the database.
+        """
+        await self.add_peers(restored.peers)
+
     @listener(DiscoveryRequest)
     async def handle_discovery_request(self, request: DiscoveryRequest):
         """DiscoveryRequest handler.
@@ -170,6 +195,7 @@ class PeeringService(Service):
                     try:
                         # TODO: we can check for magnet and discover in parallel
                         new_peers = await client.discover(magnet)
+                        peer.last_seen = int(time.time())
                         peer.rating *= 2
                         await self.emit(peer)
                         for p in chain(new_peers.match, new_peers.near):
@@ -210,6 +236,8 @@ class PeeringService(Service):
             delete_count = peers_count - self.max_peer_count
             self.log.debug("There are %i peers but %i is a maximum, need to delete %i peers",
                            peers_count, self.max_peer_count, delete_count)
-            for p in self.peers_by_rating[:delete_count]:
+            removed = self.peers_by_rating[:delete_count]
+            self.peers_by_rating = self.peers_by_rating[delete_count:]
+            for p in removed:
                 self.log.debug("Cleanup peer %s", p)
-                await self.remove_peer(p)
+                del self.peers[p.service_id]
@@ -61,3 +61,8 @@ class StorageService(Service):
         """Get local path for unpacked publication content.
         """
         return self.base_path / 'unpacked' / magnet_path(magnet)
+
+    def get_render_path(self) -> Path:
+        """Get local path for rendered publications cache.
+        """
+        return self.base_path / 'rendered'
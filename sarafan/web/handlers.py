@@ -1,3 +1,4 @@
+import dataclasses
 import json
 import math
 import os
@@ -13,6 +14,7 @@ from aiohttp.web_exceptions import HTTPBadRequest
 from aiohttp.web_request import Request
 from aiohttp.web_response import Response
 
+from sarafan.database.collections import DEFAULT_PER_PAGE, InvalidCursor
 from sarafan.magnet import is_magnet
 
 log = logging.getLogger(__name__)
@@ -170,9 +172,19 @@ async def awards(request):
 
 async def post_list(request):
     """List of posts.
+
+    ?cursor=XXX - use cursor from the previous page response for consistent pagination
+    ?per_page=<int> - number of posts per page (limited by node)
     """
     cursor = request.query.get('cursor')
-    posts, next_cursor = request.app['sarafan'].app.db.posts.all(cursor=cursor)
+    try:
+        per_page = int(request.query.get('per_page', DEFAULT_PER_PAGE))
+        posts, next_cursor = await request.app['sarafan'].app.db.posts.all(
+            cursor=cursor, per_page=per_page
+        )
+    except (ValueError, InvalidCursor):
+        log.error("Invalid posts pagination parameters %s", request.query)
+        raise HTTPBadRequest()
     log.debug("Posts received: %s", posts)
     return web.json_response({
         "result": [
@@ -182,6 +194,71 @@ async def post_list(request):
     })
 
 
+async def search(request):
+    """Full-text search over stored posts.
+
+    ?q=<words> - words to search, posts containing all of them are returned
+    ?cursor=XXX - use cursor from the previous page response to get the next page
+    ?per_page=<int> - number of posts per page (limited by node)
+    """
+    query = request.query.get('q', '')
+    cursor = request.query.get('cursor')
+    try:
+        per_page = int(request.query.get('per_page', DEFAULT_PER_PAGE))
+        results, next_cursor = await request.app['sarafan'].app.db.posts.search(
+            query, cursor=cursor, per_page=per_page
+        )
+    except (ValueError, InvalidCursor):
+        log.error("Invalid search parameters %s", request.query)
+        raise HTTPBadRequest()
+    return web.json_response({
+        "result": [
+            dict(post.to_dict(), snippet=snippet) for post, snippet in results
+        ],
+        "next_cursor": next_cursor,
+    })
+
+
+async def comment_list(request):
+    """Replies to the post or comment in thread order.
+
+    Every comment is followed by its replies.
+
+    ?cursor=XXX - use cursor from the previous page response for consistent pagination
+    ?per_page=<int> - number of comments per page (limited by node)
+    ?depth=<int> - number of reply levels to return, all levels by default
+    """
+    magnet = request.match_info['magnet']
+    cursor = request.query.get('cursor')
+    try:
+        per_page = int(request.query.get('per_page', DEFAULT_PER_PAGE))
+        depth = int(request.query['depth']) if 'depth' in request.query else None
+    except ValueError:
+        log.error("Invalid comments pagination parameters %s", request.query)
+        raise HTTPBadRequest()
+    if not is_magnet(magnet) or (depth is not None and depth < 1):
+        raise HTTPBadRequest()
+    comments, next_cursor = await request.app['sarafan'].app.db.comments.replies(
+        magnet, cursor=cursor, per_page=per_page, max_depth=depth
+    )
+    return web.json_response({
+        "result": [
+            comment.to_dict() for comment in comments
+        ],
+        "next_cursor": next_cursor,
+    })
+
+
+async def database_stats(request):
+    """Node database statistics.
+
+    `tables` contains size in bytes of every table and index.
+    `last_maintenance` contains report of the last database maintenance or null.
+    """
+    stats = await request.app['sarafan'].app.db.stats()
+    return web.json_response(dataclasses.asdict(stats))
+
+
 async def create_post(request):
     """Create post and estimate publication cost.
     """
@@ -253,6 +330,9 @@ def setup_routes(app, cors, node=True, content_path=None, client=True):
             web.get('/abuses', abuses),
             web.get('/awards', awards),
             web.get('/api/posts', post_list),
+            web.get('/api/search', search),
+            web.get('/api/comments/{magnet}', comment_list),
+            web.get('/api/stats', database_stats),
             web.post('/api/create_post', create_post),
             web.post('/api/publish', publish),
             web.static('/', Path(__file__).parent.parent.parent / 'build')
@@ -1,13 +1,23 @@
 import asyncio
+import inspect
+from contextlib import contextmanager
+from typing import Dict
 from unittest import mock
 
 import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 from async_timeout import timeout
+from core_service.bus import ServiceBus
 
 from sarafan.contract.event_service import ContractEventService
+from sarafan.database.service import DatabaseService
+from sarafan.events import ContractEventRetracted, Publication
 from sarafan.ethereum import EthereumNodeClient, Contract, Event
 from sarafan.contract.abi import CONTENT_CONTRACT
 from sarafan.ethereum.block_range import BlockRange
+from sarafan.ethereum.exceptions import ResultLimitExceeded
+from sarafan.models import Checkpoint
 
 
 def rnd_hash(digest_bytes=32):
@@ -23,6 +33,40 @@ def rnd_address():
     return str(rnd_hash(28)[:42])
 
 
+def raw_log(event: Event) -> Dict:
+    return {"logIndex": hex(event.log_index), "blockNumber": hex(event.block_number),
+            "blockHash": event.block_hash, "transactionHash": event.transaction_hash,
+            "transactionIndex": hex(event.transaction_index), "address": event.address,
+            "data": event.data, "topics": event.topics}
+
+
+@contextmanager
+def node_methods(node_client, get_logs: mock.Mock = None, block_number: mock.Mock = None):
+    """Answer node client requests with mocked node methods.
+
+    Mocks receive arguments of the client methods, so request building and
+    response parsing of the client are still used.
+    """
+    get_logs = get_logs or mock.Mock(return_value=[])
+    block_number = block_number or mock.Mock(return_value=0)
+
+    async def post(body):
+        if body["method"] == "eth_blockNumber":
+            result = hex(block_number())
+        else:
+            params = body["params"][0]
+            to_block = int(params["toBlock"], 16) if "toBlock" in params else None
+            events = get_logs(params["address"], int(params["fromBlock"], 16), to_block,
+                              topics=params.get("topics"))
+            if inspect.isawaitable(events):
+                events = await events
+            result = [raw_log(event) for event in events]
+        return {"jsonrpc": "2.0", "id": body["id"], "result": result}
+
+    with mock.patch.object(node_client, '_post', side_effect=post):
+        yield get_logs, block_number
+
+
 @pytest.mark.asyncio
 async def test_contract_event_service_simple():
     node_client = EthereumNodeClient()
@@ -53,8 +97,9 @@ async def test_contract_event_service_simple():
                   topics=pub.topics())
         ],
     ]
-    with mock.patch.object(node_client, 'get_logs', side_effect=logs), \
-            mock.patch.object(node_client, 'block_number', side_effect=[0, 1, 2]):
+    with node_methods(node_client,
+                      get_logs=mock.Mock(side_effect=logs),
+                      block_number=mock.Mock(side_effect=[0, 1, 2])):
         await service.start()
         async with timeout(1):
             pub = await queue.get()
@@ -100,10 +145,393 @@ async def test_contract_event_block_range(reverse_order):
         [],
         [],
     ]
-    with mock.patch.object(node_client, 'get_logs', side_effect=logs), \
-            mock.patch.object(node_client, 'block_number', side_effect=[0, 1, 2]):
+    with node_methods(node_client,
+                      get_logs=mock.Mock(side_effect=logs),
+                      block_number=mock.Mock(side_effect=[0, 1, 2])):
         await service.start()
         async with timeout(1):
             pub = await queue.get()
         assert pub.reply_to.rstrip(b'\x00') == b'123'
         await service.stop()
+
+
+@pytest.mark.asyncio
+async def test_contract_event_service_checkpoint():
+    db = DatabaseService()
+    await db.start()
+    node_client = EthereumNodeClient()
+    contract = Contract(
+        address="0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7",
+        abi=CONTENT_CONTRACT['abi'],
+        event_classes={'Publication': Publication},
+    )
+    await db.checkpoints.store(Checkpoint(stream=contract.address, block_number=1000))
+    service = ContractEventService(
+        node_client=node_client,
+        contract=contract,
+        event_store=db.contract_events,
+        reorg_margin=10,
+        block_sleep_interval=10,
+    )
+    queue = service.subscribe(Publication)
+    magnets = [bytes.fromhex(f'{i:064x}') for i in range(1, 4)]
+    logs = [
+        Event(log_index=i,
+              block_number=1200,
+              block_hash=rnd_hash(),
+              transaction_hash=f'0x{i:064x}',
+              transaction_index=i,
+              address=contract.address,
+              data=pub.data(),
+              topics=pub.topics())
+        for i, pub in enumerate(
+            Publication(reply_to=b'\x00' * 32, magnet=magnet, source=rnd_address(), size=1, retention=12)
+            for magnet in magnets
+        )
+    ]
+    with node_methods(node_client,
+                      get_logs=mock.Mock(return_value=logs),
+                      block_number=mock.Mock(return_value=1500)) as (get_logs, _):
+        await service.start()
+        async with timeout(1):
+            for magnet in magnets:
+                received = await queue.get()
+                # whole page is stored with checkpoint before subscribers are notified
+                assert await db.publications.get(received.magnet) == received
+            assert (await db.checkpoints.get(contract.address)).block_number == 1500
+        await service.stop()
+    get_logs.assert_called_once_with(contract.address, 990, 1500, topics=[['0x' + Publication.get_signature_hash()]])
+    await db.stop()
+
+
+@pytest.mark.asyncio
+async def test_contract_event_service_concurrent_fetch():
+    node_client = EthereumNodeClient()
+    contract = Contract(
+        address="0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7",
+        abi=CONTENT_CONTRACT['abi'],
+        event_classes={'Publication': Publication},
+    )
+    service = ContractEventService(
+        node_client=node_client,
+        contract=contract,
+        block_range=BlockRange(from_block=0, to_block=999, start_size=100),
+        concurrency=3,
+    )
+    queue = service.subscribe(Publication)
+    fetched = []
+
+    async def get_logs(address, from_block, to_block, topics):
+        # node refuses wide ranges with events and responds to later ranges faster
+        if from_block <= 150 <= to_block and to_block - from_block > 10:
+            raise ResultLimitExceeded()
+        fetched.append((from_block, to_block))
+        await asyncio.sleep((1000 - from_block) / 100000)
+        pub = Publication(reply_to=b'\x00' * 32, magnet=bytes.fromhex(f'{from_block:064x}'),
+                          source=rnd_address(), size=1, retention=12)
+        return [Event(log_index=0,
+                      block_number=from_block,
+                      block_hash=rnd_hash(),
+                      transaction_hash=f'0x{from_block:064x}',
+                      transaction_index=0,
+                      address=contract.address,
+                      data=pub.data(),
+                      topics=pub.topics())]
+
+    with node_methods(node_client,
+                      get_logs=mock.Mock(side_effect=get_logs),
+                      block_number=mock.Mock(return_value=2000)):
+        await service.fetch_events()
+    received = []
+    while not queue.empty():
+        received.append(int((await queue.get()).magnet, 16))
+    # events are delivered in block order, ranges cover all blocks once
+    assert received == sorted(received)
+    assert received[:3] == [0, 100, 150]
+    fetched.sort()
+    assert received == [from_block for from_block, _ in fetched]
+    assert fetched[0][0] == 0 and fetched[-1][1] == 999
+    assert all(prev[1] + 1 == window[0] for prev, window in zip(fetched, fetched[1:]))
+    assert service.current_block_number == 999
+
+
+@pytest.mark.asyncio
+async def test_contract_event_service_topics():
+    contract = Contract(
+        address="0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7",
+        abi=CONTENT_CONTRACT['abi'],
+        event_classes={'Publication': Publication},
+    )
+    node_client = EthereumNodeClient()
+    service = ContractEventService(node_client=node_client, contract=contract)
+    topics = [['0x' + Publication.get_signature_hash()]]
+    # nothing is requested without consumers
+    assert service.get_topics() == []
+    with node_methods(node_client,
+                      get_logs=mock.Mock(),
+                      block_number=mock.Mock(return_value=10)) as (get_logs, _):
+        assert not await service.fetch_events()
+    get_logs.assert_not_called()
+    # skipped blocks are not considered processed
+    assert service.current_block_number is None
+
+    pub = Publication(reply_to=b'\x00' * 32, magnet=b'\x01' * 32, source=rnd_address(), size=1, retention=12)
+    event = Event(log_index=0, block_number=5, block_hash='0xaa', transaction_hash='0x01', transaction_index=0,
+                  address=contract.address, data=pub.data(), topics=pub.topics())
+    queue = service.subscribe(Publication)
+    assert service.get_topics() == topics
+    with node_methods(node_client,
+                      get_logs=mock.Mock(return_value=[event]),
+                      block_number=mock.Mock(return_value=10)) as (get_logs, _):
+        assert await service.fetch_events()
+    # events of blocks skipped before are delivered to the later consumer
+    assert get_logs.call_args[0][1] == 0
+    assert (await queue.get()).magnet == '01' * 32
+    assert service.current_block_number == 10
+
+    service = ContractEventService(node_client=node_client, contract=contract)
+    service.consume(Publication)
+    assert service.get_topics() == topics
+    other_service = ContractEventService(node_client=node_client, contract=contract)
+    other_service.subscribe(Publication)
+    assert other_service.get_topics() == topics
+    other_service = ContractEventService(node_client=node_client, contract=contract, event_types=Publication)
+    assert other_service.get_topics() == topics
+
+
+@pytest.mark.asyncio
+async def test_contract_event_service_topics_changed():
+    contract = Contract(
+        address="0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7",
+        abi=CONTENT_CONTRACT['abi'],
+        event_classes={'Publication': Publication},
+    )
+    node_client = EthereumNodeClient()
+    bus = ServiceBus()
+    retractions = bus.subscribe(ContractEventRetracted)
+    service = ContractEventService(node_client=node_client, contract=contract,
+                                   block_range=BlockRange(from_block=90), event_types=Publication, bus=bus)
+    pub = Publication(reply_to=b'\x00' * 32, magnet=b'\x01' * 32, source=rnd_address(), size=1, retention=12)
+    event = Event(log_index=0, block_number=95, block_hash='0xaa', transaction_hash='0x01', transaction_index=0,
+                  address=contract.address, data=pub.data(), topics=pub.topics())
+    with node_methods(node_client,
+                      get_logs=mock.Mock(side_effect=[[event], []]),
+                      block_number=mock.Mock(side_effect=[100, 101])):
+        await service.fetch_events()
+        service.consume(contract.event('Award'))
+        service.block_range = service._shift_block_range(service.current_block_number - service.reorg_margin)
+        # events delivered with the other filter are not retracted
+        await service.fetch_events()
+    assert retractions.empty()
+    assert service.current_block_number == 101
+
+
+@pytest.mark.asyncio
+async def test_contract_event_service_reorg():
+    db = DatabaseService()
+    await db.start()
+    node_client = EthereumNodeClient()
+    contract = Contract(
+        address="0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7",
+        abi=CONTENT_CONTRACT['abi'],
+        event_classes={'Publication': Publication},
+    )
+    bus = ServiceBus()
+    retractions = bus.subscribe(ContractEventRetracted)
+    service = ContractEventService(
+        node_client=node_client,
+        contract=contract,
+        event_store=db.contract_events,
+        block_range=BlockRange(from_block=90),
+        bus=bus,
+    )
+    queue = service.subscribe(Publication)
+
+    def make_log(i, block_number, block_hash):
+        pub = Publication(reply_to=b'\x00' * 32, magnet=bytes.fromhex(f'{i:064x}'),
+                          source=rnd_address(), size=1, retention=12)
+        return Event(log_index=0, block_number=block_number, block_hash=block_hash,
+                     transaction_hash=f'0x{i:064x}', transaction_index=0,
+                     address=contract.address, data=pub.data(), topics=pub.topics())
+
+    first, replaced, included = make_log(1, 95, '0xaa'), make_log(2, 99, '0xbb'), make_log(3, 99, '0xcc')
+    with node_methods(node_client,
+                      get_logs=mock.Mock(side_effect=[[first, replaced], [first, included]]),
+                      block_number=mock.Mock(side_effect=[100, 101])):
+        await service.fetch_events()
+        service.block_range = service._shift_block_range(service.current_block_number - service.reorg_margin)
+        await service.fetch_events()
+    received = []
+    while not queue.empty():
+        received.append((await queue.get()).magnet)
+    # event of the block 95 is delivered once
+    assert received == [f'{i:064x}' for i in (1, 2, 3)]
+    retraction = retractions.get_nowait()
+    assert retraction.event.magnet == f'{2:064x}' and retraction.block_hash == '0xbb'
+    assert retractions.empty()
+    assert await db.publications.get(f'{2:064x}') is None
+    assert await db.publications.get(f'{3:064x}') is not None
+    assert (await db.checkpoints.get(contract.address)).block_number == 101
+    await db.stop()
+
+
+class StandInNode:
+    """Local JSON-RPC and WebSocket server serving contract logs.
+    """
+
+    def __init__(self):
+        self.block_number = 0
+        self.logs = []
+        self.sockets = []
+        self.subscriptions = 0
+        self.app = web.Application()
+        self.app.router.add_post('/', self.handle_rpc)
+        self.app.router.add_get('/ws', self.handle_ws)
+
+    def add_log(self, raw_log):
+        self.logs.append(raw_log)
+        self.block_number = int(raw_log['blockNumber'], 16)
+
+    async def notify(self):
+        for ws, subscription_id in self.sockets:
+            await ws.send_json({"jsonrpc": "2.0", "method": "eth_subscription",
+                                "params": {"subscription": subscription_id, "result": self.logs[-1]}})
+
+    async def disconnect(self):
+        sockets, self.sockets = self.sockets, []
+        for ws, _ in sockets:
+            await ws.close()
+
+    async def handle_rpc(self, request):
+        body = await request.json()
+        if body["method"] == "eth_blockNumber":
+            result = hex(self.block_number)
+        else:
+            params = body["params"][0]
+            result = [raw_log for raw_log in self.logs
+                      if int(params["fromBlock"], 16) <= int(raw_log['blockNumber'], 16) <= int(params["toBlock"], 16)]
+        return web.json_response({"jsonrpc": "2.0", "id": body["id"], "result": result})
+
+    async def handle_ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            body = msg.json()
+            if body["method"] == "eth_subscribe":
+                self.subscriptions += 1
+                subscription_id = hex(self.subscriptions)
+                self.sockets.append((ws, subscription_id))
+                await ws.send_json({"jsonrpc": "2.0", "id": body["id"], "result": subscription_id})
+        return ws
+
+
+@pytest.mark.asyncio
+async def test_contract_event_service_push():
+    contract = Contract(
+        address="0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7",
+        abi=CONTENT_CONTRACT['abi'],
+        event_classes={'Publication': Publication},
+    )
+
+    def make_raw_log(i, block_number):
+        pub = Publication(reply_to=b'\x00' * 32, magnet=bytes.fromhex(f'{i:064x}'),
+                          source=rnd_address(), size=1, retention=12)
+        return {"logIndex": "0x0", "blockNumber": hex(block_number), "blockHash": f'0x{block_number:064x}',
+                "transactionHash": f'0x{i:064x}', "transactionIndex": "0x0", "address": contract.address,
+                "data": pub.data(), "topics": pub.topics()}
+
+    node = StandInNode()
+    node.block_number = 10
+    async with TestServer(node.app) as server:
+        node_client = EthereumNodeClient(str(server.make_url('/')), ws_url=str(server.make_url('/ws')))
+        service = ContractEventService(
+            node_client=node_client,
+            contract=contract,
+            block_sleep_interval=0.2,
+            push_sleep_interval=100,
+        )
+        queue = service.subscribe(Publication)
+        await service.start()
+        async with timeout(2):
+            while not service.push_mode:
+                await asyncio.sleep(0.01)
+            # new event is fetched on notification without waiting for polling
+            node.add_log(make_raw_log(1, 11))
+            await node.notify()
+            assert (await queue.get()).magnet == f'{1:064x}'
+
+            # events emitted while subscription is interrupted are not lost
+            await node.disconnect()
+            node.add_log(make_raw_log(2, 12))
+            assert (await queue.get()).magnet == f'{2:064x}'
+            while not (service.push_mode and node.subscriptions == 2):
+                await asyncio.sleep(0.01)
+        await service.stop()
+        await node_client.close()
+
+
+@pytest.mark.asyncio
+async def test_contract_event_service_push_without_consumers():
+    contract = Contract(
+        address="0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7",
+        abi=CONTENT_CONTRACT['abi'],
+        event_classes={'Publication': Publication},
+    )
+    node = StandInNode()
+    async with TestServer(node.app) as server:
+        node_client = EthereumNodeClient(str(server.make_url('/')), ws_url=str(server.make_url('/ws')))
+        service = ContractEventService(node_client=node_client, contract=contract, block_sleep_interval=0.1)
+        await service.start()
+        await asyncio.sleep(0.3)
+        # logs are not subscribed until events are consumed
+        assert node.subscriptions == 0 and not service.push_mode
+        service.consume(Publication)
+        async with timeout(2):
+            while not service.push_mode:
+                await asyncio.sleep(0.01)
+        assert node.subscriptions == 1
+        await service.stop()
+        await node_client.close()
+
+
+@pytest.mark.asyncio
+async def test_contract_event_service_restart(tmp_path):
+    db = DatabaseService(database=str(tmp_path / 'db.sqlite'))
+    await db.start()
+    node_client = EthereumNodeClient()
+    contract = Contract(
+        address="0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7",
+        abi=CONTENT_CONTRACT['abi'],
+        event_classes={'Publication': Publication},
+    )
+
+    def make_log(i, block_number):
+        pub = Publication(reply_to=b'\x00' * 32, magnet=bytes.fromhex(f'{i:064x}'),
+                          source=rnd_address(), size=1, retention=12)
+        return Event(log_index=0, block_number=block_number, block_hash=f'0x{block_number:064x}',
+                     transaction_hash=f'0x{i:064x}', transaction_index=0,
+                     address=contract.address, data=pub.data(), topics=pub.topics())
+
+    logs = [make_log(1, 95), make_log(2, 99)]
+
+    def get_logs(address, from_block, to_block, topics):
+        return [log for log in logs if from_block <= log.block_number <= (to_block or from_block)]
+
+    received = []
+    for head in (100, 102):
+        # service is restarted with the checkpoint of the previous run
+        service = ContractEventService(node_client=node_client, contract=contract, event_store=db.contract_events,
+                                       block_range=BlockRange(from_block=90, start_size=5), reorg_margin=10)
+        queue = service.subscribe(Publication)
+        await service.restore_checkpoint()
+        with node_methods(node_client,
+                          get_logs=mock.Mock(side_effect=get_logs),
+                          block_number=mock.Mock(return_value=head)):
+            await service.fetch_events()
+        while not queue.empty():
+            received.append((await queue.get()).magnet)
+        assert (await db.checkpoints.get(contract.address)).block_number == head
+        logs.append(make_log(3, 101))
+    # events of the reorg margin are delivered once
+    assert received == [f'{i:064x}' for i in (1, 2, 3)]
+    await db.stop()
@@ -24,8 +24,15 @@ async def test_address_resolution():
     )
     fake_address = "0xd5e64d2103A265ece8E0afF188F9549Df6E70A20"
     fake_contract_response = '0x' + encode_single("address", bytes.fromhex(fake_address[2:])).hex()
-    with mock.patch.object(service.eth, "call", return_value=fake_contract_response):
+    responses = [
+        {"jsonrpc": "2.0", "id": 2, "result": fake_contract_response},
+        {"jsonrpc": "2.0", "id": 1, "result": fake_contract_response},
+    ]
+    with mock.patch.object(service.eth, "_post", return_value=responses) as post_mock:
         await service.start()
+        # both addresses resolved in a single batch request
+        post_mock.assert_called_once()
+        assert [body["id"] for body in post_mock.call_args[0][0]] == [1, 2]
         assert service.content_address == fake_address
         assert service.peering_address == fake_address
         await service.stop()
@@ -0,0 +1,159 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from eth_account import Account
+
+from sarafan.contract import transaction_service
+from sarafan.contract.transaction_service import TransactionService
+from sarafan.ethereum import EthereumNodeClient
+from sarafan.ethereum.exceptions import EthereumNodeException
+
+
+class FakeNode:
+    """Respond to batch requests, reject transactions with already used nonces.
+    """
+
+    def __init__(self, pending_count=7):
+        self.pending_count = pending_count
+        self.batches = []
+
+    async def post(self, bodies):
+        self.batches.append([body["method"] for body in bodies])
+        return [{"jsonrpc": "2.0", "id": body["id"], **self.respond(body)} for body in bodies]
+
+    def respond(self, body):
+        if body["method"] == "eth_gasPrice":
+            return {"result": hex(10 ** 9)}
+        if body["method"] == "eth_getTransactionCount":
+            return {"result": hex(self.pending_count)}
+        return {"result": "0x" + body["params"][0][-64:]}
+
+
+@pytest.mark.asyncio
+async def test_transaction_burst():
+    node = FakeNode()
+    client = EthereumNodeClient()
+    service = TransactionService(client, gas_price_ttl=60)
+    account = Account.create()
+    signed = []
+    sign_transaction = transaction_service.sign_transaction
+
+    def sign(transaction, private_key):
+        signed.append(transaction)
+        return sign_transaction(transaction, private_key)
+
+    with mock.patch.object(client, "_post", side_effect=node.post), \
+            mock.patch.object(transaction_service, "sign_transaction", side_effect=sign):
+        await service.start()
+        tx = {"to": account.address, "data": b"", "value": 0, "chainId": 1}
+        hashes = await asyncio.gather(*[service.submit(account.address, account.key, tx) for _ in range(5)])
+        assert len(set(hashes)) == 5
+        # nonce and gas price are requested once, transactions are sent in one batch
+        assert node.batches == [
+            ["eth_gasPrice", "eth_getTransactionCount"],
+            ["eth_sendRawTransaction"] * 5,
+        ]
+        await service.submit(account.address, account.key, tx)
+        assert node.batches[-1] == ["eth_sendRawTransaction"]
+        await service.stop()
+    assert [transaction["nonce"] for transaction in signed] == [7, 8, 9, 10, 11, 12]
+    assert {transaction["gasPrice"] for transaction in signed} == {10 ** 9}
+
+
+@pytest.mark.asyncio
+async def test_transaction_nonce_resync():
+    node = FakeNode()
+    client = EthereumNodeClient()
+    service = TransactionService(client)
+    account = Account.create()
+    tx = {"to": account.address, "data": b"", "value": 0, "chainId": 1}
+    respond = node.respond
+    node.respond = lambda body: (
+        {"error": {"message": "nonce too low"}} if body["method"] == "eth_sendRawTransaction" else respond(body)
+    )
+    with mock.patch.object(client, "_post", side_effect=node.post):
+        await service.start()
+        with pytest.raises(EthereumNodeException):
+            await service.submit(account.address, account.key, tx)
+        node.respond = respond
+        node.pending_count = 9
+        await service.submit(account.address, account.key, tx)
+        # pending transaction count is requested again after failure
+        assert node.batches[-2] == ["eth_getTransactionCount"]
+        await service.stop()
+
+
+@pytest.mark.asyncio
+async def test_transaction_sign_failed():
+    node = FakeNode()
+    client = EthereumNodeClient()
+    service = TransactionService(client, gas_price_ttl=60)
+    account = Account.create()
+    tx = {"to": account.address, "data": b"", "value": 0, "chainId": 1}
+    signed = []
+    sign_transaction = transaction_service.sign_transaction
+
+    def sign(transaction, private_key):
+        signed.append(transaction)
+        if len(signed) == 1:
+            raise ValueError("Signing failed")
+        return sign_transaction(transaction, private_key)
+
+    with mock.patch.object(client, "_post", side_effect=node.post), \
+            mock.patch.object(transaction_service, "sign_transaction", side_effect=sign):
+        await service.start()
+        with pytest.raises(ValueError):
+            await service.submit(account.address, account.key, tx)
+        await service.submit(account.address, account.key, tx)
+        # nonce of the failed transaction is reused
+        assert node.batches[-2] == ["eth_getTransactionCount"]
+        await service.stop()
+    assert [transaction["nonce"] for transaction in signed] == [7, 7]
+
+
+@pytest.mark.asyncio
+async def test_transaction_batch_middle_failed():
+    node = FakeNode()
+    client = EthereumNodeClient()
+    service = TransactionService(client, gas_price_ttl=60)
+    account, other = Account.create(), Account.create()
+    signed = []
+    sign_transaction = transaction_service.sign_transaction
+
+    def sign(transaction, private_key):
+        signed.append(transaction)
+        return sign_transaction(transaction, private_key)
+
+    respond = node.respond
+    node.respond = lambda body: (
+        {"error": {"message": "underpriced"}} if body.get("params") == ["failed"] else respond(body)
+    )
+    sign_mock = mock.Mock(side_effect=lambda transaction, private_key: (
+        "failed" if transaction.get("value") == 1 else sign(transaction, private_key)
+    ))
+    with mock.patch.object(client, "_post", side_effect=node.post), \
+            mock.patch.object(transaction_service, "sign_transaction", sign_mock):
+        await service.start()
+        tx = {"to": other.address, "data": b"", "value": 0, "chainId": 1}
+        results = await asyncio.gather(
+            service.submit(account.address, account.key, tx),
+            service.submit(account.address, account.key, dict(tx, value=1)),
+            service.submit(account.address, account.key, tx),
+            service.submit(other.address, other.key, tx),
+            return_exceptions=True,
+        )
+        assert isinstance(results[1], EthereumNodeException)
+        assert all(isinstance(result, str) for result in results[::2] + results[3:])
+        # nonce of the failed transaction is filled, so the later one can be mined
+        assert node.batches[-1] == ["eth_sendRawTransaction"]
+        filler = signed[-1]
+        assert (filler["to"], filler["value"], filler["nonce"]) == (account.address, 0, 8)
+
+        node.pending_count = 10
+        await service.submit(other.address, other.key, tx)
+        # nonces of all batch accounts are requested again
+        assert node.batches[-2] == ["eth_getTransactionCount"]
+        await service.stop()
+    assert [transaction["nonce"] for transaction in signed[:3]] == [7, 9, 7]
+    assert signed[-1]["nonce"] == 10
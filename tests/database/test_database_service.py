@@ -0,0 +1,273 @@
+import dataclasses
+import sqlite3
+
+import pytest
+
+from sarafan.database.service import DatabaseService
+from sarafan.events import Comment, Post
+from sarafan.models import Peer
+
+from ..factories import PublicationFactory
+
+
+@pytest.fixture(name='db')
+async def database_service(tmp_path):
+    service = DatabaseService(database=str(tmp_path / 'db.sqlite'))
+    await service.start()
+    try:
+        yield service
+    finally:
+        await service.stop()
+
+
+@pytest.mark.asyncio
+async def test_wal_mode(db):
+    with db.pool.writer() as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    with db.pool.reader() as connection:
+        assert connection.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+
+@pytest.mark.asyncio
+async def test_store_and_get_publication(db):
+    publication = PublicationFactory.create()
+    await db.publications.store(publication)
+    assert await db.publications.get(publication.magnet) == publication
+    assert await db.publications.get('0' * 64) is None
+
+
+@pytest.mark.asyncio
+async def test_publications_cache(db):
+    publication = PublicationFactory.create()
+    await db.publications.store(publication)
+    assert await db.publications.get(publication.magnet) == publication
+    cached = await db.publications.get(publication.magnet)
+    assert cached == publication
+    assert (db.publications.cache.hits, db.publications.cache.misses) == (1, 1)
+    # stored object replaces cached one
+    await db.publications.store(dataclasses.replace(publication, size=2))
+    assert (await db.publications.get(publication.magnet)).size == 2
+    assert db.publications.cache.misses == 2
+    assert db.peers.cache is None
+
+
+@pytest.mark.asyncio
+async def test_memory_database():
+    service = DatabaseService()
+    await service.start()
+    post = Post(magnet='1' * 64, content='in memory')
+    await service.posts.store(post)
+    stored = await service.posts.get(post.magnet)
+    assert stored.content == 'in memory'
+    await service.stop()
+    assert service.pool.closed
+
+
+@pytest.mark.asyncio
+async def test_store_many_posts(db):
+    posts = [Post(magnet=f'{i:064x}', content=f'post {i}') for i in range(10)]
+    await db.posts.store_many(posts)
+    stored = await db.posts.get(posts[5].magnet)
+    assert stored.content == 'post 5'
+
+
+@pytest.mark.asyncio
+async def test_peer_updates_coalesced(tmp_path):
+    database = str(tmp_path / 'peers.sqlite')
+    service = DatabaseService(database=database)
+    await service.start()
+    peer = Peer(service_id='coalesced')
+    for i in range(10):
+        peer.rating = i / 10
+        await service.dispatch(peer)
+    await service.dispatch(Peer(service_id='other'))
+    assert len(service.peers_buffer) == 2
+    await service.stop()
+
+    service = DatabaseService(database=database)
+    await service.start()
+    peers = {p.service_id: p for p in await service.peers.all()}
+    assert peers['coalesced'].rating == 0.9
+    assert 'other' in peers
+    await service.stop()
+
+
+@pytest.mark.asyncio
+async def test_posts_keyset_pagination(db):
+    posts = [Post(magnet=f'{i:064x}', content=f'post {i}', created_at=1600000000 + i // 3)
+             for i in range(25)]
+    await db.posts.store_many(posts)
+    received = []
+    cursor = None
+    while True:
+        page, cursor = await db.posts.all(cursor=cursor, per_page=10)
+        received += page
+        if cursor is None:
+            break
+    assert len(received) == 25
+    assert [p.magnet for p in received] == [p.magnet for p in reversed(posts)]
+
+
+@pytest.mark.asyncio
+async def test_posts_feed_uses_index(db):
+    with db.pool.reader() as connection:
+        plan = connection.execute(
+            "EXPLAIN QUERY PLAN SELECT rowid, * FROM sarafan_posts "
+            "WHERE (created_at, rowid) < (?, ?) ORDER BY created_at DESC, rowid DESC LIMIT 10",
+            [0, 0]
+        ).fetchall()
+    assert 'idx_sarafan_posts_feed' in plan[0]['detail']
+    assert len(plan) == 1
+
+
+@pytest.mark.asyncio
+async def test_posts_search(db):
+    await db.posts.store_many([
+        Post(magnet=f'{i:064x}', content=f'post number {i} about {"bees" if i % 2 else "trees"}')
+        for i in range(12)
+    ])
+    await db.posts.store(Post(magnet=f'{0:064x}', content='replaced "post" about bees'))
+    results, cursor = await db.posts.search('bees post', per_page=5)
+    assert len(results) == 5
+    assert all('<b>bees</b>' in snippet for _, snippet in results)
+    more, cursor = await db.posts.search('bees post', cursor=cursor, per_page=5)
+    assert len(more) == 2
+    assert cursor is None
+    assert await db.posts.search('"') == ([], None)
+
+
+@pytest.mark.asyncio
+async def test_posts_search_backfill(db):
+    posts = [Post(magnet=f'{i:064x}', content=f'backfill {i}') for i in range(7)]
+    await db.posts.store_many(posts)
+    # emulate posts stored before search index was created
+    with db.pool.writer() as connection:
+        connection.execute("INSERT INTO sarafan_posts_search (sarafan_posts_search) VALUES ('delete-all')")
+        connection.execute("UPDATE sarafan_posts_search_backfill SET last_rowid = 0, max_rowid = 7")
+    assert await db.posts.search('backfill') == ([], None)
+    assert await db.posts.backfill_search(chunk_size=3) == 3
+    assert await db.posts.backfill_search(chunk_size=3) == 3
+    assert await db.posts.backfill_search(chunk_size=3) == 1
+    assert await db.posts.backfill_search(chunk_size=3) == 0
+    results, _ = await db.posts.search('backfill', per_page=10)
+    assert len(results) == 7
+
+
+@pytest.mark.asyncio
+async def test_comments_tree(db):
+    post = f'{0:064x}'
+
+    def comment(i, reply_to):
+        return Comment(magnet=f'{i:064x}', reply_to=reply_to, content=f'comment {i}',
+                       created_at=1600000000 + i)
+
+    # 1 <- 2 <- 4, 1 <- 3, 5, stored in reverse order in the single batch
+    comments = [
+        comment(1, post), comment(2, f'{1:064x}'), comment(3, f'{1:064x}'),
+        comment(4, f'{2:064x}'), comment(5, post),
+    ]
+    await db.comments.store_many(reversed(comments))
+    # reply to the stored comment is resolved from the database
+    await db.comments.store(comment(6, f'{4:064x}'))
+
+    thread, cursor = await db.comments.replies(post)
+    assert [c.magnet[-1] for c in thread] == ['1', '2', '4', '6', '3', '5']
+    assert [c.depth for c in thread] == [0, 1, 2, 3, 1, 0]
+    assert all(c.post_magnet == post for c in thread)
+    assert cursor is None
+
+    top, _ = await db.comments.replies(post, max_depth=1)
+    assert [c.magnet[-1] for c in top] == ['1', '5']
+
+    subtree, _ = await db.comments.replies(f'{1:064x}', max_depth=2)
+    assert [c.magnet[-1] for c in subtree] == ['2', '4', '3']
+
+    page, cursor = await db.comments.replies(f'{1:064x}', per_page=2)
+    assert [c.magnet[-1] for c in page] == ['2', '4']
+    page, cursor = await db.comments.replies(f'{1:064x}', cursor=cursor, per_page=2)
+    assert [c.magnet[-1] for c in page] == ['6', '3']
+    assert cursor is None
+
+
+@pytest.mark.asyncio
+async def test_comments_reply_before_parent(db):
+    post = f'{0:064x}'
+
+    def comment(i, reply_to):
+        return Comment(magnet=f'{i:064x}', reply_to=reply_to, content=f'comment {i}',
+                       created_at=1600000000 + i)
+
+    # 1 <- 2 <- 3 <- 4, replies are stored before their parents
+    await db.comments.store(comment(4, f'{3:064x}'))
+    await db.comments.store_many([comment(3, f'{2:064x}')])
+    thread, _ = await db.comments.replies(post)
+    assert thread == []
+    await db.comments.store(comment(2, f'{1:064x}'))
+    await db.comments.store(comment(1, post))
+
+    thread, _ = await db.comments.replies(post)
+    assert [c.magnet[-1] for c in thread] == ['1', '2', '3', '4']
+    assert [c.depth for c in thread] == [0, 1, 2, 3]
+    assert all(c.post_magnet == post for c in thread)
+    subtree, _ = await db.comments.replies(f'{2:064x}')
+    assert [c.magnet[-1] for c in subtree] == ['3', '4']
+
+
+@pytest.mark.asyncio
+async def test_peers_top(db):
+    await db.peers.store_many([
+        Peer(service_id='old', rating=.9, last_seen=100),
+        Peer(service_id='recent', rating=.9, last_seen=200),
+        Peer(service_id='never', rating=.9),
+        Peer(service_id='bad', rating=.1, last_seen=300),
+    ])
+    top = await db.peers.top(3)
+    assert [p.service_id for p in top] == ['recent', 'old', 'never']
+    with db.pool.reader() as connection:
+        plan = connection.execute(
+            "EXPLAIN QUERY PLAN SELECT service_id FROM sarafan_peers "
+            "ORDER BY rating DESC, last_seen DESC LIMIT 3"
+        ).fetchall()
+    assert 'idx_sarafan_peers_restore' in plan[0]['detail']
+
+
+@pytest.mark.asyncio
+async def test_maintenance(db):
+    await db.posts.store_many([Post(magnet=f'{i:064x}', content='x' * 1000) for i in range(500)])
+    with db.pool.writer() as connection:
+        connection.execute("DELETE FROM sarafan_posts")
+    stats = await db.stats()
+    assert stats.freelist_count > 0
+    assert stats.last_maintenance is None
+    assert 'sarafan_posts' in stats.tables
+
+    assert not db.maintenance.due
+    db.maintenance.idle_time = 0
+    assert db.maintenance.due
+    report = await db.maintenance.run()
+    assert report.vacuumed_pages > 0
+    assert not db.maintenance.due
+
+    stats = await db.stats()
+    assert stats.freelist_count == 0
+    assert stats.last_maintenance == report
+
+
+@pytest.mark.asyncio
+async def test_legacy_database_vacuum_mode(tmp_path):
+    path = str(tmp_path / 'legacy.sqlite')
+    legacy = sqlite3.connect(path)
+    legacy.execute("CREATE TABLE legacy (value TEXT)")
+    legacy.close()
+
+    db = DatabaseService(database=path)
+    await db.start()
+    try:
+        # database isn't rebuilt unless it is enabled explicitly
+        with db.pool.reader() as connection:
+            assert connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+        await db.maintenance.enable_incremental_vacuum()
+        with db.pool.writer() as connection:
+            assert connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    finally:
+        await db.stop()
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import pytest
+
+from sarafan.database.executor import DatabaseExecutor
+from sarafan.database.pool import ConnectionPool
+
+
+@pytest.fixture(name='executor')
+def database_executor(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'executor.sqlite'), readers=2)
+    pool.open()
+    executor = DatabaseExecutor(pool)
+    executor.start()
+    try:
+        yield executor
+    finally:
+        executor.stop()
+        pool.close()
+
+
+def create_table(db):
+    db.execute("CREATE TABLE items (value integer)")
+
+
+def slow_insert(db, value):
+    time.sleep(0.2)
+    db.execute("INSERT INTO items VALUES (?)", [value])
+
+
+def count_items(db):
+    return db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+
+def fail(db):
+    db.execute("INSERT INTO items VALUES (1)")
+    raise ValueError()
+
+
+@pytest.mark.asyncio
+async def test_write_does_not_block_loop(executor):
+    await executor.write(create_table)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker_task = asyncio.ensure_future(ticker())
+    await executor.write(slow_insert, 1)
+    ticker_task.cancel()
+    assert ticks > 5
+    assert await executor.read(count_items) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_write_rolled_back(executor):
+    await executor.write(create_table)
+    with pytest.raises(ValueError):
+        await executor.write(fail)
+    assert await executor.read(count_items) == 0
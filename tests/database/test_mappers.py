@@ -0,0 +1,39 @@
+from sarafan.database.mappers import PeerMapper, PostMapper, PublicationMapper
+from sarafan.events import Post
+from sarafan.models import Peer
+
+from ..factories import PublicationFactory
+
+
+def test_compiled_columns():
+    mapper = PeerMapper()
+    assert mapper.columns == ('service_id', 'rating', 'last_seen')
+    assert mapper.get_select_columns('p') == 'p.service_id, p.rating, p.last_seen'
+    assert mapper.build_objects([('peer1', .7, None), ('peer2', .1, 10, 'ignored')]) == [
+        Peer(service_id='peer1', rating=.7),
+        Peer(service_id='peer2', rating=.1, last_seen=10),
+    ]
+
+
+def test_insert_skips_empty_values():
+    mapper = PostMapper()
+    query, args = mapper.get_insert(Post(magnet='1' * 64, content='text'))
+    assert query == "INSERT OR REPLACE INTO sarafan_posts (magnet, content) VALUES (?,?)"
+    assert args == (bytes.fromhex('1' * 64), 'text')
+    query, args = mapper.get_insert(Post(magnet='2' * 64, content='text', created_at=10))
+    assert query == ("INSERT OR REPLACE INTO sarafan_posts (magnet, content, created_at) "
+                     "VALUES (?,?,?)")
+    assert args == (bytes.fromhex('2' * 64), 'text', 10)
+    # query is compiled once for every set of empty fields
+    assert mapper.get_insert(Post(magnet='3' * 64, content='other'))[0] is \
+        mapper.get_insert(Post(magnet='4' * 64, content='text'))[0]
+
+
+def test_binary_hashes():
+    mapper = PublicationMapper()
+    publication = PublicationFactory.create()
+    query, args = mapper.get_insert(publication)
+    assert args[:2] == (bytes.fromhex(publication.reply_to[2:]), bytes.fromhex(publication.magnet))
+    assert len(args[2]) == 20
+    assert mapper.build_object(args) == publication
+    assert mapper.get_pk_value(publication.magnet) == args[1]
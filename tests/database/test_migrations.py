@@ -0,0 +1,39 @@
+import sqlite3
+
+from yoyo import get_backend, read_migrations
+
+from sarafan.database.migrations import MIGRATIONS_PATH, apply_migrations
+
+
+def test_binary_hashes_migration(tmp_path):
+    db_path = tmp_path / 'db.sqlite'
+    backend = get_backend(f'sqlite:///{db_path}')
+    migrations = read_migrations(str(MIGRATIONS_PATH))
+    with backend.lock():
+        backend.apply_migrations(backend.to_apply(
+            migrations.filter(lambda migration: migration.id < '008')
+        ))
+    backend.connection.close()
+
+    magnet = 'ab' * 32
+    with sqlite3.connect(db_path) as db:
+        db.execute("INSERT INTO sarafan_publications (magnet, source, size, reply_to) VALUES (?, ?, 1, '0x')",
+                   [magnet, '0x' + 'cd' * 20])
+        db.executemany("INSERT INTO sarafan_posts (magnet, content) VALUES (?, ?)",
+                       [(f'{i:064x}', f'migrated post {i}') for i in range(2500)])
+    db.close()
+
+    apply_migrations(db_path)
+
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("SELECT magnet, source, reply_to FROM sarafan_publications").fetchall() == [
+            (bytes.fromhex(magnet), bytes.fromhex('cd' * 20), b'')
+        ]
+        assert db.execute("SELECT COUNT(*) FROM sarafan_posts WHERE typeof(magnet) = 'blob'").fetchone()[0] == 2500
+        # search index is consistent with rowids and triggers are restored
+        assert db.execute("SELECT magnet FROM sarafan_posts_search s JOIN sarafan_posts p ON p.rowid = s.rowid "
+                          "WHERE sarafan_posts_search MATCH '2024'").fetchone()[0] == bytes.fromhex(f'{2024:064x}')
+        db.execute("DELETE FROM sarafan_posts WHERE magnet = ?", [bytes.fromhex(f'{2024:064x}')])
+        assert db.execute("SELECT COUNT(*) FROM sarafan_posts_search WHERE sarafan_posts_search MATCH '2024'"
+                          ).fetchone()[0] == 0
+    db.close()
@@ -0,0 +1,106 @@
+from dataclasses import dataclass, field
+from typing import Callable, List, Tuple
+
+import pytest
+
+from sarafan.ethereum.block_range import BlockRange
+
+
+@dataclass
+class SimulatedNode:
+    """Deterministic node model serving logs of the block range.
+    """
+    #: number of logs in the block
+    density: Callable[[int], float]
+    #: seconds per request
+    overhead: float = 0.05
+    #: seconds per block scanned
+    block_time: float = 0.0001
+    #: seconds per log returned
+    log_time: float = 0.001
+    #: node refuses ranges with more logs
+    result_limit: int = 10000
+
+    def logs(self, from_block: int, to_block: int) -> int:
+        return int(sum(self.density(block) for block in range(from_block, to_block + 1)))
+
+    def response_time(self, from_block: int, to_block: int, logs: int) -> float:
+        return self.overhead + (to_block - from_block + 1) * self.block_time + logs * self.log_time
+
+
+@dataclass
+class Replay:
+    #: (from_block, to_block, seconds, logs) of served ranges
+    served: List[Tuple[int, int, float, int]] = field(default_factory=list)
+    #: ranges refused by the node
+    refused: List[Tuple[int, int]] = field(default_factory=list)
+
+
+def replay(block_range: BlockRange, node: SimulatedNode) -> Replay:
+    """Fetch the whole block range sequentially recording node responses.
+    """
+    result = Replay()
+    for from_block, to_block in block_range:
+        logs = node.logs(from_block, to_block)
+        if logs > node.result_limit:
+            result.refused.append((from_block, to_block))
+            block_range.record_result_limit(from_block, to_block)
+            block_range.retry()
+            continue
+        t = node.response_time(from_block, to_block, logs)
+        result.served.append((from_block, to_block, t, logs))
+        block_range.record(from_block, to_block, t, logs)
+    return result
+
+
+def assert_covered(result: Replay, from_block: int, to_block: int, reverse: bool = False):
+    windows = sorted((start, end) for start, end, _, _ in result.served)
+    assert windows[0][0] == from_block and windows[-1][1] == to_block
+    assert all(prev[1] + 1 == window[0] for prev, window in zip(windows, windows[1:]))
+    starts = [start for start, _, _, _ in result.served]
+    assert starts == sorted(starts, reverse=reverse)
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_block_range_retry(reverse):
+    block_range = BlockRange(from_block=0, to_block=99, start_size=40, reverse=reverse)
+    windows = iter(block_range)
+    first = next(windows)
+    block_range.retry()
+    second = next(windows)
+    # the same range is repeated from the same edge with the half size
+    assert second[1 if reverse else 0] == first[1 if reverse else 0]
+    assert second[1] - second[0] + 1 == 20
+    assert next(windows) == ((20, 39) if not reverse else (60, 79))
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_block_range_converges(reverse):
+    node = SimulatedNode(density=lambda block: 0.01)
+    block_range = BlockRange(from_block=0, to_block=10_000_000, start_size=100,
+                             max_size=10_000_000, target_time=10.0, reverse=reverse)
+    result = replay(block_range, node)
+    assert_covered(result, 0, 10_000_000, reverse)
+    assert not result.refused
+    # the largest range served within 10 seconds is ~98000 blocks
+    sizes = [end - start + 1 for start, end, _, _ in result.served]
+    assert len(sizes) < 200
+    assert all(t <= 10.0 for _, _, t, _ in result.served)
+    assert max(sizes[10:]) > 50000
+
+
+def test_block_range_dense_region():
+    # dense region of 50 logs per block, 10000 logs limit fits 200 blocks
+    node = SimulatedNode(density=lambda block: 50 if 200_000 <= block < 210_000 else 0.001)
+    block_range = BlockRange(from_block=0, to_block=1_000_000, start_size=1000,
+                             max_size=1_000_000, region_size=10000)
+    result = replay(block_range, node)
+    assert_covered(result, 0, 1_000_000)
+    # refused ranges are halved down to the dense region size, windows are narrowed there only
+    assert len(result.refused) <= 10
+    assert all(start < 210_000 and end >= 200_000 for start, end in result.refused)
+    assert all(logs <= node.result_limit for _, _, _, logs in result.served)
+    dense = [end - start + 1 for start, end, _, _ in result.served if 200_000 <= start < 210_000]
+    assert max(dense) <= 200
+    after = [end - start + 1 for start, end, _, _ in result.served if start >= 220_000]
+    assert max(after) > 10000
@@ -0,0 +1,50 @@
+from sarafan.contract.abi import CONTENT_CONTRACT, PEERING_CONTRACT
+from sarafan.ethereum import Contract, Event
+from sarafan.events import NewPeer, Publication
+
+
+def make_event(contract_event, log_index=0):
+    return Event(log_index=log_index,
+                 block_number=1,
+                 block_hash='0x' + '00' * 32,
+                 transaction_hash=f'0x{log_index:064x}',
+                 transaction_index=log_index,
+                 address='0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7',
+                 data=contract_event.data(),
+                 topics=contract_event.topics())
+
+
+def test_decode_plan():
+    plan = Publication.get_decode_plan()
+    # plan is built once and not shared with other event classes
+    assert Publication.get_decode_plan() is plan
+    assert NewPeer.get_decode_plan() is not plan
+    assert plan.indexed_names == ('reply_to', 'magnet')
+    assert plan.data_names == ('source', 'size', 'retention')
+    assert Publication.get_signature_hash() == plan.signature_hash
+
+
+def test_parse_many():
+    abi = CONTENT_CONTRACT['abi'] + [item for item in PEERING_CONTRACT['abi'] if item.get('name') == 'NewPeer']
+    contract = Contract(
+        address='0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7',
+        abi=abi,
+        event_classes={'Publication': Publication, 'NewPeer': NewPeer},
+    )
+    expected = [
+        Publication(reply_to='00' * 32, magnet='01' * 32,
+                    source='0xd5e64d2103a265ece8e0aff188f9549df6e70a20', size=10, retention=12),
+        NewPeer(addr='0xd5e64d2103a265ece8e0aff188f9549df6e70a20', hostname='example.onion'),
+        Publication(reply_to='01' * 32, magnet='02' * 32,
+                    source='0xd5e64d2103a265ece8e0aff188f9549df6e70a20', size=20, retention=12),
+    ]
+    encoded = [
+        Publication(reply_to=bytes.fromhex(pub.reply_to), magnet=bytes.fromhex(pub.magnet),
+                    source=pub.source, size=pub.size, retention=pub.retention)
+        if isinstance(pub, Publication) else
+        NewPeer(addr=pub.addr, hostname=pub.hostname.encode('ascii'))
+        for pub in expected
+    ]
+    events = [make_event(contract_event, i) for i, contract_event in enumerate(encoded)]
+    assert contract.parse_many(events) == expected
+    assert [contract.parse(event) for event in events] == expected
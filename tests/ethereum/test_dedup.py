@@ -0,0 +1,43 @@
+from sarafan.ethereum import Event
+from sarafan.ethereum.dedup import EventDeduplicator
+
+
+def make_event(block_number, log_index=0, transaction_hash='0x01', block_hash=None):
+    return Event(log_index=log_index,
+                 block_number=block_number,
+                 block_hash=block_hash or f'0x{block_number:064x}',
+                 transaction_hash=transaction_hash,
+                 transaction_index=0,
+                 address='0x49Da5D877830AA2534b3C6701e2fF6bA655C6Ab7',
+                 data='0x',
+                 topics=[])
+
+
+def test_multiple_logs_of_transaction():
+    dedup = EventDeduplicator()
+    events = [make_event(1, log_index=0), make_event(1, log_index=1)]
+    assert dedup.reconcile(1, 1, events).new == events
+    assert dedup.reconcile(1, 1, events).new == []
+
+
+def test_reorg():
+    dedup = EventDeduplicator()
+    kept, replaced, later = make_event(1), make_event(2, transaction_hash='0x02'), make_event(5)
+    dedup.reconcile(1, 5, [kept, replaced, later])
+    # transaction of block 2 is included in the other block 2
+    moved = make_event(2, transaction_hash='0x02', block_hash='0x' + 'ff' * 32)
+    result = dedup.reconcile(1, 3, [kept, moved])
+    assert result.fork_block == 2
+    # all events since the fork are retracted, the latest first
+    assert result.retracted == [later, replaced]
+    assert result.new == [moved]
+
+
+def test_finalize():
+    dedup = EventDeduplicator()
+    for block_number in range(1000):
+        dedup.reconcile(block_number, block_number, [make_event(block_number)])
+        dedup.finalize(block_number - 12)
+    # only events of not finalized blocks are kept
+    assert len(dedup) == 12
+    assert dedup.reconcile(0, 999, [make_event(b) for b in range(1000)]).new == []
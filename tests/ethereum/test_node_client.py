@@ -0,0 +1,187 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from sarafan.ethereum import EthereumNodeClient
+from sarafan.ethereum.exceptions import EthereumNodeException, FilterNotFound
+
+
+def respond(bodies, results):
+    """Build batch response in reversed order from results by method name.
+    """
+    return [
+        {"jsonrpc": "2.0", "id": body["id"], **results[body["method"]]}
+        for body in reversed(bodies)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_request_ids():
+    client = EthereumNodeClient()
+    with mock.patch.object(client, "_post", return_value={"jsonrpc": "2.0", "id": 1, "result": "0x10"}) as post_mock:
+        assert await client.block_number() == 16
+        assert await client.block_number() == 16
+    assert [c[0][0]["id"] for c in post_mock.call_args_list] == [1, 2]
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_batch():
+    client = EthereumNodeClient()
+    results = {
+        "eth_gasPrice": {"result": "0x3b9aca00"},
+        "eth_getTransactionCount": {"result": "0x7"},
+        "eth_call": {"error": {"code": -32000, "message": "Filter not found"}},
+    }
+
+    async def post(bodies):
+        return respond(bodies, results)
+
+    with mock.patch.object(client, "_post", side_effect=post) as post_mock:
+        async with client.batch() as batch:
+            gas_price = batch.gas_price()
+            nonce = batch.get_transaction_count("0xd5e64d2103A265ece8E0afF188F9549Df6E70A20", "pending")
+            changes = batch.call({"to": "0xd5e64d2103A265ece8E0afF188F9549Df6E70A20", "data": "0x"})
+    post_mock.assert_called_once()
+    # calls are added in the call order
+    assert [body["method"] for body in post_mock.call_args[0][0]] == [
+        "eth_gasPrice", "eth_getTransactionCount", "eth_call",
+    ]
+    assert gas_price.result() == 1000000000
+    assert nonce.result() == 7
+    # error of the single call doesn't affect other calls
+    with pytest.raises(FilterNotFound):
+        await changes
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_batch_failed():
+    client = EthereumNodeClient()
+    with mock.patch.object(client, "_post", return_value={"jsonrpc": "2.0", "id": None,
+                                                          "error": {"message": "Batch requests are disabled"}}):
+        async with client.batch() as batch:
+            gas_price = batch.gas_price()
+    with pytest.raises(EthereumNodeException):
+        gas_price.result()
+
+    with mock.patch.object(client, "_post") as post_mock:
+        with pytest.raises(RuntimeError):
+            async with client.batch() as batch:
+                gas_price = batch.gas_price()
+                raise RuntimeError()
+        async with client.batch():
+            pass
+    # nothing is sent for interrupted and empty batches
+    post_mock.assert_not_called()
+    assert gas_price.cancelled()
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_keep_alive_session():
+    peers = set()
+
+    async def handler(request):
+        peers.add(request.transport.get_extra_info('peername'))
+        body = await request.json()
+        return web.json_response({"jsonrpc": "2.0", "id": body["id"], "result": hex(body["id"])})
+
+    app = web.Application()
+    app.router.add_post('/', handler)
+    async with TestServer(app) as server:
+        client = EthereumNodeClient(str(server.make_url('/')), connections_limit=1)
+        assert [await client.block_number() for _ in range(3)] == [1, 2, 3]
+        # all requests are sent through the single pooled connection
+        assert len(peers) == 1
+        await client.close()
+    assert client.closed
+    with pytest.raises(EthereumNodeException):
+        await client.block_number()
+
+
+def node_app(block_number=1, delay=0.0, calls=None):
+    """Node serving block number and call results with the delay.
+    """
+    async def handler(request):
+        body = await request.json()
+        if calls is not None:
+            calls.append(body["method"])
+        await asyncio.sleep(delay)
+        result = hex(block_number) if body["method"] != "eth_sendRawTransaction" else "0xbeef"
+        return web.json_response({"jsonrpc": "2.0", "id": body["id"], "result": result})
+
+    app = web.Application()
+    app.router.add_post('/', handler)
+    return app
+
+
+@pytest.mark.asyncio
+async def test_endpoints_routing():
+    lagging_calls, synced_calls = [], []
+    async with TestServer(node_app(block_number=90, calls=lagging_calls)) as lagging, \
+            TestServer(node_app(block_number=100, calls=synced_calls)) as synced:
+        dead_url = 'http://127.0.0.1:1/'
+        client = EthereumNodeClient([dead_url, str(lagging.make_url('/')), str(synced.make_url('/'))])
+        dead, lagging_endpoint, synced_endpoint = client.pool.endpoints
+
+        # dead endpoint is skipped and marked unhealthy
+        assert await client.block_number() == 90
+        assert not dead.healthy
+
+        await client.check_health()
+        assert lagging_endpoint.block_number == 90 and synced_endpoint.block_number == 100
+        assert client.pool.read_endpoints() == [synced_endpoint, lagging_endpoint, dead]
+        synced_calls.clear()
+        assert await client.block_number() == 100
+        assert synced_calls == ["eth_blockNumber"]
+
+        # transactions are pinned to the first healthy endpoint
+        lagging_calls.clear()
+        assert await client.send_raw_transaction("0x00") == "0xbeef"
+        assert await client.send_raw_transaction("0x00") == "0xbeef"
+        assert lagging_calls == ["eth_sendRawTransaction"] * 2
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_hedged_reads():
+    slow_calls, fast_calls = [], []
+    async with TestServer(node_app(delay=0.5, calls=slow_calls)) as slow, \
+            TestServer(node_app(calls=fast_calls)) as fast:
+        client = EthereumNodeClient([str(slow.make_url('/')), str(fast.make_url('/'))])
+        slow_endpoint, fast_endpoint = client.pool.endpoints
+        # slow endpoint looked fast before
+        for _ in range(20):
+            slow_endpoint.record("eth_call", 0.01)
+        fast_endpoint.record("eth_call", 0.02)
+
+        loop = asyncio.get_event_loop()
+        started_at = loop.time()
+        assert await client.call({"to": "0xd5e64d2103A265ece8E0afF188F9549Df6E70A20", "data": "0x"}) == "0x1"
+        assert loop.time() - started_at < 0.4
+        assert slow_calls == ["eth_call"] and fast_calls == ["eth_call"]
+        # time of the cancelled slow request is recorded too
+        assert len(slow_endpoint.samples["eth_call"]) == 21
+        assert slow_endpoint.samples["eth_call"][-1] >= 0.01
+
+        # not hedged methods wait for the response
+        started_at = loop.time()
+        assert await client.block_number() == 1
+        assert loop.time() - started_at >= 0.5
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_endpoint_recovery():
+    async with TestServer(node_app(block_number=5)) as node:
+        client = EthereumNodeClient(str(node.make_url('/')))
+        endpoint, = client.pool.endpoints
+        client.pool.fail(endpoint, RuntimeError())
+        # successful request restores single endpoint health
+        assert await client.block_number() == 5
+        assert endpoint.healthy
+        await client.close()
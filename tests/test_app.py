@@ -1,34 +1,39 @@
 import asyncio
-from unittest.mock import patch, call
+from unittest.mock import patch
 
 import pytest
 
-from sarafan.app import Application
+from sarafan.app import Application, is_reply
+from sarafan.events import DownloadFinished
 
+from .factories import PublicationFactory
 from .utils import generate_rnd_address
 
 
+async def empty_chain_post(body):
+    """Respond to node requests as a node of the growing chain without events.
+    """
+    result = [] if body["method"] == "eth_getLogs" else hex(body["id"])
+    return {"jsonrpc": "2.0", "id": body["id"], "result": result}
+
+
 @pytest.mark.asyncio
-@patch("sarafan.app.ContractService._resolve_contract_address")
+@patch("sarafan.app.ContractService._resolve_contract_addresses",
+       return_value=[generate_rnd_address(), generate_rnd_address()])
 async def test_app_simple(resolve_mock):
     app = Application()
     await app.start()
-    resolve_mock.assert_has_calls([
-        call('getContentContract'),
-        call('getPeeringContract')
-    ])
+    resolve_mock.assert_called_once_with('getContentContract', 'getPeeringContract')
     await app.stop()
 
 
 @pytest.mark.asyncio
-@patch("sarafan.contract.service.ContractService._resolve_contract_address",
-       return_value=generate_rnd_address())
-@patch("sarafan.contract.service.EthereumNodeClient.get_logs", return_value=[])
-@patch("sarafan.contract.service.EthereumNodeClient.block_number", side_effect=[0, 1, 2, 3, 4, 5, 6, 7])
+@patch("sarafan.contract.service.ContractService._resolve_contract_addresses",
+       return_value=[generate_rnd_address(), generate_rnd_address()])
+@patch("sarafan.contract.service.EthereumNodeClient._post", side_effect=empty_chain_post)
 async def test_process_new_publications(
     resolve_mock,
-    get_logs_mock,
-    block_number_mock,
+    post_mock,
     rnd_address,
     rnd_hash
 ):
@@ -40,3 +45,31 @@ async def test_process_new_publications(
     await asyncio.sleep(0)
     assert app.running
     await app.stop()
+
+
+def test_is_reply():
+    assert not is_reply('0x')
+    assert not is_reply('00' * 32)
+    assert is_reply(f'{1:064x}')
+
+
+@pytest.mark.asyncio
+@patch("sarafan.app.HiddenServiceController")
+async def test_process_reply_before_parent(controller_mock, tmp_path):
+    app = Application(argv=["sarafan", "--db", str(tmp_path / "db.sqlite"),
+                            "--content-path", str(tmp_path / "content")])
+    await app.db.start()
+    post = PublicationFactory()
+    comment = PublicationFactory(reply_to=post.magnet)
+    reply = PublicationFactory(reply_to=comment.magnet)
+    for publication in (post, comment, reply):
+        app.render_cache.put(publication.magnet, publication.magnet)
+        app.storage.get_unpack_path(publication.magnet).mkdir(parents=True)
+    # downloads are finished in any order
+    for publication in (reply, post, comment):
+        await app.process_finished_downloads(DownloadFinished(publication=publication))
+    assert await app.db.posts.get(post.magnet)
+    assert await app.db.posts.get(reply.magnet) is None
+    thread, _ = await app.db.comments.replies(post.magnet)
+    assert [(c.magnet, c.depth) for c in thread] == [(comment.magnet, 0), (reply.magnet, 1)]
+    await app.db.stop()
@@ -0,0 +1,112 @@
+import dataclasses
+import json
+import zipfile
+from unittest import mock
+
+import pytest
+
+from sarafan.bundle.bundle import ContentBundle, BundleLimitExceeded, UnsafeBundleContent
+from sarafan.bundle.cache import RenderCache
+
+
+def make_bundle(path, entries, compression=zipfile.ZIP_DEFLATED):
+    with zipfile.ZipFile(path, 'w', compression=compression) as archive:
+        for name, content in entries.items():
+            archive.writestr(name, content)
+    return path
+
+
+def test_render_content_json(tmp_path):
+    bundle_path = make_bundle(tmp_path / 'bundle.zip', {
+        'content.json': json.dumps({'version': '1.0', 'text': 'hello'}),
+    })
+    with ContentBundle(bundle_path, 'r') as bundle:
+        assert bundle.render_markdown() == 'hello'
+
+
+def test_extract_allowed_names_only(tmp_path):
+    bundle_path = make_bundle(tmp_path / 'bundle.zip', {
+        'content.json': json.dumps({'version': '1.0', 'index': 'index.md'}),
+        'index.md': '# title',
+        'image.png': b'\x89PNG',
+        'script.sh': 'rm -rf /',
+    })
+    with ContentBundle(bundle_path, 'r') as bundle:
+        assert bundle.render_markdown() == '# title'
+        bundle.extractall(tmp_path / 'unpacked')
+        # strict mode is validated again after non-strict rendering
+        with pytest.raises(UnsafeBundleContent):
+            bundle.extractall(tmp_path / 'strict', strict=True)
+    extracted = {p.name for p in (tmp_path / 'unpacked').iterdir()}
+    assert extracted == {'index.md', 'image.png'}
+    assert not (tmp_path / 'strict').exists()
+
+
+def test_reject_path_traversal(tmp_path):
+    bundle_path = make_bundle(tmp_path / 'bundle.zip', {
+        '../index.md': 'escape',
+    })
+    with ContentBundle(bundle_path, 'r') as bundle:
+        with pytest.raises(UnsafeBundleContent):
+            bundle.extractall(tmp_path / 'unpacked')
+    assert not (tmp_path / 'index.md').exists()
+
+
+def test_reject_too_many_entries(tmp_path):
+    bundle_path = make_bundle(tmp_path / 'bundle.zip', {
+        f'{i}.md': 'x' for i in range(ContentBundle.limits.max_entries + 1)
+    })
+    with ContentBundle(bundle_path, 'r') as bundle:
+        with pytest.raises(BundleLimitExceeded):
+            bundle.validate()
+    # limits are tuned for the single bundle only
+    limits = dataclasses.replace(ContentBundle.limits, max_entries=ContentBundle.limits.max_entries + 1)
+    with ContentBundle(bundle_path, 'r', limits=limits) as bundle:
+        bundle.validate()
+    assert ContentBundle.limits.max_entries == limits.max_entries - 1
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        ContentBundle.limits.max_entries = 0
+
+
+def test_reject_zip_bomb(tmp_path):
+    bundle_path = make_bundle(tmp_path / 'bundle.zip', {
+        'content.json': json.dumps({'version': '1.0', 'index': 'index.md'}),
+        'index.md': b'\x00' * (ContentBundle.limits.ratio_threshold + 1),
+    })
+    with ContentBundle(bundle_path, 'r') as bundle:
+        with pytest.raises(BundleLimitExceeded):
+            bundle.render_markdown()
+
+
+def test_render_cache(tmp_path, rnd_hash):
+    magnet = rnd_hash()[2:]
+    bundle_path = make_bundle(tmp_path / 'bundle.zip', {
+        'content.json': json.dumps({'version': '1.0', 'text': 'cached'}),
+    })
+    cache = RenderCache(max_size=1, path=tmp_path / 'rendered', html_renderer=str.upper)
+    assert cache.get(magnet) is None
+    with ContentBundle(bundle_path, 'r') as bundle:
+        rendered = cache.render(magnet, bundle)
+    assert rendered.markdown == 'cached'
+    assert rendered.html == 'CACHED'
+
+    with mock.patch.object(ContentBundle, 'render_markdown') as render_mock:
+        with ContentBundle(bundle_path, 'r') as bundle:
+            assert cache.render(magnet, bundle).markdown == 'cached'
+        render_mock.assert_not_called()
+
+    # entry should be evicted from memory and restored from disk
+    cache.put('0' * 64, 'other')
+    assert len(cache) == 1
+    with mock.patch.object(cache, '_load', wraps=cache._load) as load_mock:
+        assert cache.get(magnet) == rendered
+        load_mock.assert_called_once_with(magnet)
+        # restored entry is kept in memory
+        assert cache.get(magnet) == rendered
+        load_mock.assert_called_once()
+        # and evicts the other one
+        assert cache.get('0' * 64).markdown == 'other'
+        assert load_mock.call_count == 2
+    assert len(cache) == 1
+    assert cache.hits == 4
+    assert cache.misses == 2
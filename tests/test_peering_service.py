@@ -37,6 +37,15 @@ async def test_add_peer(peering):
     assert peer in peers_list
 
 
+@pytest.mark.asyncio
+async def test_add_peers(peering):
+    await peering.add_peers([Peer(service_id=f'bulkpeer{i}', rating=i / 100) for i in range(MAX_PEERS * 2)])
+    assert len(peering.peers) == MAX_PEERS
+    assert [p.service_id for p in peering.peers_by_rating] == [
+        f'bulkpeer{i}' for i in range(MAX_PEERS, MAX_PEERS * 2)
+    ]
+
+
 @pytest.mark.asyncio
 async def test_remove_peer(peering):
     peer = Peer(service_id='removepeer1')